@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2024 Tobias Koch <tobias.koch@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+# Copies a generated tree of small files with CopyFiles, once the way the
+# pool was fed before, with the whole task pickled along with every item,
+# and once through the scheduler. Run from the top of the source tree:
+#
+#   PYTHONPATH=lib python3 benchmarks/copyfiles_ipc.py [num_files] [num_proc]
+
+import logging
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+import time
+
+from multiprocessing import Pool
+
+from snazzy.copyfiles import CopyFiles
+from snazzy.output import SiteDirectory
+
+class UnscheduledCopyFiles(CopyFiles):
+
+    # The entry list goes to the workers with every job, like it used to.
+    def __getstate__(self):
+        return self.__dict__.copy()
+
+    def execute(self, worker_pool: Pool) -> None:
+        worker_pool.map(self._process_entry, self._objects, chunksize=1)
+
+#end class
+
+def create_tree(basedir: str, num_files: int) -> list[str]:
+    entries = []
+
+    for i in range(num_files):
+        entry = "/static/files/{:03d}/file-{:05d}.txt".format(i // 500, i)
+        srcfile = basedir + entry
+
+        os.makedirs(os.path.dirname(srcfile), exist_ok=True)
+        with open(srcfile, "w", encoding="utf-8") as f:
+            f.write("file {}\n".format(i))
+
+        entries.append(entry)
+    #end for
+
+    return entries
+#end function
+
+def run(task_class: type, basedir: str, entries: list[str],
+        num_proc: int) -> tuple[float, int]:
+    sitedir = os.path.join(basedir, "_site")
+
+    output = SiteDirectory(sitedir)
+    output.begin()
+
+    task = task_class(basedir, sitedir, output=output)
+    for entry in entries:
+        task.add_object(entry)
+
+    job_size = len(pickle.dumps(task._process_entry))
+
+    start = time.monotonic()
+    with Pool(processes=num_proc) as pool:
+        task.execute(pool)
+    duration = time.monotonic() - start
+
+    output.discard()
+
+    return duration, job_size
+#end function
+
+def main() -> None:
+    num_files = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    num_proc  = int(sys.argv[2]) if len(sys.argv) > 2 else \
+        (os.cpu_count() or 2)
+
+    logging.disable(logging.INFO)
+
+    basedir = tempfile.mkdtemp(prefix="snazzy-bench-")
+    cwd = os.getcwd()
+
+    try:
+        # The scheduler keeps its duration history below the project.
+        os.chdir(basedir)
+
+        entries = create_tree(basedir, num_files)
+
+        print("{} files, {} processes".format(num_files, num_proc))
+
+        for label, task_class in [("task per item", UnscheduledCopyFiles),
+                ("worker context", CopyFiles)]:
+            duration, job_size = run(task_class, basedir, entries, num_proc)
+            print(
+                "{:<16} {:8.2f}s  {:>10} bytes pickled task".format(
+                    label, duration, job_size
+                )
+            )
+        #end for
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(basedir)
+    #end try
+#end function
+
+if __name__ == "__main__":
+    main()
@@ -24,114 +24,392 @@
 #
 
 import functools
+import hashlib
 import logging
 import os
-import shutil
 import sys
-import tempfile
+import threading
 
+from collections import OrderedDict
 from multiprocessing.pool import Pool
 from multiprocessing.pool import ThreadPool
+from urllib.parse import urljoin, urlparse, urlunparse
 
 from lxml import etree
 from tidylib import tidy_document
 
-from snazzy.task import Task
+from snazzy.criticalcss import CriticalCss
+from snazzy.css import rebase_urls
+from snazzy.error import BuildCancelled, SnazzyError
+from snazzy.resourcehints import ResourceHints
+from snazzy.serviceworker import ServiceWorker
+from snazzy.sizereport import SizeReport, measure
+from snazzy.task import Task, module_script_name
+from snazzy.toolrunner import cancel, cancelled, keep_going, record_error
+from snazzy.component import Component
 from snazzy.componentmaker import ComponentMaker
 
 LOGGER = logging.getLogger(__name__)
 
 class AppMaker(Task):
 
+    # Apps are mostly waiting for the pool workers, so there may be more of
+    # them than processes.
+    MAX_APP_THREADS = 8
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._omitted_vendor_modules = []
+
+    def omit_vendor_module(self, module_name: str) -> None:
+        self._omitted_vendor_modules.append(module_name)
+
     def execute(self, worker_pool: Pool) -> None:
-        partial_generate_app = functools.partial(
-            self._generate_app, worker_pool=worker_pool
+        self.start(worker_pool)
+        for entry in self._objects:
+            self.submit(entry)
+        self.set_assets_ready()
+        self.finish()
+    #end function
+
+    def start(self, worker_pool: Pool) -> None:
+        self._shared_lock   = threading.Lock()
+        self._shared        = None
+        self._shared_bundle = None
+
+        self._assets_ready = threading.Event()
+        self._app_pool = ThreadPool(self.MAX_APP_THREADS)
+        self._pending  = []
+
+        self._generate = functools.partial(
+            self._generate_app_or_fail,
+                worker_pool=worker_pool, size_report=SizeReport()
         )
+    #end function
 
-        with ThreadPool(len(self._objects)) as pool:
-            pool.map(partial_generate_app, self._objects)
+    def submit(self, entry: str) -> None:
+        # The bundles of an app are built right away, the page itself once
+        # the assets it refers to are in place.
+        self._pending.append(
+            self._app_pool.apply_async(self._generate, (entry,))
+        )
     #end function
 
-    def _generate_app(self, entry, worker_pool) -> None:
-        LOGGER.info("building SPA at {}".format(os.path.dirname(entry)))
+    def set_assets_ready(self) -> None:
+        self._assets_ready.set()
 
-        srcfile = os.path.normpath(
-            os.sep.join([self._basedir, entry])
+    def finish(self) -> None:
+        try:
+            for result in self._pending:
+                result.get()
+        finally:
+            self._app_pool.terminate()
+        #end try
+
+        if self._pending:
+            self._finish_size_report(self._generate.keywords["size_report"])
+    #end function
+
+    def abort(self) -> None:
+        # Apps that are still running stop at their next tool call, write
+        # or while waiting for the assets, the build is cancelled by now.
+        # They must be done before the output is discarded.
+        for result in self._pending:
+            result.wait()
+        self._app_pool.terminate()
+    #end function
+
+    def _wait_for_assets(self) -> None:
+        while not self._assets_ready.wait(0.1):
+            if cancelled():
+                raise BuildCancelled("build cancelled")
+    #end function
+
+    def _finish_size_report(self, size_report: SizeReport) -> None:
+        json_file, _ = size_report.write(self._state_path("reports"))
+
+        LOGGER.info(
+            "wrote bundle size report to {}"
+            .format(os.path.relpath(json_file, self._basedir))
         )
 
-        dstfile = os.path.normpath(
-            os.sep.join([self._sitedir, entry])
+        violations = size_report.check_budgets(
+            self._config.get("budgets", {})
         )
 
-        srcdir = os.path.dirname(srcfile)
-        dstdir = os.path.dirname(dstfile)
+        for message in violations:
+            LOGGER.error("size budget exceeded: {}".format(message))
 
-        os.makedirs(dstdir, exist_ok=True)
+        if violations:
+            raise SnazzyError(
+                "{} size budget(s) exceeded".format(len(violations))
+            )
+    #end function
+
+    def _generate_app_or_fail(self, entry, worker_pool,
+            size_report: SizeReport | None = None) -> None:
+        try:
+            self._generate_app(entry, worker_pool, size_report)
+        except BuildCancelled:
+            raise
+        except Exception as e:
+            if not keep_going():
+                # Stops the other apps right away.
+                cancel(e)
+                raise
+
+            message = "{}: {}".format(entry, str(e))
+            LOGGER.error(message)
+            record_error(message)
+        #end try
+    #end function
+
+    def _generate_app(self, entry, worker_pool,
+            size_report: SizeReport | None = None) -> None:
+        app = os.path.dirname(entry)
+
+        LOGGER.info("building SPA at {}".format(app))
+
+        srcfile = os.path.normpath(
+            os.sep.join([self._basedir, entry])
+        )
+
+        dstpath = self._site_path(entry)
+        dstdir  = os.path.dirname(dstpath)
+        srcdir  = os.path.dirname(srcfile)
 
         appdir = os.path.join(srcdir, "+app")
         appjs  = os.path.join(srcdir, "+app.js")
 
         component_maker = ComponentMaker(
-            self._basedir, self._sitedir, self._debug, self._prefix
+            self._basedir, self._sitedir, self._debug, self._prefix,
+                config=self._config, output=self._output,
+                opt_level=self._opt_level
         )
+        component_maker.set_usage_index(self._usage_index)
 
         for dirpath, _, filenames in os.walk(appdir):
             for entry in filenames:
                 if entry.endswith(".xml"):
                     component_maker.add_object(os.path.join(dirpath, entry))
 
-        all_components = component_maker.execute(worker_pool)
+        shared = self._shared_components(worker_pool)
+        all_components = component_maker.execute(worker_pool, shared)
+
+        # When the library is shipped as a bundle of its own, the app
+        # bundle only contains the components of the app itself.
+        uses_shared_bundle = False
+
+        if self._shared_bundle:
+            app_components = [
+                c for c in all_components if shared.get(c.name) is not c
+            ]
+            uses_shared_bundle = len(app_components) < len(all_components)
+            all_components = app_components
+        #end if
+
+        component_sizes = []
 
-        with tempfile.TemporaryDirectory() as tmpdir:
-            tmpjs  = os.path.join(tmpdir, "app.js")
-            tmpcss = os.path.join(tmpdir, "app.css")
+        js_parts  = []
+        css_parts = []
 
-            for component in all_components:
-                template   = component.template
-                script     = component.script
-                stylesheet = component.style
+        modern_js_parts = []
 
-                with open(tmpjs, "a+", encoding="utf-8") as f:
-                    f.write(template)
-                    f.write(script)
+        for component in all_components:
+            template   = component.template
+            script     = component.script
+            stylesheet = component.style
 
-                with open(tmpcss, "a+", encoding="utf-8") as f:
-                    f.write(stylesheet)
-            #end for
+            js_parts.append(template)
+            js_parts.append(script)
+            css_parts.append(stylesheet)
 
-            with open(appjs, "r", encoding="utf-8") as f:
-                script = self._convert_js_in_memory(f.read())
-            with open(tmpjs, "a+", encoding="utf-8") as f:
-                f.write(script)
-            with open(tmpcss, "a+", encoding="utf-8"):
-                pass
+            modern_js_parts.append(component.modern_template or "")
+            modern_js_parts.append(component.modern_script or "")
 
-            appjs = os.path.join(
-                dstdir, "app.js" if self._debug else "app-{}.js"
-                    .format(self._prefix)
+            component_sizes.append({
+                "name": component.name,
+                "template": measure(
+                    component.raw_sizes.get("template", 0), template),
+                "script": measure(
+                    component.raw_sizes.get("script", 0), script),
+                "style": measure(
+                    component.raw_sizes.get("style", 0), stylesheet)
+            })
+        #end for
+
+        with open(appjs, "r", encoding="utf-8") as f:
+            raw_script = f.read()
+            script = self._convert_js_in_memory(raw_script)
+        js_parts.append(script)
+
+        differential = self._script_targets() is not None
+
+        if differential:
+            modern_js_parts.append(
+                self._convert_js_in_memory(raw_script, "modern")
             )
 
-            appcss = os.path.join(
-                dstdir, "app.css" if self._debug else "app-{}.css"
-                    .format(self._prefix)
+        component_sizes.append({
+            "name": "+app.js",
+            "template": measure(0, None),
+            "script": measure(len(raw_script.encode("utf-8")), script),
+            "style": measure(0, None)
+        })
+
+        appjs_name  = "app.js" if self._debug else \
+            "app-{}.js".format(self._prefix)
+        appcss_name = "app.css" if self._debug else \
+            "app-{}.css".format(self._prefix)
+
+        bundles = {
+            appjs_name:
+                "".join(js_parts),
+            appcss_name:
+                "".join(css_parts)
+        }
+
+        if not self._debug:
+            bundles[appjs_name] = self._obfuscate_js(
+                bundles[appjs_name], toplevel=True
+            )
+            bundles[appcss_name] = self._optimize_css(bundles[appcss_name])
+        #end if
+
+        if differential:
+            bundles[module_script_name(appjs_name)] = self._obfuscate_js(
+                "".join(modern_js_parts), module=True
             )
 
-            shutil.move(tmpjs,  appjs)
-            shutil.move(tmpcss, appcss)
+        bundle_sizes = {}
 
-            if not self._debug:
-                self._obfuscate_js(appjs, appjs)
+        for name, content in bundles.items():
+            self._write(
+                "/".join(filter(None, [dstdir, name])), content
+            )
+            bundle_sizes[name] = \
+                measure(len(content.encode("utf-8")), content)
+        #end for
+
+        if size_report is not None:
+            size_report.add_app(app, bundle_sizes, component_sizes)
+
+        self._wait_for_assets()
+
+        self._process_html(srcfile, dstpath, bundles,
+            self._shared_bundle if uses_shared_bundle else None)
+    #end function
+
+    def _shared_components(self, worker_pool: Pool) \
+            -> dict[str, Component]:
+        shared_dir = self._config.get("shared_components")
+        if not shared_dir:
+            return {}
+
+        # Apps are built concurrently, the first one to get here compiles
+        # the library for all of them.
+        with self._shared_lock:
+            if self._shared is None:
+                self._shared = self._compile_shared_components(
+                    shared_dir, worker_pool
+                )
         #end with
 
-        self._process_html(srcfile, dstfile)
+        return self._shared
+    #end function
+
+    def _compile_shared_components(self, shared_dir: str,
+            worker_pool: Pool) -> dict[str, Component]:
+        srcdir = os.path.normpath(
+            os.sep.join([self._basedir, shared_dir])
+        )
+
+        if not os.path.isdir(srcdir):
+            raise SnazzyError(
+                "shared component directory {} not found".format(shared_dir)
+            )
+
+        LOGGER.info("building shared components at {}".format(shared_dir))
+
+        component_maker = ComponentMaker(
+            self._basedir, self._sitedir, self._debug, self._prefix,
+                config=self._config, output=self._output,
+                opt_level=self._opt_level
+        )
+        component_maker.set_usage_index(self._usage_index)
+
+        for dirpath, _, filenames in os.walk(srcdir):
+            for entry in sorted(filenames):
+                if entry.endswith(".xml"):
+                    component_maker.add_object(os.path.join(dirpath, entry))
+
+        components = component_maker.execute(worker_pool)
+
+        if self._config.get("shared_bundle"):
+            self._shared_bundle = self._write_shared_bundle(components)
+
+        return OrderedDict((c.name, c) for c in components)
+    #end function
+
+    def _write_shared_bundle(self, components: list[Component]) \
+            -> tuple[str, str]:
+        script = "".join(c.template + c.script for c in components)
+        style  = self._optimize_css("".join(c.style for c in components))
+
+        digest = hashlib.sha256(
+            (script + style).encode("utf-8")
+        ).hexdigest()[:8]
+
+        # The app bundles use the classes of the shared components, which
+        # only works with globals. There is no module build of it, just as
+        # for the scripts under /static.
+        outputs = [("js", script), ("css", style)]
+
+        urls = []
+
+        for ext, content in outputs:
+            if ext == "js":
+                content = self._obfuscate_js(content) \
+                    if not self._debug else content
+
+            path = self._site_path(
+                "/static/shared-{}.{}".format(digest, ext)
+            )
+            self._write(path, content)
+            urls.append("/" + path)
+        #end for
+
+        return urls[0], urls[1]
     #end function
 
-    def _process_html(self, srcfile: str, dstfile: str) -> None:
+    def _process_html(self, srcfile: str, dstpath: str,
+            bundles: dict[str, str] | None = None,
+            shared_bundle: tuple[str, str] | None = None) -> None:
         with open(srcfile, "r", encoding="utf-8") as f:
             tree = etree.parse(f, parser=etree.HTMLParser())
 
         root = tree.getroot()
         self._apply_static_asset_prefix(root)
+        self._remove_omitted_vendor_scripts(root)
+
+        if self._config.get("image_hints"):
+            self._add_image_hints(
+                root, "/" + os.path.relpath(os.path.dirname(srcfile),
+                    self._basedir).replace(os.sep, "/")
+            )
+        #end if
+
+        if shared_bundle:
+            self._link_shared_bundle(root, bundles or {}, shared_bundle)
+        if self._script_targets():
+            self._add_module_scripts(root, bundles or {})
+
+        if self._config.get("resource_hints"):
+            self._add_resource_hints(root, dstpath, bundles or {})
+        if self._config.get("critical_css") and not self._debug:
+            self._inline_critical_css(root, dstpath, bundles or {})
+        if self._config.get("service_worker"):
+            self._add_service_worker_registration(root, dstpath)
 
         html_str = "<!DOCTYPE html>\n" + \
             etree.tostring(root, encoding="unicode", method="html",
@@ -161,8 +439,259 @@ class AppMaker(Task):
         if tidy_errors:
             sys.stderr.write(tidy_errors)
 
-        with open(dstfile, "w+", encoding="utf-8") as f:
-            f.write(tidy_str)
+        self._write(dstpath, tidy_str)
+    #end function
+
+    def _write(self, path: str, data: str) -> None:
+        # Apps are built in threads of the main process, which go on after
+        # another job failed, until they get here.
+        if cancelled():
+            raise BuildCancelled("build cancelled")
+        self._output.write(path, data)
+    #end function
+
+    def _remove_omitted_vendor_scripts(self, root: etree.Element) -> None:
+        omitted = [
+            "{}.js".format(module) for module in self._omitted_vendor_modules
+        ]
+
+        for script in root.xpath("//script[@src]"):
+            src = urlparse(script.get("src")).path
+
+            if "/ext/js/" not in src or os.path.basename(src) not in omitted:
+                continue
+
+            previous = script.getprevious()
+            parent = script.getparent()
+
+            if script.tail:
+                if previous is not None:
+                    previous.tail = (previous.tail or "") + script.tail
+                else:
+                    parent.text = (parent.text or "") + script.tail
+            #end if
+
+            parent.remove(script)
+        #end for
+    #end function
+
+    def _link_shared_bundle(self, root: etree.Element,
+            bundles: dict[str, str], shared_bundle: tuple[str, str]) -> None:
+        shared_js, shared_css = shared_bundle
+
+        for element in root.xpath("//script[@src] | //link[@href]"):
+            attr_name = "src" if element.tag == "script" else "href"
+            name = os.path.basename(urlparse(element.get(attr_name)).path)
+
+            if name not in bundles:
+                continue
+
+            if element.tag == "script" and name.endswith(".js"):
+                shared = etree.Element("script", src=shared_js)
+            elif element.tag == "link" and name.endswith(".css"):
+                shared = etree.Element(
+                    "link", rel="stylesheet", href=shared_css
+                )
+            else:
+                continue
+
+            shared.tail = element.tail
+            element.addprevious(shared)
+        #end for
+    #end function
+
+    def _add_module_scripts(self, root: etree.Element,
+            bundles: dict[str, str]) -> None:
+        # Only the app bundles have a module build. No other script uses
+        # their top-level names, which are not globals in a module.
+        for script in root.xpath("//script[@src]"):
+            if script.get("type") == "module" or \
+                    script.get("nomodule") is not None:
+                continue
+
+            url = urlparse(script.get("src"))
+            if url.scheme or url.netloc or not url.path.endswith(".js"):
+                continue
+
+            module_path = module_script_name(url.path)
+
+            if os.path.basename(module_path) not in bundles:
+                continue
+
+            # Browsers that understand type="module" skip the nomodule
+            # script and vice versa.
+            module = etree.Element(
+                "script", type="module",
+                    src=urlunparse(url._replace(path=module_path))
+            )
+            module.tail = script.tail
+            script.addprevious(module)
+            script.set("nomodule", "nomodule")
+        #end for
+    #end function
+
+    def _add_service_worker_registration(self, root: etree.Element,
+            dstpath: str) -> None:
+        body = root.find("body")
+        if body is None:
+            return
+
+        script = etree.SubElement(body, "script")
+        script.text = ServiceWorker.registration_script("/" + dstpath)
+    #end function
+
+    def _add_resource_hints(self, root: etree.Element, dstpath: str,
+            bundles: dict[str, str]) -> None:
+        settings = self._config.get("resource_hints")
+        if not isinstance(settings, dict):
+            settings = {}
+
+        app_bundles = [
+            name for name in bundles if name.endswith(".js")
+        ] or ["app.js"]
+
+        stylesheets = {
+            link.get("href"): css for link, css in
+                self._local_stylesheets(root, dstpath, bundles)
+        }
+
+        ResourceHints(app_bundles, settings.get("max_images", 4)) \
+            .apply(root, stylesheets)
+    #end function
+
+    def _inline_critical_css(self, root: etree.Element, dstpath: str,
+            bundles: dict[str, str]) -> None:
+        settings = self._config.get("critical_css")
+        if not isinstance(settings, dict):
+            settings = {}
+
+        head = root.find("head")
+        if head is None:
+            return
+
+        # Relative URLs in the stylesheets would resolve against the page
+        # once the rules are inlined.
+        stylesheets = [
+            (link, rebase_urls(css, urljoin("/" + dstpath, link.get("href"))))
+                for link, css in
+                    self._local_stylesheets(root, dstpath, bundles)
+                        if link.getparent() is head and
+                            link.get("media", "all") in ["all", "screen"]
+        ]
+
+        if not stylesheets:
+            return
+
+        critical = self._extract_critical_css(
+            root, [css for _, css in stylesheets],
+                settings.get("max_elements", 150)
+        )
+
+        max_size = settings.get("max_size", 14 * 1024)
+
+        # Above that, the page would not render any sooner.
+        if len(critical.encode("utf-8")) > max_size:
+            LOGGER.warning(
+                "critical CSS of {} exceeds {} bytes, not inlining it"
+                .format(dstpath, max_size)
+            )
+            return
+        #end if
+
+        style = etree.Element("style")
+        style.text = critical
+        stylesheets[0][0].addprevious(style)
+        style.tail = stylesheets[0][0].tail
+
+        hrefs = [link.get("href") for link, _ in stylesheets]
+
+        # Preload hints for the stylesheets are superseded by the
+        # stylesheets themselves.
+        for link in list(head.iter("link")):
+            if link.get("rel") == "preload" and link.get("href") in hrefs:
+                head.remove(link)
+
+        for link, _ in stylesheets:
+            noscript = etree.Element("noscript")
+            etree.SubElement(
+                noscript, "link", rel="stylesheet", href=link.get("href")
+            )
+            noscript.tail = link.tail
+            link.addnext(noscript)
+
+            link.set("rel", "preload")
+            link.set("as", "style")
+            link.set("onload", "this.onload=null;this.rel='stylesheet'")
+        #end for
+    #end function
+
+    def _extract_critical_css(self, root: etree.Element,
+            stylesheets: list[str], max_elements: int) -> str:
+        page = etree.tostring(root, encoding="unicode", method="html")
+
+        # The static prefix changes with the sources, the cache key must
+        # not.
+        def normalize(text: str) -> str:
+            return text.replace(self._prefix, "##PREFIX##") \
+                if self._prefix else text
+        #end function
+
+        key = hashlib.sha256()
+        for text in [str(max_elements), page, *stylesheets]:
+            key.update(hashlib.sha256(
+                normalize(text).encode("utf-8")).digest())
+
+        cache_file = os.path.join(
+            self._state_path("cache", "critical"), key.hexdigest() + ".css"
+        )
+
+        if os.path.exists(cache_file):
+            with open(cache_file, "r", encoding="utf-8") as f:
+                critical = f.read()
+        else:
+            extractor = CriticalCss(max_elements)
+            critical = normalize(
+                "".join(extractor.extract(root, css) for css in stylesheets)
+            )
+
+            os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+            tmp_file = "{}.{}.tmp".format(cache_file, threading.get_ident())
+            with open(tmp_file, "w", encoding="utf-8") as f:
+                f.write(critical)
+            os.replace(tmp_file, cache_file)
+        #end if
+
+        return critical.replace("##PREFIX##", self._prefix)
+    #end function
+
+    def _local_stylesheets(self, root: etree.Element, dstpath: str,
+            bundles: dict[str, str]) -> list[tuple[etree.Element, str]]:
+        page_url = "/" + dstpath
+        stylesheets = []
+
+        for link in root.iter("link"):
+            href = link.get("href")
+            if not href or "stylesheet" not in link.get("rel", "").split():
+                continue
+
+            url = urlparse(href)
+            if url.scheme or url.netloc:
+                continue
+
+            name = os.path.basename(url.path)
+
+            if name in bundles:
+                stylesheets.append((link, bundles[name]))
+                continue
+
+            # Global stylesheets have been compiled by CopyFiles already.
+            css = self._output.read(urljoin(page_url, url.path))
+
+            if css is not None:
+                stylesheets.append((link, css.decode("utf-8")))
+        #end for
+
+        return stylesheets
     #end function
 
 #end class
@@ -75,6 +75,7 @@ class SnazzyCli:
 
           prepare
           make
+          daemon
           clean
           distclean
           new
@@ -170,14 +171,48 @@ class SnazzyCli:
 
         OPTIONS:
 
-          --debug    Don't mangle and optimize CSS and JavaScript in any way.
-          -j <num>   Number of processes to use for parallel processing.
+          --debug          Don't mangle and optimize CSS and JavaScript in any
+                           way.
+          -j <num>         Number of processes to use for parallel processing.
+          --only <pattern> Only build the pages and assets that match the
+                           given gitignore style pattern, e.g. "blog/" or
+                           "static/css/*.scss". A page is rebuilt as well when
+                           a file of its app matches. Everything else in _site
+                           is left as it is. May be given more than once.
+          --keep-going     Build as much as possible after an error and report
+                           all errors at the end. By default, the build stops
+                           at the first error.
+          -O <level>       Optimization level of production builds:
+                             0  transpile scripts only
+                             1  also minify with babel
+                             2  also compress and mangle with terser
+                                (default)
+                             3  multiple terser passes with pure_getters
+                                and unsafe, top-level mangling of the app
+                                bundle and removal of empty and duplicate
+                                CSS rules
+          -o, --output <path>
+                           Write the site to the given directory or archive
+                           instead of _site. Archives are detected by their
+                           extension (.zip, .tar, .tar.gz, .tgz, .tar.bz2 or
+                           .tar.xz) and are written without staging the site
+                           on disk.
+          --no-daemon      Build in this process, even if a build daemon is
+                           running (see 'snazzy daemon --help').
+
+          When invoked from a parallel GNU make, snazzy takes a job token from
+          the make jobserver for every tool invocation, so that the overall
+          number of jobs stays within the limit given to make.
 
         """
         )
 
         try:
-            opts, args = getopt.getopt(args, "hj:", ["help", "debug"])
+            opts, args = getopt.getopt(
+                args, "hj:o:O:",
+                    ["help", "debug", "keep-going", "no-daemon", "only=",
+                        "output="]
+            )
         except getopt.GetoptError as e:
             raise InvocationError(
                 "error parsing command line: {}".format(str(e))
@@ -185,17 +220,25 @@ class SnazzyCli:
 
         options = {
             "debug":
-                False,
-            "num_proc":
-                os.cpu_count() or 2
+                False
         }
 
+        # The daemon cannot take tokens from the jobserver of a make that
+        # it is not a child of.
+        use_daemon = "--jobserver" not in os.environ.get("MAKEFLAGS", "")
+
         for o, v in opts:
             if o in ["-h", "--help"]:
                 sys.stdout.write(usage)
                 sys.exit(SnazzyCli.EXIT_OK)
             elif o == "--debug":
                 options["debug"] = True
+            elif o == "--no-daemon":
+                use_daemon = False
+            elif o == "--keep-going":
+                options["keep_going"] = True
+            elif o == "--only":
+                options.setdefault("only", []).append(v)
             elif o == "-j":
                 try:
                     options["num_proc"] = int(v)
@@ -204,6 +247,14 @@ class SnazzyCli:
                         "invalid argument to -j: {}".format(v)
                     )
                 #end try
+            elif o == "-O":
+                if v not in ["0", "1", "2", "3"]:
+                    raise InvocationError(
+                        "invalid optimization level: {}".format(v)
+                    )
+                options["opt_level"] = int(v)
+            elif o in ["-o", "--output"]:
+                options["output"] = os.path.abspath(v)
             #end ifs
         #end for
 
@@ -212,9 +263,103 @@ class SnazzyCli:
                 "garbage at end of command line"
             )
 
+        if use_daemon:
+            from snazzy.daemon import forward_make
+
+            succeeded = forward_make(options)
+
+            if succeeded is not None:
+                if not succeeded:
+                    sys.exit(SnazzyCli.EXIT_ERR)
+                return
+            #end if
+        #end if
+
+        options.setdefault("num_proc", os.cpu_count() or 2)
+
+        if "output" in options:
+            from snazzy.output import open_output
+            options["output"] = open_output(options["output"])
+
         SiteMaker().make(**options)
     #end function
 
+    @classmethod
+    def daemon(cls, *args: list[str]) -> None:
+        usage = SnazzyCli.COPYRIGHT + textwrap.dedent(
+        """\
+          This command runs a build daemon for the project in the current
+          directory. While it is running, 'snazzy make' hands builds over to
+          it, which saves the startup of the interpreter and the worker
+          pool, and reuses tool output from earlier builds. The daemon
+          starts afresh when .gitignore, .snazzyignore, .babelrc,
+          package.json, package-lock.json or snazzy.json change.
+
+        USAGE:
+
+          snazzy daemon [options]
+
+        OPTIONS:
+
+          -h, --help       Show this help text.
+          -j <num>         Number of processes to use for parallel processing.
+          --idle-timeout <seconds>
+                           Exit after this many seconds without a build
+                           (default: 1800).
+
+        """
+        )
+
+        try:
+            opts, args = getopt.getopt(
+                args, "hj:", ["help", "idle-timeout="]
+            )
+        except getopt.GetoptError as e:
+            raise InvocationError(
+                "error parsing command line: {}".format(str(e))
+            )
+
+        num_proc = os.cpu_count() or 2
+        idle_timeout = None
+
+        for o, v in opts:
+            if o in ["-h", "--help"]:
+                sys.stdout.write(usage)
+                sys.exit(SnazzyCli.EXIT_OK)
+            elif o == "-j":
+                try:
+                    num_proc = int(v)
+                except ValueError:
+                    raise InvocationError(
+                        "invalid argument to -j: {}".format(v)
+                    )
+                #end try
+            elif o == "--idle-timeout":
+                try:
+                    idle_timeout = float(v)
+                except ValueError:
+                    raise InvocationError(
+                        "invalid argument to --idle-timeout: {}".format(v)
+                    )
+                #end try
+            #end if
+        #end for
+
+        if len(args) > 0:
+            raise InvocationError(
+                "garbage at end of command line"
+            )
+
+        # The daemon needs multiprocessing, which is not worth loading just
+        # to print the usage.
+        from snazzy.daemon import BuildDaemon, DEFAULT_IDLE_TIMEOUT
+
+        if idle_timeout is None:
+            idle_timeout = DEFAULT_IDLE_TIMEOUT
+
+        BuildDaemon(num_proc, idle_timeout).serve()
+    #end function
+
     @classmethod
     def clean(cls, *args: list[str]) -> None:
         usage = SnazzyCli.COPYRIGHT + textwrap.dedent(
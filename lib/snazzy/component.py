@@ -88,13 +88,19 @@ class Component:
         template: str | None = None,
         script: str | None = None,
         style: str | None = None,
-        dependencies: list[str] = []
+        dependencies: list[str] = [],
+        raw_sizes: dict[str, int] | None = None,
+        modern_template: str | None = None,
+        modern_script: str | None = None
     ):
         self.name = name
         self.template = template
         self.script = script
         self.style = style
         self.dependencies = dependencies
+        self.raw_sizes = raw_sizes or {}
+        self.modern_template = modern_template
+        self.modern_script = modern_script
     #end function
 
     def generate(self):
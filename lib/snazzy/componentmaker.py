@@ -23,33 +23,53 @@
 # THE SOFTWARE.
 #
 
+import hashlib
 import os
+import re
 import subprocess
+import textwrap
 
 from collections import OrderedDict
+from html import escape as html_escape
 from multiprocessing.pool import Pool
 
 from lxml import etree
 
+from snazzy.error import SnazzyError
+from snazzy.jobserver import job_slot
+from snazzy.schedule import run_longest_first
 from snazzy.task import Task
 from snazzy.component import Component
 
+SCOPE_ATTR_PREFIX = "data-css-scope-"
+
+# Elements whose whitespace is rendered as it is.
+PRESERVE_WHITESPACE = ["pre", "script", "style", "textarea"]
+
 class ComponentMaker(Task):
 
-    def execute(self, worker_pool: Pool) -> list[Component]:
+    def execute(self, worker_pool: Pool,
+            library: dict[str, Component] | None = None) -> list[Component]:
+        # With --keep-going, components that failed come back as None.
         component_by_name = {
-            c.name: c for c in worker_pool.map(
-                self.process_component_xml_safety_wrapper, self._objects
-            )
+            c.name: c for c in run_longest_first(
+                worker_pool, self.process_component_xml_safety_wrapper,
+                self._objects, self._objects, "components"
+            ) if c is not None
         }
 
+        if library is None:
+            library = {}
+
         dependencies = OrderedDict()
 
+        # Components from the library are only linked in if one of the own
+        # components depends on them, own components take precedence.
         for component in component_by_name.values():
             if component.name in dependencies:
                 continue
             self._resolve_dependencies(
-                component, component_by_name, dependencies, []
+                component, component_by_name, dependencies, [], library
             )
         #end for
 
@@ -61,7 +81,8 @@ class ComponentMaker(Task):
         component: Component,
         component_by_name: dict[str, Component],
         dependencies: dict[str, Component],
-        dependency_stack: list[str] = []
+        dependency_stack: list[str] = [],
+        library: dict[str, Component] = {}
     ) -> None:
         for dependency in component.dependencies:
             if dependency not in dependencies:
@@ -72,11 +93,22 @@ class ComponentMaker(Task):
                         )
                     )
 
+                dependency_component = component_by_name.get(
+                    dependency, library.get(dependency)
+                )
+
+                if dependency_component is None:
+                    raise ValueError(
+                        "component {} depends on unknown component {}"
+                        .format(component.name, dependency)
+                    )
+
                 self._resolve_dependencies(
-                    component_by_name[dependency],
+                    dependency_component,
                     component_by_name,
                     dependencies,
-                    dependency_stack + [dependency]
+                    dependency_stack + [dependency],
+                    library
                 )
         #end for
 
@@ -85,7 +117,10 @@ class ComponentMaker(Task):
 
     def process_component_xml_safety_wrapper(self, srcfile: str) -> Component:
         try:
-            return self._process_component_xml(srcfile)
+            with job_slot():
+                return self._process_component_xml(srcfile)
+        except SnazzyError:
+            raise
         except Exception as e:
             raise RuntimeError(str(e))
     #end function
@@ -95,6 +130,12 @@ class ComponentMaker(Task):
         script     = ""
         stylesheet = ""
 
+        raw_sizes = {}
+
+        differential = self._script_targets() is not None
+        modern_template = ""
+        modern_script   = ""
+
         dependencies = []
 
         tree = etree.parse(srcfile)
@@ -115,40 +156,255 @@ class ComponentMaker(Task):
         script_node   = root.find("script")
         style_node    = root.find("style")
 
+        scope_classes = {}
+
         if template_node is not None:
-            handlebars = "".join(
-                etree.tostring(child, encoding="unicode", method="html")
-                    for child in template_node
+            if self._config.get("prerender_markdown"):
+                self._prerender_markdown(template_node)
+
+            scope_classes = self._replace_scope_attributes(
+                component_name, template_node,
+                    script_node.text if script_node is not None else None
             )
+            if self._config.get("image_hints"):
+                self._add_image_hints(template_node)
 
-            # TODO: find a better solution for this.
-            handlebars = handlebars\
-                .replace("%7B%7B", "{{")\
-                .replace("%7D%7D", "}}")
+            handlebars = self._serialize_template(template_node)
+
+            raw_sizes["template"] = len(handlebars.encode("utf-8"))
 
             cmd = ["./node_modules/.bin/handlebars", "--name",
                     component_name, "-i", "-"]
 
-            result = subprocess.run(cmd, input=handlebars, check=True,
+            if not self._debug:
+                cmd += self._handlebars_options(template_node)
+
+                if self._opt_level >= 1:
+                    self._collapse_whitespace(template_node)
+                    handlebars = self._serialize_template(template_node)
+                #end if
+            #end if
+
+            result = self._run_tool(cmd, input=handlebars,
                 stdout=subprocess.PIPE, universal_newlines=True)
 
-            template = self._convert_js_in_memory(result.stdout)
+            # Precompiled templates are ES5 already. From -O2 on, terser
+            # minifies the bundle they go into, babel has nothing to add.
+            if self._opt_level >= 2:
+                template = result.stdout
+                modern_template = result.stdout
+            else:
+                template = self._convert_js_in_memory(result.stdout)
+                if differential:
+                    modern_template = \
+                        self._convert_js_in_memory(result.stdout, "modern")
+            #end if
         #end if
 
         if script_node is not None:
+            raw_sizes["script"] = len(
+                (script_node.text or "").encode("utf-8")
+            )
             script = \
                 self._convert_js_in_memory(script_node.text)
+            if differential:
+                modern_script = \
+                    self._convert_js_in_memory(script_node.text, "modern")
 
         if style_node is not None:
+            raw_sizes["style"] = len(
+                (style_node.text or "").encode("utf-8")
+            )
             stylesheet = \
                 self._convert_scss_in_memory(style_node.text)
+            stylesheet = \
+                self._replace_scope_selectors(stylesheet, scope_classes)
+            stylesheet = \
+                self._prune_css(stylesheet, set(scope_classes.values()))
 
         return Component(
             component_name,
             template=template,
             script=script,
             style=stylesheet,
-            dependencies=dependencies
+            dependencies=dependencies,
+            raw_sizes=raw_sizes,
+            modern_template=modern_template if differential else None,
+            modern_script=modern_script if differential else None
+        )
+    #end function
+
+    def _serialize_template(self, template_node: etree.Element) -> str:
+        # Text in front of the first element, e.g. from a Markdown block
+        # that was rendered there. Indentation is left out as before.
+        text = template_node.text or ""
+        if not text.strip():
+            text = ""
+
+        handlebars = html_escape(text, quote=False) + "".join(
+            etree.tostring(child, encoding="unicode", method="html")
+                for child in template_node
+        )
+
+        # TODO: find a better solution for this.
+        return handlebars\
+            .replace("%7B%7B", "{{")\
+            .replace("%7D%7D", "}}")
+    #end function
+
+    def _handlebars_options(self, template_node: etree.Element) -> list[str]:
+        # A template that declares its helpers gets direct calls instead of
+        # lookups in the context, and no @data if it does not use it.
+        options = []
+
+        known_helpers = template_node.get("known-helpers", "")
+
+        for helper in known_helpers.replace(",", " ").split():
+            options += ["-k", helper]
+        if template_node.get("known-helpers-only") == "true":
+            options.append("-o")
+        if template_node.get("data") == "false":
+            options.append("--no-data")
+
+        return options
+    #end function
+
+    def _collapse_whitespace(self, template_node: etree.Element) -> None:
+        # Runs of whitespace render as one space, except in preformatted
+        # elements. Non-breaking spaces are left alone.
+        def collapse(text: str | None) -> str | None:
+            if not text:
+                return text
+            return re.sub(r"[ \t\n\r\f]+", " ", text)
+        #end function
+
+        def visit(element: etree.Element, preserve: bool) -> None:
+            for child in element:
+                is_element = isinstance(child.tag, str)
+                keep = preserve or (is_element and
+                    child.tag.lower() in PRESERVE_WHITESPACE)
+
+                if is_element and not keep:
+                    child.text = collapse(child.text)
+                if is_element:
+                    visit(child, keep)
+                if not preserve:
+                    child.tail = collapse(child.tail)
+            #end for
+        #end function
+
+        visit(template_node, False)
+    #end function
+
+    def _prerender_markdown(self, template_node: etree.Element) -> None:
+        blocks = list(template_node.iter("markdown"))
+        if not blocks:
+            return
+
+        rendered = self._convert_markdown_in_memory(
+            [textwrap.dedent(block.text or "").strip() for block in blocks]
+        )
+
+        for block, html in zip(blocks, rendered):
+            wrapper = etree.fromstring(
+                "<div>{}</div>".format(html), parser=etree.HTMLParser()
+            ).find(".//div")
+
+            parent = block.getparent()
+            index  = parent.index(block)
+
+            # Text in front of the first rendered element has to be attached
+            # to the preceding sibling or to the parent.
+            leading_text = (wrapper.text or "") if len(wrapper) else \
+                (wrapper.text or "") + (block.tail or "")
+
+            if index > 0:
+                previous = parent[index - 1]
+                previous.tail = (previous.tail or "") + leading_text
+            else:
+                parent.text = (parent.text or "") + leading_text
+
+            children = list(wrapper)
+            if children:
+                children[-1].tail = (children[-1].tail or "") + \
+                    (block.tail or "")
+
+            parent.remove(block)
+
+            for offset, child in enumerate(children):
+                parent.insert(index + offset, child)
+        #end for
+    #end function
+
+    def _replace_scope_attributes(self, component_name: str,
+            template_node: etree.Element, script: str | None) \
+                -> dict[str, str]:
+        scope_classes = {}
+
+        elements = [
+            element for element in template_node.iter()
+                if isinstance(element.tag, str)
+        ]
+
+        # A class stands in for the presence of the attribute only. Where
+        # the attribute has a value, styles may select by it, so the
+        # attribute stays wherever it is used.
+        valued = set(
+            attr_name for element in elements
+                for attr_name, value in element.attrib.items()
+                    if attr_name.startswith(SCOPE_ATTR_PREFIX) and value
+        )
+
+        for element in elements:
+            for attr_name in list(element.attrib):
+                if not attr_name.startswith(SCOPE_ATTR_PREFIX):
+                    continue
+
+                # Scripts may select elements by their scope attribute, in
+                # which case the attribute has to stay.
+                if script and attr_name in script:
+                    continue
+                if attr_name in valued:
+                    continue
+
+                scope = attr_name[len(SCOPE_ATTR_PREFIX):]
+
+                if scope not in scope_classes:
+                    digest = hashlib.sha1(
+                        "{}:{}".format(component_name, scope)
+                            .encode("utf-8")
+                    ).hexdigest()
+                    scope_classes[scope] = "s" + digest[:6]
+                #end if
+
+                del element.attrib[attr_name]
+
+                classes = element.get("class", "").split()
+                classes.append(scope_classes[scope])
+                element.set("class", " ".join(classes))
+            #end for
+        #end for
+
+        return scope_classes
+    #end function
+
+    def _replace_scope_selectors(self, css: str,
+            scope_classes: dict[str, str]) -> str:
+        if not scope_classes:
+            return css
+
+        def replace_selector(m: re.Match) -> str:
+            scope_class = scope_classes.get(m.group(1))
+            if scope_class is None:
+                return m.group(0)
+            return "." + scope_class
+        #end function
+
+        return re.sub(
+            r"\[" + re.escape(SCOPE_ATTR_PREFIX) +
+                r"([\w-]+)(?:=(?:\"\"|''))?\]",
+            replace_selector,
+            css
         )
     #end function
 
@@ -0,0 +1,68 @@
+# -*- encoding: utf-8 -*-
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2024 Tobias Koch <tobias.koch@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+import json
+import os
+
+from typing import Any
+
+from snazzy.error import SnazzyError
+
+# Project-local directory for reports, caches and build state. It starts
+# with an underscore, so it is never picked up as a source of the site.
+STATE_DIR = "_snazzy"
+
+class Config:
+
+    FILENAME = "snazzy.json"
+
+    def __init__(self, settings: dict[str, Any] | None = None):
+        self._settings = settings or {}
+
+    @classmethod
+    def load(cls, filename: str = FILENAME) -> "Config":
+        if not os.path.exists(filename):
+            return cls()
+
+        try:
+            with open(filename, "r", encoding="utf-8") as f:
+                settings = json.load(f)
+        except (OSError, ValueError) as e:
+            raise SnazzyError(
+                "failed to load {}: {}".format(filename, str(e))
+            )
+
+        if not isinstance(settings, dict):
+            raise SnazzyError(
+                "{} must contain a JSON object".format(filename)
+            )
+
+        return cls(settings)
+    #end function
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self._settings.get(key, default)
+
+#end class
@@ -25,50 +25,136 @@
 
 import logging
 import os
-import shutil
 
 from multiprocessing.pool import Pool
+from typing import TYPE_CHECKING
+
+from snazzy.jobserver import job_slot
+from snazzy.output import WriteBuffer
+from snazzy.schedule import StreamingRun
 from snazzy.task import Task
 
+if TYPE_CHECKING:
+    from snazzy.usage import UsageIndex
+
 LOGGER = logging.getLogger(__name__)
 
 class CopyFiles(Task):
 
-    def execute(self, worker_pool: Pool) -> None:
-        worker_pool.map(self._process_entry, self._objects)
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stream = None
+        self._markdown_entries = []
+    #end function
 
-    def _process_entry(self, entry: str) -> None:
-        LOGGER.info("processing {}".format(entry))
+    def __getstate__(self) -> dict:
+        state = super().__getstate__()
+        state["_stream"] = None
+        state["_markdown_entries"] = []
+        return state
+    #end function
+
+    def execute(self, worker_pool: Pool) -> None:
+        self.start(worker_pool)
+        for entry in self._objects:
+            self.submit(entry)
+        self.finish()
+    #end function
 
-        srcfile = os.path.normpath(
-            os.sep.join([self._basedir, entry])
+    def start(self, worker_pool: Pool) -> None:
+        self._markdown_entries = []
+        self._stream = StreamingRun(
+            worker_pool, self._process_entry, self._srcfile, "copyfiles"
         )
+    #end function
 
-        if entry.startswith("/static/"):
-            entry = "/static/" + self._prefix + entry[len("/static"):]
+    def submit(self, entry: str) -> None:
+        # Entries go to the workers while the tree is still being walked.
+        # Markdown is rendered in one go at the end.
+        if entry.endswith(".md"):
+            self._markdown_entries.append(entry)
+        else:
+            self._stream.submit(entry)
+    #end function
 
-        destdir = os.path.normpath(
-            os.sep.join([self._sitedir, os.path.dirname(entry)])
-        )
+    def finish(self) -> None:
+        results = self._stream.finish()
+        self._stream = None
 
-        os.makedirs(destdir, exist_ok=True)
+        if self._markdown_entries:
+            self._prerender_markdown_files(self._markdown_entries)
 
-        if entry.endswith(".scss"):
-            dstfile = os.path.normpath(
-                os.sep.join([self._sitedir, entry[:-4] + "css"])
-            )
-            self._convert_scss(srcfile, dstfile)
+        for writes in results:
+            for path, data, mtime in writes or []:
+                self._output.write(path, data, mtime=mtime)
+        #end for
+    #end function
+
+    def set_usage_index(self, usage_index: "UsageIndex") -> None:
+        super().set_usage_index(usage_index)
 
+        # Workers only see the index in chunks that are sent from now on.
+        if self._stream is not None:
+            self._stream.reset_context()
+    #end function
+
+    def _prerender_markdown_files(self, entries: list[str]) -> None:
+        sources = []
+
+        for entry in entries:
+            LOGGER.info("processing {}".format(entry))
+
+            with open(self._srcfile(entry), "r", encoding="utf-8") as f:
+                sources.append(f.read())
+        #end for
+
+        with job_slot():
+            rendered = self._convert_markdown_in_memory(sources)
+
+        for entry, html in zip(entries, rendered):
+            self._output.write(self._site_path(entry[:-2] + "html"), html)
+    #end function
+
+    def _process_entry(self, entry: str) \
+            -> list[tuple[str, bytes, float | None]] | None:
+        with job_slot():
+            if self._output.WORKER_WRITES:
+                self._copy_entry(entry)
+                return None
+
+            # The output lives in the parent process, so the results are
+            # collected here and passed back.
+            output, self._output = self._output, WriteBuffer()
+            try:
+                self._copy_entry(entry)
+                return self._output.writes
+            finally:
+                self._output = output
+        #end with
+    #end function
+
+    def _copy_entry(self, entry: str) -> None:
+        LOGGER.info("processing {}".format(entry))
+
+        srcfile = self._srcfile(entry)
+
+        if entry.endswith(".scss"):
+            self._convert_scss(srcfile, self._site_path(entry[:-4] + "css"))
         elif entry.endswith(".js"):
-            dstfile = os.path.normpath(
-                os.sep.join([self._sitedir, entry])
+            self._convert_js(srcfile, self._site_path(entry))
+        elif entry.endswith(".css") and self._usage_index is not None \
+                and not self._debug:
+            with open(srcfile, "r", encoding="utf-8") as f:
+                css = f.read()
+            self._output.write(
+                self._site_path(entry),
+                self._optimize_css(self._prune_css(css))
             )
-            self._convert_js(srcfile, dstfile)
-            if not self._debug:
-                self._obfuscate_js(dstfile, dstfile)
-
         else:
-            shutil.copy2(srcfile, destdir)
+            self._output.copy(srcfile, self._site_path(entry))
     #end function
 
+    def _srcfile(self, entry: str) -> str:
+        return os.path.normpath(os.sep.join([self._basedir, entry]))
+
 #end class
@@ -0,0 +1,120 @@
+# -*- encoding: utf-8 -*-
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2024 Tobias Koch <tobias.koch@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+from lxml import etree
+
+from snazzy.css import Statement, NESTING_AT_RULES, key_selector, parse, \
+    selector_tokens, serialize, split_selectors
+
+# Elements that never render anything themselves.
+SKIPPED_TAGS = ["noscript", "script", "style", "template"]
+
+class CriticalCss:
+
+    def __init__(self, max_elements: int = 150):
+        self._max_elements = max_elements
+
+    def extract(self, root: etree.Element, css: str) -> str:
+        # The first elements of the body in document order stand in for
+        # what is visible above the fold.
+        signatures = [self._signature(root)]
+
+        body = root.find("body")
+        if body is not None:
+            signatures.append(self._signature(body))
+
+            count = 0
+
+            for element in body.iterdescendants():
+                if not isinstance(element.tag, str) or \
+                        element.tag in SKIPPED_TAGS:
+                    continue
+                if count >= self._max_elements:
+                    break
+
+                signatures.append(self._signature(element))
+                count += 1
+            #end for
+        #end if
+
+        return serialize(self._select(parse(css), signatures))
+    #end function
+
+    def _select(self, statements: list[Statement],
+            signatures: list[set[tuple[str, str]]]) -> list[Statement]:
+        result = []
+
+        for statement in statements:
+            at_keyword = statement.at_keyword
+
+            if statement.block is None:
+                continue
+
+            # Fonts are needed by whatever text is styled above the fold.
+            if at_keyword == "@font-face":
+                result.append(statement)
+                continue
+
+            if at_keyword is not None:
+                if at_keyword not in NESTING_AT_RULES or \
+                        at_keyword.endswith("keyframes"):
+                    continue
+
+                nested = self._select(parse(statement.block), signatures)
+                if nested:
+                    result.append(
+                        Statement(statement.prelude, serialize(nested))
+                    )
+                continue
+            #end if
+
+            for selector in split_selectors(statement.prelude):
+                tokens = set(selector_tokens(key_selector(selector)))
+
+                if any(tokens <= signature for signature in signatures):
+                    result.append(statement)
+                    break
+            #end for
+        #end for
+
+        return result
+    #end function
+
+    def _signature(self, element: etree.Element) -> set[tuple[str, str]]:
+        signature = {("tag", element.tag.lower())}
+
+        for attr_name, value in element.attrib.items():
+            signature.add(("attribute", attr_name.lower()))
+
+            if attr_name == "class":
+                signature.update(("class", name) for name in value.split())
+            elif attr_name == "id":
+                signature.add(("id", value))
+        #end for
+
+        return signature
+    #end function
+
+#end class
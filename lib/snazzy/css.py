@@ -0,0 +1,630 @@
+# -*- encoding: utf-8 -*-
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2024 Tobias Koch <tobias.koch@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+# A small CSS reader that is just good enough to work on the compiled output
+# of sass. It splits a stylesheet into statements, i.e. rules with a block
+# and at-rules terminated by a semicolon. Selectors are only looked into as
+# far as needed to tell which classes, ids, tags and attributes they refer
+# to. Declarations are only looked into for the colors and numbers that
+# minify shortens.
+
+import re
+
+from typing import Callable
+from urllib.parse import urljoin, urlparse
+
+# At-rules whose block holds rules rather than declarations.
+NESTING_AT_RULES = [
+    "@-moz-document",
+    "@-moz-keyframes",
+    "@-webkit-keyframes",
+    "@container",
+    "@document",
+    "@keyframes",
+    "@layer",
+    "@media",
+    "@scope",
+    "@supports",
+]
+
+class Statement:
+
+    def __init__(self, prelude: str, block: str | None = None):
+        # For "a{color:red}", prelude is "a" and block is "color:red". For
+        # "@import 'x';", prelude is "@import 'x'" and block is None.
+        self.prelude = prelude
+        self.block = block
+
+    @property
+    def at_keyword(self) -> str | None:
+        m = re.match(r"@[-\w]+", _strip_comments(self.prelude).strip())
+        return m.group(0).lower() if m else None
+
+    @property
+    def has_nested_rules(self) -> bool:
+        return self.block is not None and \
+            self.at_keyword in NESTING_AT_RULES
+
+    def to_css(self) -> str:
+        if self.block is not None:
+            return self.prelude + "{" + self.block + "}"
+        # A trailing comment is kept as it is.
+        if not _strip_comments(self.prelude).strip():
+            return self.prelude
+        return self.prelude + ";"
+    #end function
+
+#end class
+
+def parse(css: str) -> list[Statement]:
+    statements = []
+
+    start = 0
+    depth = 0
+    prelude_end = None
+    i = 0
+
+    while i < len(css):
+        c = css[i]
+
+        if c in "\"'":
+            i = _skip_string(css, i)
+            continue
+        if css.startswith("/*", i):
+            end = css.find("*/", i + 2)
+            i = len(css) if end == -1 else end + 2
+            continue
+
+        if c == "{":
+            if depth == 0:
+                prelude_end = i
+            depth += 1
+        elif c == "}":
+            depth -= 1
+            if depth == 0:
+                statements.append(
+                    Statement(
+                        css[start:prelude_end].strip(),
+                        css[prelude_end + 1:i]
+                    )
+                )
+                start = i + 1
+            #end if
+        elif c == ";" and depth == 0:
+            prelude = css[start:i].strip()
+            if prelude:
+                statements.append(Statement(prelude))
+            start = i + 1
+        #end if
+
+        i += 1
+    #end while
+
+    if css[start:].strip():
+        statements.append(Statement(css[start:].strip()))
+
+    return statements
+#end function
+
+def serialize(statements: list[Statement]) -> str:
+    return "".join(s.to_css() for s in statements)
+
+def optimize(css: str) -> str:
+    return serialize(_optimize_statements(parse(css)))
+
+def _optimize_statements(statements: list[Statement]) -> list[Statement]:
+    for statement in statements:
+        if statement.has_nested_rules:
+            statement.block = serialize(
+                _optimize_statements(parse(statement.block))
+            )
+    #end for
+
+    # Empty rules have no effect. A rule that is repeated verbatim later on
+    # has no effect either, because the later copy wins the cascade.
+    result = []
+    seen = set()
+
+    for statement in reversed(statements):
+        # Layers are ordered by their first appearance, even when empty.
+        if statement.block is not None and statement.at_keyword != "@layer":
+            if not statement.block.strip(" \t\r\n;"):
+                continue
+
+            key = statement.to_css()
+            if key in seen:
+                continue
+            seen.add(key)
+        #end if
+
+        result.append(statement)
+    #end for
+
+    result.reverse()
+    return result
+#end function
+
+def _skip_string(css: str, i: int) -> int:
+    quote = css[i]
+    i += 1
+
+    while i < len(css):
+        if css[i] == "\\":
+            i += 2
+            continue
+        if css[i] == quote or css[i] == "\n":
+            return i + 1
+        i += 1
+    #end while
+
+    return i
+#end function
+
+def _strip_comments(text: str) -> str:
+    while "/*" in text:
+        start = text.find("/*")
+        end = text.find("*/", start + 2)
+        text = text[:start] + ("" if end == -1 else text[end + 2:])
+    #end while
+
+    return text
+#end function
+
+# At-rules whose rules are subject to pruning. Keyframe selectors and the
+# like are always kept.
+PRUNABLE_AT_RULES = [
+    "@-moz-document",
+    "@container",
+    "@document",
+    "@layer",
+    "@media",
+    "@scope",
+    "@supports",
+]
+
+def prune(css: str, is_used: Callable[[str, str], bool]) -> str:
+    return serialize(_prune_statements(parse(css), is_used))
+
+def split_selectors(prelude: str) -> list[str]:
+    return _split(prelude, ",")
+
+def _split(text: str, separator: str) -> list[str]:
+    # Splits at separators outside of strings, parentheses and brackets.
+    parts = []
+
+    start = 0
+    depth = 0
+    i = 0
+
+    while i < len(text):
+        c = text[i]
+
+        if c in "\"'":
+            i = _skip_string(text, i)
+            continue
+
+        if c in "([":
+            depth += 1
+        elif c in ")]":
+            depth -= 1
+        elif c == separator and depth == 0:
+            parts.append(text[start:i].strip())
+            start = i + 1
+        #end if
+
+        i += 1
+    #end while
+
+    parts.append(text[start:].strip())
+    return [part for part in parts if part]
+#end function
+
+def selector_tokens(selector: str) -> list[tuple[str, str]]:
+    # Returns the classes, ids, tags and attribute names that an element
+    # must carry for the selector to match. Arguments of functional
+    # pseudo-classes are ignored, which errs on the side of keeping a rule.
+    tokens = []
+
+    def replace_attribute(m: re.Match) -> str:
+        tokens.append(("attribute", m.group(1).lower()))
+        return " "
+    #end function
+
+    selector = re.sub(
+        r"\[\s*(?:[-\w*]*\|)?([-\w]+)[^\]]*\]", replace_attribute, selector
+    )
+
+    selector = _remove_parentheses(selector)
+
+    def replace_name(m: re.Match) -> str:
+        kind = "class" if m.group(1) == "." else "id"
+        tokens.append((kind, re.sub(r"\\(.)", r"\1", m.group(2))))
+        return " "
+    #end function
+
+    selector = re.sub(r"([.#])((?:[-\w]|\\.)+)", replace_name, selector)
+    selector = re.sub(r"::?[-\w]+", " ", selector)
+
+    for part in re.split(r"[\s>+~*|]+", selector):
+        if re.match(r"^[A-Za-z][-\w]*$", part):
+            tokens.append(("tag", part.lower()))
+    #end for
+
+    return tokens
+#end function
+
+def _prune_statements(statements: list[Statement],
+        is_used: Callable[[str, str], bool]) -> list[Statement]:
+    result = []
+
+    for statement in statements:
+        if statement.block is None:
+            result.append(statement)
+            continue
+
+        at_keyword = statement.at_keyword
+
+        if at_keyword is None:
+            selectors = [
+                selector for selector in split_selectors(
+                    _strip_comments(statement.prelude))
+                        if all(is_used(kind, name) for kind, name in
+                            selector_tokens(selector))
+            ]
+
+            if not selectors:
+                continue
+
+            statement.prelude = ",".join(selectors)
+        elif at_keyword in PRUNABLE_AT_RULES:
+            statement.block = serialize(
+                _prune_statements(parse(statement.block), is_used)
+            )
+
+            if not statement.block.strip() and at_keyword != "@layer":
+                continue
+        #end if
+
+        result.append(statement)
+    #end for
+
+    return result
+#end function
+
+def _remove_parentheses(text: str) -> str:
+    result = []
+    depth = 0
+
+    for c in text:
+        if c == "(":
+            depth += 1
+        elif c == ")":
+            depth = max(depth - 1, 0)
+        elif depth == 0:
+            result.append(c)
+    #end for
+
+    return "".join(result)
+#end function
+
+def key_selector(selector: str) -> str:
+    # The compound selector right of the last combinator, which is what the
+    # element that gets the style has to match.
+    selector = re.sub(r"\[\s*([^\]\s=~|^$*]+)[^\]]*\]", r"[\1]", selector)
+    selector = _remove_parentheses(selector)
+
+    parts = [p for p in re.split(r"\s*[>+~]\s*|\s+", selector.strip()) if p]
+    return parts[-1] if parts else ""
+#end function
+
+# At-rules that sass interprets rather than passes through. A stylesheet
+# with one of them is left to sass.
+SASS_AT_RULES = [
+    "@at-root",
+    "@charset",
+    "@content",
+    "@debug",
+    "@each",
+    "@else",
+    "@error",
+    "@extend",
+    "@for",
+    "@forward",
+    "@function",
+    "@if",
+    "@import",
+    "@include",
+    "@mixin",
+    "@return",
+    "@use",
+    "@warn",
+    "@while",
+]
+
+def is_plain_css(text: str) -> bool:
+    # True if sass would do no more than remove whitespace and comments.
+    # Anything unusual, including non-ASCII text, which makes sass add a
+    # byte order mark, counts as SCSS.
+    if not text.isascii():
+        return False
+
+    code = _strip_strings_and_urls(_strip_comments(text))
+
+    if re.search(r"[$&]|#\{|//", code):
+        return False
+    if code.count("{") != code.count("}"):
+        return False
+
+    return _is_plain(parse(text))
+#end function
+
+def _is_plain(statements: list[Statement]) -> bool:
+    for statement in statements:
+        prelude = _strip_comments(statement.prelude).strip()
+
+        if statement.at_keyword in SASS_AT_RULES or prelude.startswith("%"):
+            return False
+
+        if statement.block is None:
+            # Only at-rules end in a semicolon at the top level.
+            if prelude and statement.at_keyword is None:
+                return False
+        elif statement.has_nested_rules:
+            if not _is_plain(parse(statement.block)):
+                return False
+        elif "{" in statement.block:
+            # Nested rules.
+            return False
+        #end if
+    #end for
+
+    return True
+#end function
+
+def minify(css: str) -> str:
+    # Removes whitespace and comments and shortens selectors, colors and
+    # numbers the way compressed sass output does. Comments starting with
+    # /*! are kept.
+    tokens = []
+    space = False
+    i = 0
+
+    while i < len(css):
+        c = css[i]
+
+        if c in " \t\r\n\f":
+            space = True
+            i += 1
+            continue
+        #end if
+
+        if css.startswith("/*", i):
+            end = css.find("*/", i + 2)
+            end = len(css) if end == -1 else end + 2
+            if css.startswith("/*!", i):
+                tokens.append(css[i:end])
+            else:
+                space = True
+            i = end
+            continue
+        #end if
+
+        if c in "\"'":
+            end = _skip_string(css, i)
+            token = css[i:end]
+        else:
+            end = i + 1
+            token = c
+        #end if
+
+        # A space before a colon separates a descendant pseudo-class, as
+        # in "a :hover", and one before an opening parenthesis may separate
+        # a media feature. Everywhere else around these it means nothing.
+        if space and tokens and tokens[-1] not in "{};,:(" and \
+                token not in "{};,)":
+            tokens.append(" ")
+        space = False
+
+        if token == "}" and tokens and tokens[-1] == ";":
+            tokens.pop()
+
+        tokens.append(token)
+        i = end
+    #end while
+
+    return serialize(_compress_statements(parse("".join(tokens))))
+#end function
+
+def _compress_statements(statements: list[Statement]) -> list[Statement]:
+    result = []
+
+    for statement in statements:
+        if statement.has_nested_rules:
+            statement.block = serialize(
+                _compress_statements(parse(statement.block))
+            )
+        elif statement.block is not None:
+            if statement.at_keyword is None:
+                statement.prelude = _compress_selector(statement.prelude)
+            statement.block = ";".join(
+                _compress_declaration(declaration)
+                    for declaration in _split(statement.block, ";")
+            )
+        #end if
+
+        # Layers are ordered by their first appearance, even when empty.
+        if statement.block is not None and not statement.block and \
+                statement.at_keyword != "@layer":
+            continue
+
+        result.append(statement)
+    #end for
+
+    return result
+#end function
+
+def _compress_selector(prelude: str) -> str:
+    # Drops the spaces around child and sibling combinators. Inside
+    # parentheses, as in :nth-child(2n + 1), they are left alone.
+    result = []
+    depth = 0
+    i = 0
+
+    while i < len(prelude):
+        c = prelude[i]
+
+        if c in "\"'":
+            end = _skip_string(prelude, i)
+            result.append(prelude[i:end])
+            i = end
+            continue
+        #end if
+
+        if c in "([":
+            depth += 1
+        elif c in ")]":
+            depth -= 1
+        elif c in ">+~" and depth == 0:
+            while result and result[-1] == " ":
+                result.pop()
+            result.append(c)
+            i += 1
+            while i < len(prelude) and prelude[i] == " ":
+                i += 1
+            continue
+        #end if
+
+        result.append(c)
+        i += 1
+    #end while
+
+    return "".join(result)
+#end function
+
+HEX_COLOR_PATTERN = re.compile(r"#([0-9a-fA-F]{3}|[0-9a-fA-F]{6})(?![-\w])")
+NUMBER_PATTERN = re.compile(
+    r"(?<![-\w.#])([+-]?)(\d*)\.(\d+)(?![eE][+-]?\d)(?!\.)"
+)
+
+def _compress_declaration(declaration: str) -> str:
+    # Custom properties are passed through by sass as they are.
+    name, colon, value = declaration.partition(":")
+    if not colon or name.startswith("--"):
+        return declaration
+
+    name = name.rstrip()
+
+    # Strings and URLs are kept as they are.
+    parts = re.split(
+        r"(\"(?:\\.|[^\"\\])*\"|'(?:\\.|[^'\\])*'|url\([^)]*\))",
+            value, flags=re.IGNORECASE
+    )
+
+    for n in range(0, len(parts), 2):
+        parts[n] = HEX_COLOR_PATTERN.sub(_shorten_color, parts[n])
+        parts[n] = NUMBER_PATTERN.sub(_shorten_number, parts[n])
+    #end for
+
+    return name + colon + "".join(parts)
+#end function
+
+def _shorten_color(m: re.Match) -> str:
+    digits = m.group(1).lower()
+
+    if len(digits) == 6 and digits[0::2] == digits[1::2]:
+        digits = digits[0::2]
+
+    return "#" + digits
+#end function
+
+def _shorten_number(m: re.Match) -> str:
+    sign = "-" if m.group(1) == "-" else ""
+    integer = m.group(2).lstrip("0")
+    fraction = m.group(3).rstrip("0")
+
+    if not integer and not fraction:
+        return "0"
+
+    return sign + integer + ("." + fraction if fraction else "")
+#end function
+
+URL_PATTERN = re.compile(r"url\(\s*[^\s\"')][^)]*\)", re.IGNORECASE)
+
+def _strip_strings_and_urls(text: str) -> str:
+    # Replaces strings and unquoted URLs, which may contain anything, with
+    # empty ones.
+    result = []
+    i = 0
+
+    while i < len(text):
+        if text[i] in "\"'":
+            i = _skip_string(text, i)
+            result.append("\"\"")
+            continue
+        #end if
+
+        if text[i] in "uU" and (i == 0 or
+                not re.match(r"[-\w]", text[i - 1])):
+            m = URL_PATTERN.match(text, i)
+            if m:
+                result.append("url()")
+                i = m.end()
+                continue
+        #end if
+
+        result.append(text[i])
+        i += 1
+    #end while
+
+    return "".join(result)
+#end function
+
+def rebase_urls(css: str, base_url: str) -> str:
+    # Makes relative references absolute, for when a stylesheet is moved to
+    # where base_url no longer applies, e.g. inlined into a page.
+    def rebase(url: str) -> str:
+        parsed = urlparse(url)
+        if parsed.scheme or parsed.netloc or url.startswith(("/", "#")):
+            return url
+        return urljoin(base_url, url)
+    #end function
+
+    def replace_url(m: re.Match) -> str:
+        return "{}{}{}{}{}".format(
+            m.group(1), m.group(2), rebase(m.group(3)), m.group(2),
+                m.group(4)
+        )
+    #end function
+
+    css = re.sub(
+        r"(url\(\s*)(['\"]?)([^'\")\s]+)\2(\s*\))", replace_url, css,
+            flags=re.IGNORECASE
+    )
+
+    return re.sub(
+        r"(@import\s+)(['\"])([^'\"]+)\2()", replace_url, css,
+            flags=re.IGNORECASE
+    )
+#end function
@@ -0,0 +1,320 @@
+# -*- encoding: utf-8 -*-
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2024 Tobias Koch <tobias.koch@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+# A build daemon keeps the interpreter, the imported modules, the worker
+# pool and the ignore rules around between builds, along with the output of
+# tools that only read stdin. "snazzy make" hands the build over to it when
+# it finds the socket, and the daemon streams the log back.
+
+import importlib
+import json
+import logging
+import multiprocessing
+import os
+import socket
+
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any
+
+from snazzy import toolrunner
+from snazzy.config import STATE_DIR
+from snazzy.toolchain import TOOLCHAIN_FILE
+from snazzy.error import BuildCancelled, SnazzyError
+
+LOGGER = logging.getLogger(__name__)
+
+SOCKET_FILE = os.path.join(STATE_DIR, "daemon.sock")
+
+DEFAULT_IDLE_TIMEOUT = 30 * 60
+
+# When one of these changes, everything the daemon holds may be stale. The
+# pool goes as well, it takes the cached tool output with it.
+WATCHED_FILES = [
+    ".babelrc",
+    ".gitignore",
+    ".snazzyignore",
+    "package-lock.json",
+    "package.json",
+    "snazzy.json",
+    TOOLCHAIN_FILE,
+]
+
+# Everything "make" imports lazily, imported once when the daemon starts.
+WARM_MODULES = [
+    "pathspec",
+    "snazzy.appmaker",
+    "snazzy.copyfiles",
+    "snazzy.discovery",
+    "snazzy.output",
+    "snazzy.preptask",
+    "snazzy.serverconfig",
+    "snazzy.usage",
+]
+
+def _init_worker(log_queue: Any, output_cache: Any) -> None:
+    # Worker logs go through the daemon, which passes them on to the
+    # client of the current build.
+    root = logging.getLogger()
+    root.handlers.clear()
+    root.addHandler(QueueHandler(log_queue))
+    root.setLevel(logging.INFO)
+
+    toolrunner.init_worker()
+    toolrunner.set_output_cache(output_cache)
+    toolrunner.log_tool_output()
+#end function
+
+class _ClientHandler(logging.Handler):
+
+    def __init__(self, conn: socket.socket):
+        super().__init__()
+        self._conn = conn
+        self._gone = False
+
+    def emit(self, record: logging.LogRecord) -> None:
+        if self._gone:
+            return
+
+        try:
+            _send(self._conn, {
+                "level": record.levelno, "message": record.getMessage()
+            })
+        except OSError:
+            # The client was interrupted, there is no point in going on.
+            self._gone = True
+            toolrunner.cancel(BuildCancelled("client disconnected"))
+        #end try
+    #end function
+
+#end class
+
+class _Dispatcher(logging.Handler):
+
+    def emit(self, record: logging.LogRecord) -> None:
+        logging.getLogger().handle(record)
+
+#end class
+
+class BuildDaemon:
+
+    def __init__(self, num_proc: int,
+            idle_timeout: float = DEFAULT_IDLE_TIMEOUT):
+        self._num_proc     = num_proc
+        self._idle_timeout = idle_timeout
+        self._sitemaker    = None
+        self._pool         = None
+        self._pool_size    = None
+        self._fingerprint  = None
+        self._manager      = None
+        self._output_cache = None
+        self._log_queue    = None
+    #end function
+
+    def serve(self) -> None:
+        if connect() is not None:
+            raise SnazzyError("a build daemon is already running")
+
+        self._warm_up()
+
+        self._manager      = multiprocessing.Manager()
+        self._output_cache = self._manager.dict()
+        self._log_queue    = multiprocessing.Queue()
+
+        listener = QueueListener(self._log_queue, _Dispatcher())
+        listener.start()
+
+        os.makedirs(STATE_DIR, exist_ok=True)
+        if os.path.lexists(SOCKET_FILE):
+            os.unlink(SOCKET_FILE)
+
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+        try:
+            server.bind(SOCKET_FILE)
+            server.listen(1)
+            server.settimeout(self._idle_timeout)
+
+            LOGGER.info(
+                "build daemon listening on {}, idle timeout {}s".format(
+                    SOCKET_FILE, int(self._idle_timeout)
+                )
+            )
+
+            while True:
+                try:
+                    conn, _ = server.accept()
+                except socket.timeout:
+                    LOGGER.info("build daemon idle, exiting")
+                    break
+                #end try
+
+                with conn:
+                    conn.settimeout(None)
+                    self._handle(conn)
+            #end while
+        finally:
+            server.close()
+            if os.path.lexists(SOCKET_FILE):
+                os.unlink(SOCKET_FILE)
+            self._drop_pool()
+            listener.stop()
+            self._manager.shutdown()
+        #end try
+    #end function
+
+    def _warm_up(self) -> None:
+        for module in WARM_MODULES:
+            importlib.import_module(module)
+
+    def _handle(self, conn: socket.socket) -> None:
+        from snazzy.output import open_output
+        from snazzy.sitemaker import SiteMaker
+
+        try:
+            request = json.loads(conn.makefile("r", encoding="utf-8")
+                .readline())
+            options = request["options"]
+        except (OSError, ValueError, KeyError, TypeError):
+            return
+
+        fingerprint = self._current_fingerprint()
+
+        if fingerprint != self._fingerprint:
+            if self._fingerprint is not None:
+                LOGGER.info("project settings changed, starting afresh")
+            self._fingerprint = fingerprint
+            self._sitemaker = SiteMaker()
+            self._output_cache.clear()
+            self._drop_pool()
+        #end if
+
+        num_proc = options.setdefault("num_proc", self._num_proc)
+
+        if self._pool is not None and self._pool_size != num_proc:
+            self._drop_pool()
+        if self._pool is None:
+            self._pool = multiprocessing.Pool(
+                processes=num_proc, initializer=_init_worker,
+                    initargs=(self._log_queue, self._output_cache)
+            )
+            self._pool_size = num_proc
+        #end if
+
+        if options.get("output"):
+            options["output"] = open_output(options["output"])
+
+        handler = _ClientHandler(conn)
+        root = logging.getLogger()
+        root.addHandler(handler)
+
+        status = {"status": 0}
+
+        try:
+            self._sitemaker.make(worker_pool=self._pool, **options)
+        except Exception as e:
+            status = {"status": 1, "error": str(e)}
+            # Workers may still be running tools for the failed build.
+            self._drop_pool()
+        finally:
+            root.removeHandler(handler)
+        #end try
+
+        try:
+            _send(conn, status)
+        except OSError:
+            pass
+    #end function
+
+    def _drop_pool(self) -> None:
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+        self._pool = None
+    #end function
+
+    def _current_fingerprint(self) -> list[Any]:
+        fingerprint = []
+
+        for filename in WATCHED_FILES:
+            try:
+                st = os.stat(filename)
+                fingerprint.append((filename, st.st_mtime_ns, st.st_size))
+            except OSError:
+                fingerprint.append((filename, None, None))
+        #end for
+
+        return fingerprint
+    #end function
+
+#end class
+
+def connect() -> socket.socket | None:
+    if not os.path.exists(SOCKET_FILE):
+        return None
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+    try:
+        sock.connect(SOCKET_FILE)
+    except OSError:
+        sock.close()
+        return None
+
+    return sock
+#end function
+
+def forward_make(options: dict[str, Any]) -> bool | None:
+    # Returns None if no daemon is running, otherwise whether the build
+    # succeeded. Errors are raised as on a local build.
+    sock = connect()
+    if sock is None:
+        return None
+
+    with sock:
+        try:
+            _send(sock, {"options": options})
+        except OSError:
+            return None
+
+        LOGGER.info("build forwarded to the build daemon")
+
+        for line in sock.makefile("r", encoding="utf-8"):
+            message = json.loads(line)
+
+            if "status" in message:
+                if message.get("error"):
+                    raise SnazzyError(message["error"])
+                return message["status"] == 0
+            #end if
+
+            LOGGER.log(message["level"], message["message"])
+        #end for
+    #end with
+
+    raise SnazzyError("lost connection to the build daemon")
+#end function
+
+def _send(sock: socket.socket, message: dict[str, Any]) -> None:
+    sock.sendall((json.dumps(message) + "\n").encode("utf-8"))
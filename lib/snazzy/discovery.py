@@ -0,0 +1,191 @@
+# -*- encoding: utf-8 -*-
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2024 Tobias Koch <tobias.koch@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+import os
+import queue
+import threading
+import time
+
+from typing import Any, Iterator
+
+from pathspec import PathSpec
+
+class Discovery:
+
+    # The walk runs ahead of the build by at most this many entries, so the
+    # tree is never held in memory as a whole.
+    QUEUE_SIZE = 256
+
+    # A directory whose mtime is this close to the time of the scan may
+    # still change within the resolution of the clock, it is not cached.
+    LISTING_GRACE_NS = 2 * 10**9
+
+    _END = object()
+
+    def __init__(self, basedir: str, ignore_spec: PathSpec,
+            listings: dict[str, Any] | None = None):
+        self._basedir = basedir
+        self._ignore_spec = ignore_spec
+
+        # The build daemon passes in the same dict for every build, and
+        # directories that did not change are not read or matched again.
+        # Adding, removing or renaming an entry changes the mtime of its
+        # directory, changes to the files themselves do not matter here.
+        self._listings = listings
+
+        # Git does not look into ignored directories, so files below them
+        # cannot be included again. Other ignore rules may disagree, the
+        # directories are only skipped if nothing is included again.
+        self._prune_dirs = not any(
+            pattern.include is False for pattern in ignore_spec.patterns
+        )
+    #end function
+
+    def __iter__(self) -> Iterator[str]:
+        # Yields the paths of the sources relative to the base directory,
+        # with a leading slash, as they are found.
+        entries = queue.Queue(self.QUEUE_SIZE)
+        stop = threading.Event()
+
+        thread = threading.Thread(
+            target=self._walk, args=(entries, stop), daemon=True
+        )
+        thread.start()
+
+        try:
+            while True:
+                entry = entries.get()
+
+                if entry is self._END:
+                    break
+                if isinstance(entry, BaseException):
+                    raise entry
+
+                yield entry
+            #end while
+        finally:
+            stop.set()
+            thread.join()
+        #end try
+    #end function
+
+    def _walk(self, entries: queue.Queue, stop: threading.Event) -> None:
+        def put(item: object) -> bool:
+            while not stop.is_set():
+                try:
+                    entries.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            #end while
+
+            return False
+        #end function
+
+        try:
+            # Top-down and in sorted order, as os.walk would go.
+            pending = [(self._basedir, "")]
+
+            while pending:
+                dirpath, reldir = pending.pop()
+                dirnames, sources = self._list(dirpath, reldir)
+
+                for entry in sources:
+                    if not put(entry):
+                        return
+                #end for
+
+                pending.extend(
+                    (os.path.join(dirpath, d), reldir + "/" + d)
+                        for d in reversed(dirnames)
+                )
+            #end while
+        except Exception as e:
+            put(e)
+            return
+        #end try
+
+        put(self._END)
+    #end function
+
+    def _list(self, dirpath: str, reldir: str) \
+            -> tuple[list[str], list[str]]:
+        # Returns the subdirectories to descend into and the sources found
+        # in a directory, after the ignore rules were applied.
+        try:
+            mtime = os.stat(dirpath).st_mtime_ns
+        except OSError:
+            return [], []
+
+        if self._listings is not None:
+            listing = self._listings.get(dirpath)
+            if listing is not None and listing[0] == mtime:
+                return listing[1], listing[2]
+        #end if
+
+        dirnames  = []
+        filenames = []
+
+        try:
+            with os.scandir(dirpath) as it:
+                for dir_entry in it:
+                    try:
+                        is_dir = dir_entry.is_dir()
+                    except OSError:
+                        is_dir = False
+
+                    # Like os.walk, symlinks to directories are not followed.
+                    if not is_dir:
+                        filenames.append(dir_entry.name)
+                    elif not dir_entry.is_symlink():
+                        dirnames.append(dir_entry.name)
+                #end for
+            #end with
+        except OSError:
+            return [], []
+        #end try
+
+        dirnames.sort()
+
+        if self._prune_dirs:
+            dirnames = [
+                d for d in dirnames if not self._ignore_spec
+                    .match_file(reldir + "/" + d + "/")
+            ]
+        #end if
+
+        entries = [
+            reldir + "/" + filename for filename in sorted(filenames)
+                if not self._ignore_spec.match_file(reldir + "/" + filename)
+        ]
+
+        if self._listings is not None and \
+                time.time_ns() - mtime > self.LISTING_GRACE_NS:
+            self._listings[dirpath] = (mtime, dirnames, entries)
+
+        return dirnames, entries
+    #end function
+
+#end class
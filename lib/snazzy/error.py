@@ -28,3 +28,9 @@ class SnazzyError(Exception):
 
 class InvocationError(SnazzyError):
     pass
+
+class ToolError(SnazzyError):
+    pass
+
+class BuildCancelled(SnazzyError):
+    pass
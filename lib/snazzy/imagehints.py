@@ -0,0 +1,284 @@
+# -*- encoding: utf-8 -*-
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2024 Tobias Koch <tobias.koch@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+
+import hashlib
+import json
+import os
+import re
+import struct
+import threading
+
+from typing import Callable
+
+from lxml import etree
+
+from snazzy.config import STATE_DIR
+
+CACHE_FILE = os.path.join(STATE_DIR, "cache", "images.json")
+
+# Images up to this index in document order are assumed to be visible
+# without scrolling and are loaded as usual.
+DEFAULT_EAGER_IMAGES = 2
+
+# Frame headers of baseline, progressive and lossless JPEGs. C4, C8 and CC
+# are other markers in the same range.
+JPEG_SOF_MARKERS = [
+    m for m in range(0xC0, 0xD0) if m not in [0xC4, 0xC8, 0xCC]
+]
+
+def image_size(data: bytes) -> tuple[int, int] | None:
+    # The intrinsic size of a PNG, GIF, JPEG or SVG image, None for other
+    # formats and for images whose header cannot be read.
+    try:
+        if data.startswith(b"\x89PNG\r\n\x1a\n") and data[12:16] == b"IHDR":
+            return struct.unpack(">II", data[16:24])
+        if data[:6] in [b"GIF87a", b"GIF89a"]:
+            return struct.unpack("<HH", data[6:10])
+        if data.startswith(b"\xff\xd8"):
+            return _jpeg_size(data)
+    except struct.error:
+        return None
+
+    if b"<svg" in data[:4096]:
+        return _svg_size(data)
+
+    return None
+#end function
+
+def _jpeg_size(data: bytes) -> tuple[int, int] | None:
+    orientation = 1
+    i = 2
+
+    while i + 4 <= len(data):
+        if data[i] != 0xFF:
+            return None
+
+        marker = data[i + 1]
+
+        if marker == 0xFF:
+            i += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD9:
+            i += 2
+            continue
+
+        length = struct.unpack(">H", data[i + 2:i + 4])[0]
+        segment = data[i + 4:i + 2 + length]
+
+        if marker == 0xE1 and segment.startswith(b"Exif\0\0"):
+            orientation = _exif_orientation(segment[6:]) or orientation
+
+        if marker in JPEG_SOF_MARKERS:
+            height, width = struct.unpack(">HH", segment[1:5])
+
+            # Browsers apply the EXIF orientation, the values 5 to 8 turn
+            # the image by 90 degrees.
+            if orientation >= 5:
+                width, height = height, width
+
+            return width, height
+        #end if
+
+        i += 2 + length
+    #end while
+
+    return None
+#end function
+
+def _exif_orientation(tiff: bytes) -> int | None:
+    if tiff[:2] == b"II":
+        order = "<"
+    elif tiff[:2] == b"MM":
+        order = ">"
+    else:
+        return None
+
+    offset = struct.unpack(order + "I", tiff[4:8])[0]
+    count = struct.unpack(order + "H", tiff[offset:offset + 2])[0]
+
+    for n in range(count):
+        entry = tiff[offset + 2 + 12 * n:offset + 14 + 12 * n]
+        tag = struct.unpack(order + "H", entry[:2])[0]
+
+        if tag == 0x0112:
+            return struct.unpack(order + "H", entry[8:10])[0]
+    #end for
+
+    return None
+#end function
+
+def _svg_size(data: bytes) -> tuple[int, int] | None:
+    parser = etree.XMLParser(resolve_entities=False, no_network=True)
+
+    try:
+        root = etree.fromstring(data, parser=parser)
+    except etree.XMLSyntaxError:
+        return None
+
+    def length(value: str | None) -> float | None:
+        # Relative units depend on where the image is used.
+        m = re.fullmatch(r"\s*([0-9]*\.?[0-9]+)\s*(px)?\s*", value or "")
+        return float(m.group(1)) if m else None
+    #end function
+
+    width  = length(root.get("width"))
+    height = length(root.get("height"))
+
+    if width is None or height is None:
+        view_box = (root.get("viewBox") or "").replace(",", " ").split()
+
+        try:
+            width, height = [float(v) for v in view_box[2:4]]
+        except ValueError:
+            return None
+    #end if
+
+    if width <= 0 or height <= 0:
+        return None
+
+    return round(width), round(height)
+#end function
+
+class ImageSizes:
+
+    def __init__(self, filename: str = CACHE_FILE):
+        self._filename = filename
+        self._lock     = threading.Lock()
+        self._entries  = self._load()
+        self._added    = {}
+    #end function
+
+    def size(self, srcfile: str) -> tuple[int, int] | None:
+        try:
+            with open(srcfile, "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+
+        # Keyed by content, so that a changed image is read again and
+        # copies of an image are read once.
+        key = hashlib.sha256(data).hexdigest()
+
+        with self._lock:
+            if key in self._entries:
+                size = self._entries[key]
+                return tuple(size) if size else None
+        #end with
+
+        size = image_size(data)
+
+        with self._lock:
+            self._entries[key] = size
+            self._added[key] = size
+        #end with
+
+        return size
+    #end function
+
+    def save(self) -> None:
+        # Pages and templates are processed in several processes, each
+        # merges what it found with what the others saved.
+        with self._lock:
+            if not self._added:
+                return
+
+            entries = self._load()
+            entries.update(self._added)
+            self._added = {}
+
+            os.makedirs(os.path.dirname(self._filename), exist_ok=True)
+
+            tmp_file = "{}.{}.tmp".format(self._filename, os.getpid())
+            with open(tmp_file, "w", encoding="utf-8") as f:
+                json.dump(entries, f, sort_keys=True)
+                f.write("\n")
+            os.replace(tmp_file, self._filename)
+        #end with
+    #end function
+
+    def _load(self) -> dict[str, list[int] | None]:
+        try:
+            with open(self._filename, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+        return entries if isinstance(entries, dict) else {}
+    #end function
+
+#end class
+
+_sizes = None
+_sizes_lock = threading.Lock()
+
+def image_sizes() -> ImageSizes:
+    global _sizes
+
+    with _sizes_lock:
+        if _sizes is None:
+            _sizes = ImageSizes()
+        return _sizes
+    #end with
+#end function
+
+class ImageHints:
+
+    def __init__(self, sizes: ImageSizes,
+            eager_images: int = DEFAULT_EAGER_IMAGES):
+        self._sizes = sizes
+        self._eager_images = eager_images
+
+    def apply(self, root: etree.Element,
+            resolve: Callable[[str], str | None]) -> None:
+        # resolve maps the src of an image to its source file, or to None
+        # if it is not part of the site.
+        for index, img in enumerate(root.iter("img")):
+            src = img.get("src")
+
+            if src and img.get("width") is None and \
+                    img.get("height") is None:
+                srcfile = resolve(src)
+                size = self._sizes.size(srcfile) if srcfile else None
+
+                if size:
+                    img.set("width", str(size[0]))
+                    img.set("height", str(size[1]))
+            #end if
+
+            # Images the page asked to load early stay eager, wherever
+            # they are.
+            if index < self._eager_images or \
+                    img.get("fetchpriority") == "high":
+                continue
+
+            if img.get("loading") is None:
+                img.set("loading", "lazy")
+            if img.get("decoding") is None:
+                img.set("decoding", "async")
+        #end for
+    #end function
+
+#end class
@@ -0,0 +1,239 @@
+# -*- encoding: utf-8 -*-
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2024 Tobias Koch <tobias.koch@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+import contextlib
+import logging
+import multiprocessing
+import os
+import select
+import shlex
+import threading
+
+from typing import Iterator
+
+LOGGER = logging.getLogger(__name__)
+
+# Client side of the GNU make jobserver protocol. Make hands out job tokens
+# through a named pipe (--jobserver-auth=fifo:PATH) or an inherited pair of
+# pipe descriptors (--jobserver-auth=R,W). One job per recipe is covered by
+# the implicit token, every additional job has to take a token from make.
+class JobServer:
+
+    POLL_INTERVAL = 0.05
+
+    def __init__(self, read_fd: int, write_fd: int,
+            fifo_path: str | None = None):
+        self._read_fd   = _nonblocking_reader(read_fd, fifo_path)
+        self._write_fd  = write_fd
+        self._fifo_path = fifo_path
+        self._implicit  = multiprocessing.Lock()
+    #end function
+
+    @classmethod
+    def from_environment(cls, makeflags: str | None = None) \
+            -> "JobServer | None":
+        if makeflags is None:
+            makeflags = os.environ.get("MAKEFLAGS", "")
+
+        auth = None
+
+        try:
+            flags = shlex.split(makeflags)
+        except ValueError:
+            flags = makeflags.split()
+
+        # make passes the flag once, but the last occurrence wins in case
+        # MAKEFLAGS has been amended by an intermediate recipe.
+        for flag in flags:
+            for prefix in ["--jobserver-auth=", "--jobserver-fds="]:
+                if flag.startswith(prefix):
+                    auth = flag[len(prefix):]
+        #end for
+
+        if not auth:
+            return None
+
+        if auth.startswith("fifo:"):
+            fifo_path = auth[len("fifo:"):]
+
+            try:
+                fd = os.open(fifo_path, os.O_RDWR)
+            except OSError as e:
+                LOGGER.warning(
+                    "cannot open jobserver fifo {}: {}".format(fifo_path, e)
+                )
+                return None
+
+            return cls(fd, fd, fifo_path)
+        #end if
+
+        try:
+            read_fd, write_fd = [int(fd) for fd in auth.split(",")]
+        except ValueError:
+            LOGGER.warning(
+                "unsupported jobserver auth \"{}\"".format(auth)
+            )
+            return None
+
+        # make only passes the pipe to recipes it considers sub-makes. When
+        # the file descriptors are not open, tokens cannot be taken.
+        try:
+            os.fstat(read_fd)
+            os.fstat(write_fd)
+        except OSError:
+            LOGGER.warning(
+                "jobserver pipe is not accessible, prefix the recipe "
+                "with '+' to enable it"
+            )
+            return None
+
+        return cls(read_fd, write_fd)
+    #end function
+
+    def acquire(self) -> bytes | None:
+        # Returns None if the implicit token was taken. The implicit token
+        # may be freed while waiting on make, so check back periodically.
+        while True:
+            if self._implicit.acquire(block=False):
+                return None
+
+            readable, _, _ = select.select(
+                [self._read_fd], [], [], self.POLL_INTERVAL
+            )
+            if not readable:
+                continue
+
+            # Other clients of make wait on the same pipe, the token may
+            # be gone by the time it is read.
+            try:
+                token = os.read(self._read_fd, 1)
+            except BlockingIOError:
+                continue
+
+            if token:
+                return token
+        #end while
+    #end function
+
+    def release(self, token: bytes | None) -> None:
+        if token is None:
+            self._implicit.release()
+        else:
+            os.write(self._write_fd, token)
+    #end function
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+
+        # Only the path travels to spawned processes, which open the fifo
+        # themselves. Forked processes simply inherit the descriptors.
+        if self._fifo_path:
+            state["_read_fd"]  = None
+            state["_write_fd"] = None
+
+        return state
+    #end function
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+
+        if self._fifo_path:
+            fd = os.open(self._fifo_path, os.O_RDWR)
+            self._read_fd  = _nonblocking_reader(fd, self._fifo_path)
+            self._write_fd = fd
+        #end if
+    #end function
+
+#end class
+
+def _nonblocking_reader(fd: int, fifo_path: str | None = None) -> int:
+    # The fifo was opened by us, but an inherited pipe shares its file
+    # status flags with make and every other client. On Linux, the pipe
+    # can be opened again through /proc to get a description of our own.
+    if not fifo_path:
+        try:
+            fd = os.open("/proc/self/fd/{}".format(fd),
+                os.O_RDONLY | os.O_NONBLOCK)
+            return fd
+        except OSError:
+            pass
+    #end if
+
+    os.set_blocking(fd, False)
+    return fd
+#end function
+
+_jobserver = None
+_slot_depth = threading.local()
+
+# Tokens taken by this process, handed back by release_held_tokens when the
+# process is terminated in the middle of a job.
+_held_tokens = []
+
+def install(jobserver: JobServer | None) -> None:
+    global _jobserver
+    _jobserver = jobserver
+#end function
+
+@contextlib.contextmanager
+def job_slot() -> Iterator[None]:
+    # Nested blocks in the same thread share the token of the outermost
+    # block, so a pool task that runs external tools counts as one job.
+    depth = getattr(_slot_depth, "value", 0)
+
+    if _jobserver is None or depth > 0:
+        _slot_depth.value = depth + 1
+        try:
+            yield
+        finally:
+            _slot_depth.value = depth
+        return
+    #end if
+
+    token = _jobserver.acquire()
+    _held_tokens.append(token)
+    _slot_depth.value = 1
+
+    try:
+        yield
+    finally:
+        _slot_depth.value = 0
+        _held_tokens.remove(token)
+        _jobserver.release(token)
+    #end try
+#end function
+
+def release_held_tokens() -> None:
+    # Make counts on getting every token back, even from a job that was
+    # cut short, or the slots are lost for the rest of the build.
+    while _held_tokens:
+        token = _held_tokens.pop()
+
+        try:
+            _jobserver.release(token)
+        except (OSError, ValueError):
+            pass
+    #end while
+#end function
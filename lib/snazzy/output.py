@@ -0,0 +1,545 @@
+# -*- encoding: utf-8 -*-
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2024 Tobias Koch <tobias.koch@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+import ctypes
+import ctypes.util
+import filecmp
+import hashlib
+import io
+import logging
+import os
+import shutil
+import tarfile
+import threading
+import time
+import zipfile
+
+from typing import Any, Iterator
+
+from snazzy.error import SnazzyError
+
+LOGGER = logging.getLogger(__name__)
+
+# File types that are compressed already and are stored as is in archives.
+COMPRESSED_EXTENSIONS = [
+    "avif", "gif", "gz", "ico", "jpeg", "jpg", "png", "webp", "woff",
+    "woff2", "zip"
+]
+
+TAR_MODES = {
+    ".tar":     "w|",
+    ".tar.bz2": "w|bz2",
+    ".tar.gz":  "w|gz",
+    ".tar.xz":  "w|xz",
+    ".tgz":     "w|gz",
+}
+
+def open_output(target: str) -> "Output":
+    if target.endswith(".zip"):
+        return ArchiveOutput(target)
+
+    for suffix in TAR_MODES:
+        if target.endswith(suffix):
+            return ArchiveOutput(target)
+
+    return SiteDirectory(target)
+#end function
+
+class Output:
+
+    # Whether pool workers may write to this output directly. Outputs that
+    # live in the parent process get the data handed back by the workers.
+    WORKER_WRITES = False
+
+    def __init__(self, location: str):
+        self.location = location
+
+    def begin(self) -> None:
+        pass
+
+    def write(self, path: str, data: bytes | str,
+            mtime: float | None = None) -> None:
+        raise NotImplementedError()
+
+    def copy(self, srcfile: str, path: str) -> None:
+        # Copies keep the modification time of their source.
+        with open(srcfile, "rb") as f:
+            self.write(path, f.read(), mtime=os.path.getmtime(srcfile))
+    #end function
+
+    def read(self, path: str) -> bytes | None:
+        raise NotImplementedError()
+
+    def exists(self, path: str) -> bool:
+        raise NotImplementedError()
+
+    def paths(self) -> Iterator[str]:
+        raise NotImplementedError()
+
+    def size(self, path: str) -> int | None:
+        data = self.read(path)
+        return len(data) if data is not None else None
+    #end function
+
+    def digest(self, path: str) -> str | None:
+        data = self.read(path)
+        return hashlib.sha256(data).hexdigest() if data is not None \
+            else None
+    #end function
+
+    def publish(self) -> dict[str, list[str]] | None:
+        return None
+
+    def discard(self) -> None:
+        pass
+
+#end class
+
+class WriteBuffer(Output):
+
+    # Collects the outputs of a pool worker, so that they can be written to
+    # an output that only exists in the parent process.
+
+    def __init__(self):
+        super().__init__("buffer")
+        self.writes = []
+
+    def write(self, path: str, data: bytes | str,
+            mtime: float | None = None) -> None:
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        self.writes.append((path, data, mtime))
+    #end function
+
+    def read(self, path: str) -> bytes | None:
+        for written_path, data, _ in reversed(self.writes):
+            if written_path == path:
+                return data
+        return None
+    #end function
+
+    def exists(self, path: str) -> bool:
+        return self.read(path) is not None
+
+    def paths(self) -> Iterator[str]:
+        return iter(sorted(set(path for path, _, _ in self.writes)))
+
+#end class
+
+class MemoryOutput(Output):
+
+    def __init__(self):
+        super().__init__("memory")
+        self.files  = {}
+        self.mtimes = {}
+    #end function
+
+    def __getstate__(self) -> dict[str, Any]:
+        # Pool workers never write here, there is no point in sending them
+        # a copy of the whole site.
+        return {"location": self.location, "files": {}, "mtimes": {}}
+
+    def begin(self) -> None:
+        self.files  = {}
+        self.mtimes = {}
+    #end function
+
+    def write(self, path: str, data: bytes | str,
+            mtime: float | None = None) -> None:
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+
+        path = path.strip("/")
+
+        self.files[path]  = data
+        self.mtimes[path] = time.time() if mtime is None else mtime
+    #end function
+
+    def read(self, path: str) -> bytes | None:
+        return self.files.get(path.strip("/"))
+
+    def exists(self, path: str) -> bool:
+        return path.strip("/") in self.files
+
+    def paths(self) -> Iterator[str]:
+        return iter(sorted(self.files))
+
+#end class
+
+class ArchiveOutput(Output):
+
+    # Small text assets are kept in memory, because later build steps read
+    # them back. Everything else is only streamed into the archive.
+    RETAINED_EXTENSIONS = ["css", "html", "js", "json", "svg"]
+
+    def __init__(self, filename: str):
+        super().__init__(filename)
+        self._partfile = filename + ".part"
+        self._archive  = None
+        self._entries  = {}
+        self._retained = {}
+        self._lock     = threading.Lock()
+    #end function
+
+    def __getstate__(self) -> dict[str, Any]:
+        return {
+            "location":  self.location,
+            "_partfile": self._partfile,
+            "_archive":  None,
+            "_entries":  {},
+            "_retained": {}
+        }
+    #end function
+
+    def __setstate__(self, state: dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def begin(self) -> None:
+        self._entries  = {}
+        self._retained = {}
+
+        if self.location.endswith(".zip"):
+            self._archive = zipfile.ZipFile(self._partfile, "w")
+            return
+
+        for suffix, mode in TAR_MODES.items():
+            if self.location.endswith(suffix):
+                self._archive = tarfile.open(self._partfile, mode)
+                return
+        #end for
+
+        raise SnazzyError(
+            "unsupported archive format: {}".format(self.location)
+        )
+    #end function
+
+    def write(self, path: str, data: bytes | str,
+            mtime: float | None = None) -> None:
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+
+        path = path.strip("/")
+
+        if mtime is None:
+            mtime = time.time()
+
+        ext = path.rsplit(".", 1)[-1].lower()
+        digest = hashlib.sha256(data).hexdigest()
+
+        # Pages and assets are written from several threads at once.
+        with self._lock:
+            # Archive members cannot be replaced once they have been
+            # streamed.
+            if path in self._entries:
+                raise SnazzyError(
+                    "{} is written twice to {}".format(path, self.location)
+                )
+
+            if isinstance(self._archive, zipfile.ZipFile):
+                info = zipfile.ZipInfo(path, time.localtime(mtime)[:6])
+                info.external_attr = 0o644 << 16
+                info.compress_type = zipfile.ZIP_STORED \
+                    if ext in COMPRESSED_EXTENSIONS else zipfile.ZIP_DEFLATED
+                self._archive.writestr(info, data)
+            else:
+                info = tarfile.TarInfo(path)
+                info.size  = len(data)
+                info.mtime = int(mtime)
+                info.mode  = 0o644
+                self._archive.addfile(info, io.BytesIO(data))
+            #end if
+
+            self._entries[path] = (len(data), digest)
+
+            if ext in self.RETAINED_EXTENSIONS:
+                self._retained[path] = data
+        #end with
+    #end function
+
+    def read(self, path: str) -> bytes | None:
+        return self._retained.get(path.strip("/"))
+
+    def exists(self, path: str) -> bool:
+        return path.strip("/") in self._entries
+
+    def paths(self) -> Iterator[str]:
+        # Sorting a copy, entries may be added while the caller iterates.
+        with self._lock:
+            return iter(sorted(self._entries))
+    #end function
+
+    def size(self, path: str) -> int | None:
+        entry = self._entries.get(path.strip("/"))
+        return entry[0] if entry else None
+    #end function
+
+    def digest(self, path: str) -> str | None:
+        entry = self._entries.get(path.strip("/"))
+        return entry[1] if entry else None
+    #end function
+
+    def publish(self) -> dict[str, list[str]] | None:
+        with self._lock:
+            self._archive.close()
+            self._archive = None
+        os.replace(self._partfile, self.location)
+        return None
+    #end function
+
+    def discard(self) -> None:
+        with self._lock:
+            if self._archive is not None:
+                self._archive.close()
+                self._archive = None
+        if os.path.exists(self._partfile):
+            os.unlink(self._partfile)
+    #end function
+
+#end class
+
+class SiteDirectory(Output):
+
+    WORKER_WRITES = True
+
+    def __init__(self, sitedir: str):
+        super().__init__(sitedir)
+        self._sitedir  = sitedir
+        self._stagedir = sitedir + ".staging"
+    #end function
+
+    def begin(self) -> None:
+        if os.path.exists(self._stagedir):
+            shutil.rmtree(self._stagedir)
+        os.makedirs(self._stagedir)
+    #end function
+
+    def seed_from_live(self) -> None:
+        # For partial builds, the staging directory starts out as a copy of
+        # the live site, made of hard links, and outputs replace the links.
+        for dirpath, _, filenames in os.walk(self._sitedir):
+            for filename in filenames:
+                live = os.path.join(dirpath, filename)
+                staged = os.path.join(
+                    self._stagedir, os.path.relpath(live, self._sitedir)
+                )
+
+                os.makedirs(os.path.dirname(staged), exist_ok=True)
+
+                if not self._link(live, staged):
+                    shutil.copy2(live, staged)
+            #end for
+        #end for
+    #end function
+
+    def write(self, path: str, data: bytes | str,
+            mtime: float | None = None) -> None:
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+
+        staged, live = self._prepare(path)
+
+        # An unchanged output is linked from the live tree, so it keeps its
+        # inode and mtime and sync tools can skip it.
+        if os.path.isfile(live) and os.path.getsize(live) == len(data):
+            with open(live, "rb") as f:
+                unchanged = f.read() == data
+            if unchanged and self._link(live, staged):
+                return
+        #end if
+
+        with open(staged, "wb") as f:
+            f.write(data)
+        if mtime is not None:
+            os.utime(staged, (mtime, mtime))
+    #end function
+
+    def copy(self, srcfile: str, path: str) -> None:
+        staged, live = self._prepare(path)
+
+        if os.path.isfile(live) and \
+                filecmp.cmp(srcfile, live, shallow=False) and \
+                    self._link(live, staged):
+            return
+
+        shutil.copy2(srcfile, staged)
+    #end function
+
+    def read(self, path: str) -> bytes | None:
+        try:
+            with open(self._staged_path(path), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+    #end function
+
+    def exists(self, path: str) -> bool:
+        return os.path.isfile(self._staged_path(path))
+
+    def size(self, path: str) -> int | None:
+        try:
+            return os.path.getsize(self._staged_path(path))
+        except OSError:
+            return None
+    #end function
+
+    def paths(self) -> Iterator[str]:
+        for dirpath, dirnames, filenames in os.walk(self._stagedir):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                yield os.path.relpath(
+                    os.path.join(dirpath, filename), self._stagedir
+                ).replace(os.sep, "/")
+        #end for
+    #end function
+
+    def publish(self) -> dict[str, list[str]]:
+        changes = self._compare_to_live()
+
+        if os.path.islink(self._sitedir):
+            self._swap_link()
+        elif os.path.exists(self._sitedir):
+            if self._exchange(self._stagedir, self._sitedir):
+                shutil.rmtree(self._stagedir)
+            else:
+                self._swap_link()
+        else:
+            os.rename(self._stagedir, self._sitedir)
+        #end if
+
+        return changes
+    #end function
+
+    def discard(self) -> None:
+        if os.path.exists(self._stagedir):
+            shutil.rmtree(self._stagedir)
+
+    def _link(self, live: str, staged: str) -> bool:
+        try:
+            os.link(live, staged)
+        except OSError:
+            return False
+        return True
+    #end function
+
+    def _staged_path(self, path: str) -> str:
+        return os.path.join(self._stagedir, *path.strip("/").split("/"))
+
+    def _prepare(self, path: str) -> tuple[str, str]:
+        relpath = path.strip("/").split("/")
+        staged  = os.path.join(self._stagedir, *relpath)
+        live    = os.path.join(self._sitedir, *relpath)
+
+        os.makedirs(os.path.dirname(staged), exist_ok=True)
+
+        if os.path.lexists(staged):
+            os.unlink(staged)
+
+        return staged, live
+    #end function
+
+    def _compare_to_live(self) -> dict[str, list[str]]:
+        changes = {"added": [], "modified": [], "removed": []}
+        staged_paths = set()
+
+        for path in self.paths():
+            staged_paths.add(path)
+            live = os.path.join(self._sitedir, *path.split("/"))
+
+            if not os.path.isfile(live):
+                changes["added"].append(path)
+            elif not os.path.samefile(live, self._staged_path(path)):
+                changes["modified"].append(path)
+        #end for
+
+        for dirpath, _, filenames in os.walk(self._sitedir):
+            for filename in filenames:
+                path = os.path.relpath(
+                    os.path.join(dirpath, filename), self._sitedir
+                ).replace(os.sep, "/")
+                if path not in staged_paths:
+                    changes["removed"].append(path)
+            #end for
+        #end for
+
+        changes["removed"].sort()
+        return changes
+    #end function
+
+    def _swap_link(self) -> None:
+        # Without renameat2, _site becomes a symlink to the latest build,
+        # and replacing a symlink is a single rename as well.
+        build = "{}.{}".format(self._sitedir, os.urandom(4).hex())
+        os.rename(self._stagedir, build)
+
+        link = self._sitedir + ".link"
+        if os.path.lexists(link):
+            os.unlink(link)
+        os.symlink(os.path.basename(build), link)
+
+        if os.path.islink(self._sitedir):
+            oldsite = os.path.realpath(self._sitedir)
+        else:
+            # Turning the directory into a link is the one step in which
+            # _site is missing for a moment.
+            oldsite = self._sitedir + ".old"
+            if os.path.exists(oldsite):
+                shutil.rmtree(oldsite)
+            os.rename(self._sitedir, oldsite)
+        #end if
+
+        os.replace(link, self._sitedir)
+        shutil.rmtree(oldsite)
+    #end function
+
+    def _exchange(self, path1: str, path2: str) -> bool:
+        # Swaps both trees in a single step where the platform allows it,
+        # so readers never see a missing or half-written site.
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            renameat2 = libc.renameat2
+        except (AttributeError, OSError, TypeError):
+            return False
+
+        AT_FDCWD = -100
+        RENAME_EXCHANGE = 2
+
+        result = renameat2(
+            AT_FDCWD, os.fsencode(path1),
+            AT_FDCWD, os.fsencode(path2),
+            RENAME_EXCHANGE
+        )
+
+        if result != 0:
+            LOGGER.debug(
+                "renameat2 failed: {}".format(os.strerror(ctypes.get_errno()))
+            )
+            return False
+        #end if
+
+        return True
+    #end function
+
+#end class
@@ -25,7 +25,6 @@
 
 import logging
 import os
-import shutil
 
 from multiprocessing.pool import Pool
 
@@ -36,10 +35,12 @@ LOGGER = logging.getLogger(__name__)
 
 class PrepTask(Task):
 
+    VENDOR_MODULES = ["handlebars", "jquery", "marked"]
+
     def execute(self, worker_pool: Pool) -> None:
         self._sanity_check()
 
-        for module in ["handlebars", "jquery", "marked"]:
+        for module in self._objects:
             self._copy_js_module(module)
     #end function
 
@@ -80,21 +81,16 @@ class PrepTask(Task):
                 .format(module_name)
             )
 
-        destdir = os.path.join(
-            self._sitedir, "static", self._prefix, "ext", "js"
-        )
-        dstfile = os.path.join(
-            destdir, "{}.js".format(module_name)
+        dstpath = self._site_path(
+            "/static/ext/js/{}.js".format(module_name)
         )
 
         LOGGER.info(
             "installing {} to /static/ext/js/{}"
-            .format(module_name, os.path.basename(dstfile))
+            .format(module_name, os.path.basename(dstpath))
         )
 
-        if not os.path.exists(dstfile):
-            os.makedirs(destdir, exist_ok=True)
-            shutil.copyfile(srcfile, dstfile)
+        self._output.copy(srcfile, dstpath)
     #end function
 
 #end class
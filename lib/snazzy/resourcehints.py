@@ -0,0 +1,220 @@
+# -*- encoding: utf-8 -*-
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2024 Tobias Koch <tobias.koch@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+import os
+import re
+
+from urllib.parse import urljoin, urlparse
+
+from lxml import etree
+
+FONT_TYPES = {
+    "otf":   "font/otf",
+    "ttf":   "font/ttf",
+    "woff":  "font/woff",
+    "woff2": "font/woff2",
+}
+
+IMAGE_EXTENSIONS = ["avif", "gif", "jpeg", "jpg", "png", "svg", "webp"]
+
+class ResourceHints:
+
+    def __init__(self, app_bundles: list[str], max_images: int = 4):
+        # File names of the app scripts, e.g. app-1a2b.js and, with
+        # differential bundles, app-1a2b.module.js.
+        self._app_bundles = app_bundles
+        self._max_images = max_images
+
+    def apply(self, root: etree.Element, stylesheets: dict[str, str]) \
+            -> None:
+        head = root.find("head")
+        if head is None:
+            return
+
+        preloads = []
+
+        for script in root.iter("script"):
+            src = script.get("src")
+            if not src:
+                continue
+
+            # Legacy builds are only fetched by browsers that don't know
+            # about modules, preloading them would waste bandwidth.
+            if script.get("nomodule") is not None:
+                continue
+
+            if self._is_app_bundle(src):
+                self._defer_app_script(root, script)
+                script.set("fetchpriority", script.get("fetchpriority",
+                    "high"))
+            elif "/ext/js/" in src:
+                script.set("fetchpriority", script.get("fetchpriority",
+                    "high"))
+            else:
+                continue
+
+            if script.get("type") == "module":
+                preloads.append(("modulepreload", src, None, None))
+            else:
+                preloads.append(("preload", src, "script", None))
+        #end for
+
+        # Stylesheets linked from the head are requested as soon as the
+        # parser gets to them, a preload would only add bytes. The ones in
+        # the body and the ones pulled in with @import are found late.
+        head_stylesheets = set(
+            link.get("href") for link in head.iter("link")
+                if "stylesheet" in (link.get("rel") or "").lower().split()
+        )
+
+        for href in stylesheets:
+            if href not in head_stylesheets:
+                preloads.append(("preload", href, "style", None))
+        for url in self._collect_imports(stylesheets):
+            if url not in head_stylesheets:
+                preloads.append(("preload", url, "style", None))
+
+        fonts, images = self._collect_css_urls(stylesheets)
+
+        for url in fonts:
+            ext = url.rsplit(".", 1)[-1].lower()
+            preloads.append(("preload", url, "font", FONT_TYPES[ext]))
+        for url in images[:self._max_images]:
+            preloads.append(("preload", url, "image", None))
+
+        self._insert_preloads(head, preloads)
+    #end function
+
+    def _is_app_bundle(self, src: str) -> bool:
+        return os.path.basename(urlparse(src).path) in self._app_bundles
+
+    def _defer_app_script(self, root: etree.Element,
+            script: etree.Element) -> None:
+        if script.get("defer") is not None or \
+                script.get("async") is not None or \
+                    script.get("type") == "module":
+            return
+
+        # Deferring the bundle is only safe if no classic script that runs
+        # later during parsing could depend on it.
+        found = False
+
+        for element in root.iter("script"):
+            if element is script:
+                found = True
+                continue
+            if not found:
+                continue
+            if element.get("defer") is None and \
+                    element.get("async") is None and \
+                        element.get("type") != "module":
+                return
+        #end for
+
+        script.set("defer", "defer")
+    #end function
+
+    def _collect_imports(self, stylesheets: dict[str, str]) -> list[str]:
+        urls = []
+
+        for href, css in stylesheets.items():
+            for m in re.finditer(
+                    r"@import\s+(?:url\(\s*)?(['\"]?)([^'\")\s;]+)\1",
+                        css, re.IGNORECASE):
+                url = urljoin(href, m.group(2))
+                if not url.startswith("data:") and url not in urls:
+                    urls.append(url)
+            #end for
+        #end for
+
+        return urls
+    #end function
+
+    def _collect_css_urls(self, stylesheets: dict[str, str]) \
+            -> tuple[list[str], list[str]]:
+        fonts  = []
+        images = []
+
+        for href, css in stylesheets.items():
+            for m in re.finditer(
+                    r"url\(\s*(['\"]?)([^'\")]+)\1\s*\)", css):
+                url = m.group(2).strip()
+
+                if url.startswith("data:") or url.startswith("#"):
+                    continue
+
+                url = urljoin(href, url)
+                ext = urlparse(url).path.rsplit(".", 1)[-1].lower()
+
+                if ext in FONT_TYPES and url not in fonts:
+                    fonts.append(url)
+                elif ext in IMAGE_EXTENSIONS and url not in images:
+                    images.append(url)
+            #end for
+        #end for
+
+        # @font-face rules usually list several formats of the same font,
+        # browsers that support preload all pick woff2.
+        woff2 = [url for url in fonts if url.lower().endswith(".woff2")]
+        if woff2:
+            fonts = woff2
+
+        return fonts, images
+    #end function
+
+    def _insert_preloads(self, head: etree.Element,
+            preloads: list[tuple[str, str, str | None, str | None]]) -> None:
+        existing = set()
+
+        for link in head.iter("link"):
+            existing.add((link.get("rel"), link.get("href")))
+
+        index = 0
+
+        # Hints go after <meta charset> and friends, but ahead of the
+        # resources they refer to.
+        for i, child in enumerate(head):
+            if child.tag in ["meta", "title", "base"]:
+                index = i + 1
+
+        for rel, href, as_type, mime_type in preloads:
+            if (rel, href) in existing:
+                continue
+            existing.add((rel, href))
+
+            link = etree.Element("link", rel=rel, href=href)
+            if as_type:
+                link.set("as", as_type)
+            if mime_type:
+                link.set("type", mime_type)
+            if as_type == "font":
+                link.set("crossorigin", "anonymous")
+
+            head.insert(index, link)
+            index += 1
+        #end for
+    #end function
+
+#end class
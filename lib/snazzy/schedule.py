@@ -0,0 +1,512 @@
+# -*- encoding: utf-8 -*-
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2024 Tobias Koch <tobias.koch@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+import functools
+import heapq
+import json
+import logging
+import multiprocessing
+import os
+import pickle
+import statistics
+import threading
+import time
+
+from multiprocessing.pool import Pool
+from typing import Any, Callable
+
+from snazzy.config import STATE_DIR
+from snazzy.error import BuildCancelled, SnazzyError
+from snazzy.toolrunner import cancel, cancelled, keep_going, record_error
+
+LOGGER = logging.getLogger(__name__)
+
+STATS_FILE = os.path.join(STATE_DIR, "durations.json")
+
+# Used for files of a type that was never built before, roughly what sass
+# and babel need per byte of input on top of their startup time.
+DEFAULT_STARTUP_TIME     = 0.3
+DEFAULT_SECONDS_PER_BYTE = 2e-6
+
+class DurationStats:
+
+    def __init__(self, filename: str = STATS_FILE):
+        self._filename = filename
+        self._lock     = threading.Lock()
+        self._entries  = {}
+        self._rates    = {}
+        self._rates_at = 0
+
+        try:
+            with open(filename, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+            if isinstance(entries, dict):
+                self._entries = entries
+        except (OSError, ValueError):
+            pass
+    #end function
+
+    def estimate(self, srcfile: str) -> float:
+        key = os.path.relpath(srcfile)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry:
+                return entry["seconds"]
+
+            # Without history, the duration is extrapolated from files of
+            # the same type, assuming it grows with the file size. Results
+            # are recorded while estimates are still being asked for, so the
+            # rates are only worked out again once the history has doubled.
+            if len(self._entries) >= 2 * self._rates_at:
+                self._rates = {}
+                self._rates_at = max(len(self._entries), 1)
+            #end if
+
+            ext = os.path.splitext(key)[1]
+
+            if ext not in self._rates:
+                rates = [
+                    e["seconds"] / e["size"]
+                        for k, e in self._entries.items()
+                            if os.path.splitext(k)[1] == ext and
+                                e["size"] > 0
+                ]
+                self._rates[ext] = statistics.median(rates) if rates \
+                    else None
+            #end if
+
+            rate = self._rates[ext]
+        #end with
+
+        size = self._file_size(srcfile)
+
+        if rate is not None:
+            return rate * size
+
+        return DEFAULT_STARTUP_TIME + DEFAULT_SECONDS_PER_BYTE * size
+    #end function
+
+    def record(self, srcfile: str, seconds: float) -> None:
+        with self._lock:
+            self._entries[os.path.relpath(srcfile)] = {
+                "seconds": round(seconds, 4),
+                "size": self._file_size(srcfile)
+            }
+        #end with
+    #end function
+
+    def save(self) -> None:
+        with self._lock:
+            entries = {
+                key: entry for key, entry in self._entries.items()
+                    if os.path.exists(key)
+            }
+        #end with
+
+        os.makedirs(os.path.dirname(self._filename), exist_ok=True)
+
+        with open(self._filename, "w", encoding="utf-8") as f:
+            json.dump(entries, f, indent=2, sort_keys=True)
+            f.write("\n")
+    #end function
+
+    def _file_size(self, srcfile: str) -> int:
+        try:
+            return os.path.getsize(srcfile)
+        except OSError:
+            return 0
+    #end function
+
+#end class
+
+_stats = None
+_stats_lock = threading.Lock()
+
+def duration_stats() -> DurationStats:
+    global _stats
+
+    with _stats_lock:
+        if _stats is None:
+            _stats = DurationStats()
+        return _stats
+    #end with
+#end function
+
+def save_duration_stats() -> None:
+    with _stats_lock:
+        if _stats is not None:
+            _stats.save()
+    #end with
+#end function
+
+# Chunks shrink as the remaining work does, a chunk gets about this
+# fraction of what is left per worker. Expensive jobs end up alone in their
+# chunk, cheap ones like plain file copies are batched.
+CHUNKS_PER_WORKER = 4
+
+# The function a worker calls for the items of the current run. It is sent
+# along with every chunk, but unpickled only once per worker and run.
+_context_id = 0
+_worker_context = (None, None)
+
+def _next_context_id() -> int:
+    global _context_id
+
+    with _stats_lock:
+        _context_id += 1
+        return _context_id
+    #end with
+#end function
+
+def _context_func(context_id: int, context: bytes) -> Callable[[Any], Any]:
+    global _worker_context
+
+    if _worker_context[0] != context_id:
+        _worker_context = (context_id, pickle.loads(context))
+
+    return _worker_context[1]
+#end function
+
+def _run_chunk(job: tuple[int, bytes, list[tuple[int, Any]], bool]) \
+        -> list[tuple[int, Any, float, str | None]]:
+    context_id, context, chunk, collect_errors = job
+
+    func = _context_func(context_id, context)
+    results = []
+
+    for index, item in chunk:
+        start = time.monotonic()
+
+        try:
+            result = func(item)
+        except BuildCancelled:
+            raise
+        except Exception as e:
+            message = "{}: {}".format(item, str(e))
+
+            if not collect_errors:
+                raise SnazzyError(message)
+
+            results.append((index, None, time.monotonic() - start, message))
+            continue
+        #end try
+
+        results.append((index, result, time.monotonic() - start, None))
+    #end for
+
+    return results
+#end function
+
+def _next_result(iterator: Any) -> list[tuple[int, Any, float, str | None]]:
+    # Polls, so that a failure elsewhere in the build ends the wait.
+    while True:
+        if cancelled():
+            raise BuildCancelled("build cancelled")
+
+        try:
+            return iterator.next(timeout=0.1)
+        except multiprocessing.TimeoutError:
+            continue
+        except Exception as e:
+            cancel(e)
+            raise
+    #end while
+#end function
+
+def _make_chunks(order: list[int], estimates: list[float],
+        num_workers: int) -> list[list[int]]:
+    remaining = sum(estimates)
+    chunks = []
+    chunk = []
+    chunk_time = 0.0
+    target = 0.0
+
+    for i in order:
+        if not chunk:
+            target = remaining / (CHUNKS_PER_WORKER * num_workers)
+
+        chunk.append(i)
+        chunk_time += estimates[i]
+        remaining -= estimates[i]
+
+        if chunk_time >= target:
+            chunks.append(chunk)
+            chunk = []
+            chunk_time = 0.0
+        #end if
+    #end for
+
+    if chunk:
+        chunks.append(chunk)
+
+    return chunks
+#end function
+
+def run_longest_first(worker_pool: Pool, func: Callable[[Any], Any],
+        items: list[Any], srcfiles: list[str], label: str) -> list[Any]:
+    if not items:
+        return []
+
+    stats = duration_stats()
+    estimates = [stats.estimate(srcfile) for srcfile in srcfiles]
+
+    order = sorted(
+        range(len(items)), key=lambda i: estimates[i], reverse=True
+    )
+
+    num_workers = getattr(worker_pool, "_processes", None) or 1
+    predicted = _lpt_makespan([estimates[i] for i in order], num_workers)
+
+    chunks = _make_chunks(order, estimates, num_workers)
+
+    # The function, usually a bound method of a task, is pickled once here
+    # rather than once per item by the pool.
+    context_id = _next_context_id()
+    context = pickle.dumps(func)
+    collect_errors = keep_going()
+
+    results = [None] * len(items)
+    start = time.monotonic()
+
+    # The pool hands out one chunk at a time, so that a worker that is done
+    # picks the next longest chunk instead of a precomputed batch.
+    iterator = worker_pool.imap_unordered(
+        _run_chunk, [
+            (context_id, context, [(i, items[i]) for i in chunk],
+                collect_errors)
+            for chunk in chunks
+        ], chunksize=1
+    )
+
+    for _ in range(len(chunks)):
+        for index, result, seconds, error in _next_result(iterator):
+            if error is not None:
+                LOGGER.error(error)
+                record_error(error)
+                continue
+
+            results[index] = result
+            stats.record(srcfiles[index], seconds)
+        #end for
+    #end for
+
+    LOGGER.info(
+        "{}: {} jobs in {} chunks, predicted makespan {:.2f}s, "
+        "actual {:.2f}s".format(
+            label, len(items), len(chunks), predicted,
+            time.monotonic() - start
+        )
+    )
+
+    return results
+#end function
+
+# Items that are submitted one by one are sent out in chunks of about this
+# much estimated work. At most CHUNKS_PER_WORKER chunks per worker are in
+# flight, beyond that, submitting blocks. Items are held back until about
+# as much work as can be in flight has come together, and that window is
+# sent out longest-first.
+STREAM_CHUNK_SECONDS = 0.25
+
+class StreamingRun:
+
+    def __init__(self, worker_pool: Pool, func: Callable[[Any], Any],
+            srcfile: Callable[[Any], str], label: str):
+        self._pool    = worker_pool
+        self._func    = func
+        self._srcfile = srcfile
+        self._label   = label
+        self._stats   = duration_stats()
+
+        self._num_workers = getattr(worker_pool, "_processes", None) or 1
+
+        self._slots = threading.BoundedSemaphore(
+            CHUNKS_PER_WORKER * self._num_workers
+        )
+        self._done = threading.Condition()
+
+        self._context_id  = None
+        self._context     = None
+        self._window      = []
+        self._window_time = 0.0
+        self._estimates   = []
+        self._chunk       = []
+        self._chunk_time  = 0.0
+        self._num_items  = 0
+        self._num_chunks = 0
+        self._pending    = 0
+        self._results    = {}
+        self._error      = None
+        self._start      = time.monotonic()
+
+        self._collect_errors = keep_going()
+    #end function
+
+    def reset_context(self) -> None:
+        # Chunks submitted from now on see the current state of the task.
+        self._dispatch()
+        self._context = None
+    #end function
+
+    def submit(self, item: Any) -> None:
+        srcfile = self._srcfile(item)
+        estimate = self._stats.estimate(srcfile)
+
+        self._window.append((estimate, self._num_items, item, srcfile))
+        self._window_time += estimate
+        self._estimates.append(estimate)
+        self._num_items += 1
+
+        window_seconds = \
+            STREAM_CHUNK_SECONDS * CHUNKS_PER_WORKER * self._num_workers
+        if self._window_time >= window_seconds:
+            self._dispatch()
+    #end function
+
+    def finish(self) -> list[Any]:
+        self._dispatch()
+
+        with self._done:
+            while self._pending and not cancelled():
+                self._done.wait(0.1)
+        #end with
+
+        if self._error is not None:
+            raise self._error
+        if cancelled():
+            raise BuildCancelled("build cancelled")
+
+        predicted = _lpt_makespan(
+            sorted(self._estimates, reverse=True), self._num_workers
+        ) if self._estimates else 0.0
+
+        LOGGER.info(
+            "{}: {} jobs in {} chunks, predicted makespan {:.2f}s, "
+            "actual {:.2f}s".format(
+                self._label, self._num_items, self._num_chunks, predicted,
+                time.monotonic() - self._start
+            )
+        )
+
+        return [self._results.get(i) for i in range(self._num_items)]
+    #end function
+
+    def _dispatch(self) -> None:
+        window = sorted(self._window, key=lambda entry: entry[0], reverse=True)
+        self._window = []
+        self._window_time = 0.0
+
+        for estimate, index, item, srcfile in window:
+            self._chunk.append((index, item, srcfile))
+            self._chunk_time += estimate
+
+            if self._chunk_time >= STREAM_CHUNK_SECONDS:
+                self._flush()
+        #end for
+
+        self._flush()
+    #end function
+
+    def _flush(self) -> None:
+        if not self._chunk:
+            return
+        if cancelled():
+            raise BuildCancelled("build cancelled")
+
+        if self._context is None:
+            self._context_id = _next_context_id()
+            self._context = pickle.dumps(self._func)
+        #end if
+
+        # Holds up the caller, and with it the discovery of more items,
+        # while the workers are busy.
+        while not self._slots.acquire(timeout=0.1):
+            if cancelled():
+                raise BuildCancelled("build cancelled")
+
+        chunk = self._chunk
+        self._chunk = []
+        self._chunk_time = 0.0
+
+        with self._done:
+            self._pending += 1
+        self._num_chunks += 1
+
+        self._pool.apply_async(
+            _run_chunk, ((
+                self._context_id, self._context,
+                    [(index, item) for index, item, _ in chunk],
+                        self._collect_errors
+            ),),
+            callback=functools.partial(
+                self._chunk_done,
+                    {index: srcfile for index, _, srcfile in chunk}
+            ),
+            error_callback=self._chunk_failed
+        )
+    #end function
+
+    def _chunk_done(self, srcfiles: dict[int, str],
+            results: list[tuple[int, Any, float, str | None]]) -> None:
+        for index, result, seconds, error in results:
+            if error is not None:
+                LOGGER.error(error)
+                record_error(error)
+                continue
+
+            self._results[index] = result
+            self._stats.record(srcfiles[index], seconds)
+        #end for
+
+        self._release()
+    #end function
+
+    def _chunk_failed(self, error: BaseException) -> None:
+        if self._error is None:
+            self._error = error
+        cancel(error)
+        self._release()
+    #end function
+
+    def _release(self) -> None:
+        with self._done:
+            self._pending -= 1
+            self._done.notify_all()
+        #end with
+
+        self._slots.release()
+    #end function
+
+#end class
+
+def _lpt_makespan(durations: list[float], num_workers: int) -> float:
+    loads = [0.0] * min(num_workers, len(durations))
+
+    for duration in durations:
+        heapq.heapreplace(loads, loads[0] + duration)
+
+    return max(loads)
+#end function
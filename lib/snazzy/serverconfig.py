@@ -0,0 +1,367 @@
+# -*- encoding: utf-8 -*-
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2024 Tobias Koch <tobias.koch@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+import gzip
+import logging
+import os
+import re
+
+from multiprocessing.pool import Pool
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from snazzy.serviceworker import SW_MANIFEST, SW_SCRIPT
+from snazzy.task import Task
+
+LOGGER = logging.getLogger(__name__)
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+NO_CACHE  = "no-cache"
+
+CONTENT_TYPES = {
+    "avif":        "image/avif",
+    "css":         "text/css",
+    "gif":         "image/gif",
+    "html":        "text/html",
+    "ico":         "image/x-icon",
+    "jpeg":        "image/jpeg",
+    "jpg":         "image/jpeg",
+    "js":          "text/javascript",
+    "json":        "application/json",
+    "map":         "application/json",
+    "mjs":         "text/javascript",
+    "otf":         "font/otf",
+    "png":         "image/png",
+    "svg":         "image/svg+xml",
+    "ttf":         "font/ttf",
+    "txt":         "text/plain",
+    "wasm":        "application/wasm",
+    "webmanifest": "application/manifest+json",
+    "webp":        "image/webp",
+    "woff":        "font/woff",
+    "woff2":       "font/woff2",
+    "xml":         "application/xml",
+}
+
+TEXT_TYPES = [
+    "css", "html", "js", "json", "map", "mjs", "svg", "txt", "webmanifest",
+    "xml"
+]
+
+# Below this size, compression does not pay for the extra request header
+# and file.
+MIN_COMPRESS_SIZE = 256
+
+def _compress(job: tuple[str, bytes, bool]) -> list[tuple[str, bytes]]:
+    path, data, with_brotli = job
+    variants = []
+
+    compressed = gzip.compress(data, compresslevel=9, mtime=0)
+    if len(compressed) < len(data) * 0.9:
+        variants.append((path + ".gz", compressed))
+
+    if with_brotli:
+        compressed = brotli.compress(data)
+        if len(compressed) < len(data) * 0.9:
+            variants.append((path + ".br", compressed))
+    #end if
+
+    return variants
+#end function
+
+class ServerConfig(Task):
+
+    FORMATS = ["apache", "headers", "nginx"]
+
+    def execute(self, worker_pool: Pool) -> None:
+        settings = self._config.get("server_config")
+        if not isinstance(settings, dict):
+            settings = {}
+
+        formats = settings.get("formats", self.FORMATS)
+        precompress = settings.get("precompress", True)
+
+        paths = list(self._output.paths())
+
+        encodings = []
+
+        if precompress:
+            encodings = self._precompress(worker_pool, paths)
+
+        extensions = sorted(set(
+            path.rsplit(".", 1)[-1].lower() for path in paths
+                if "." in path
+        ) & set(CONTENT_TYPES))
+
+        if "apache" in formats:
+            self._output.write(
+                ".htaccess", self._apache_config(extensions, encodings)
+            )
+        if "headers" in formats:
+            self._output.write("_headers", self._headers_file(paths))
+        if "nginx" in formats:
+            self._write_nginx_config(extensions, encodings)
+    #end function
+
+    def _precompress(self, worker_pool: Pool, paths: list[str]) -> list[str]:
+        with_brotli = brotli is not None
+
+        if not with_brotli:
+            LOGGER.info("brotli module not found, only writing .gz files")
+
+        jobs = []
+
+        for path in paths:
+            ext = path.rsplit(".", 1)[-1].lower()
+            if ext not in TEXT_TYPES:
+                continue
+
+            data = self._output.read(path)
+            if data is None or len(data) < MIN_COMPRESS_SIZE:
+                continue
+
+            jobs.append((path, data, with_brotli))
+        #end for
+
+        count = 0
+
+        for variants in worker_pool.map(_compress, jobs):
+            for path, data in variants:
+                self._output.write(path, data)
+                count += 1
+        #end for
+
+        LOGGER.info("wrote {} precompressed files".format(count))
+
+        return ["br", "gzip"] if with_brotli else ["gzip"]
+    #end function
+
+    def _hashed_patterns(self) -> tuple[str, str] | None:
+        if not self._prefix:
+            return None
+
+        # The prefix changes with the sources, the patterns match the prefix
+        # of any build, so that pages still cached by clients keep hitting.
+        prefix = "[0-9a-z]{{{}}}".format(len(self._prefix))
+
+        return (
+            "^/static/{}/".format(prefix),
+            "(^|/)app-{}\\.(module\\.)?(js|css)$".format(prefix)
+        )
+    #end function
+
+    def _headers_file(self, paths: list[str]) -> str:
+        # Headers of several matching rules are merged, so there is no
+        # catch-all rule, only rules for exactly what was built.
+        lines = []
+
+        if self._prefix:
+            lines += [
+                "/static/{}/*".format(self._prefix),
+                "  Cache-Control: {}".format(IMMUTABLE),
+            ]
+
+            for path in paths:
+                if re.search(self._hashed_patterns()[1], "/" + path):
+                    lines += [
+                        "/" + path,
+                        "  Cache-Control: {}".format(IMMUTABLE),
+                    ]
+            #end for
+        #end if
+
+        for path in paths:
+            if not (path.endswith(".html") or
+                    path in [SW_SCRIPT, SW_MANIFEST]):
+                continue
+
+            urls = ["/" + path]
+            if os.path.basename(path) == "index.html":
+                urls.append("/" + path[:-len("index.html")])
+
+            for url in urls:
+                lines += [url, "  Cache-Control: {}".format(NO_CACHE)]
+        #end for
+
+        return "\n".join(lines) + "\n"
+    #end function
+
+    def _apache_config(self, extensions: list[str],
+            encodings: list[str]) -> str:
+        lines = [
+            "# Generated by snazzy, changes will be overwritten.",
+            ""
+        ]
+
+        for ext in extensions:
+            lines.append("AddType {} .{}".format(CONTENT_TYPES[ext], ext))
+        text_extensions = [ext for ext in extensions if ext in TEXT_TYPES]
+
+        if text_extensions:
+            lines.append("AddCharset utf-8 {}".format(
+                " ".join("." + ext for ext in text_extensions)
+            ))
+        lines.append("")
+
+        lines += [
+            "<IfModule mod_headers.c>",
+            "    Header set Cache-Control \"{}\"".format(NO_CACHE),
+        ]
+
+        patterns = self._hashed_patterns()
+
+        if patterns:
+            lines += [
+                "    <If \"%{{REQUEST_URI}} =~ m#{}# || "
+                "%{{REQUEST_URI}} =~ m#{}#\">".format(*patterns),
+                "        Header set Cache-Control \"{}\"".format(IMMUTABLE),
+                "    </If>",
+            ]
+        #end if
+
+        lines += ["</IfModule>", ""]
+
+        if encodings:
+            suffix = {"br": "br", "gzip": "gz"}
+            text_types = "|".join(
+                ext for ext in extensions if ext in TEXT_TYPES
+            )
+
+            lines += ["<IfModule mod_rewrite.c>", "    RewriteEngine On"]
+
+            for encoding in encodings:
+                lines += [
+                    "    RewriteCond %{{HTTP:Accept-Encoding}} \\b{}\\b"
+                        .format(encoding),
+                    "    RewriteCond %{{REQUEST_FILENAME}}.{} -f"
+                        .format(suffix[encoding]),
+                    "    RewriteRule ^(.+\\.({}))$ $1.{} [L,E=no-gzip:1,"
+                    "E=no-brotli:1]".format(text_types, suffix[encoding]),
+                ]
+            #end for
+
+            lines += ["</IfModule>", ""]
+
+            for encoding in encodings:
+                lines += [
+                    "AddEncoding {} .{}".format(encoding, suffix[encoding]),
+                ]
+
+                for ext in extensions:
+                    if ext not in TEXT_TYPES:
+                        continue
+                    lines += [
+                        "<FilesMatch \"\\.{}\\.{}$\">".format(
+                            ext, suffix[encoding]),
+                        "    ForceType \"{}; charset=utf-8\"".format(
+                            CONTENT_TYPES[ext]),
+                        "    <IfModule mod_headers.c>",
+                        "        Header append Vary Accept-Encoding",
+                        "    </IfModule>",
+                        "</FilesMatch>",
+                    ]
+                #end for
+            #end for
+        #end if
+
+        return "\n".join(lines) + "\n"
+    #end function
+
+    def _write_nginx_config(self, extensions: list[str],
+            encodings: list[str]) -> None:
+        # The map has to live in the http block, the rest in the server
+        # block of the site, hence two files outside of the site.
+        outdir = self._state_path("server")
+        os.makedirs(outdir, exist_ok=True)
+
+        http_conf = [
+            "# Generated by snazzy. Include in the http block.",
+            "",
+            "map $uri $snazzy_cache_control {",
+        ]
+
+        patterns = self._hashed_patterns()
+
+        if patterns:
+            for pattern in patterns:
+                http_conf.append(
+                    "    \"~{}\" \"{}\";".format(pattern, IMMUTABLE)
+                )
+        #end if
+
+        http_conf += [
+            "    default \"{}\";".format(NO_CACHE),
+            "}",
+        ]
+
+        server_conf = [
+            "# Generated by snazzy. Include in the server block of the site.",
+            "",
+            "add_header Cache-Control $snazzy_cache_control;",
+            "",
+            "types {",
+        ]
+
+        for ext in extensions:
+            server_conf.append("    {} {};".format(CONTENT_TYPES[ext], ext))
+
+        server_conf += [
+            "}",
+            "",
+            "charset utf-8;",
+            "charset_types {};".format(
+                " ".join(sorted(set(
+                    CONTENT_TYPES[ext] for ext in extensions
+                        if ext in TEXT_TYPES
+                )))
+            ),
+        ]
+
+        if "gzip" in encodings:
+            server_conf += ["gzip_static on;", "gzip_vary on;"]
+        if "br" in encodings:
+            server_conf += [
+                "# Requires the ngx_brotli module.",
+                "brotli_static on;",
+            ]
+        #end if
+
+        for name, lines in [("nginx-http.conf", http_conf),
+                ("nginx-server.conf", server_conf)]:
+            with open(os.path.join(outdir, name), "w",
+                    encoding="utf-8") as f:
+                f.write("\n".join(lines) + "\n")
+        #end for
+
+        LOGGER.info(
+            "wrote nginx configuration to {}"
+            .format(os.path.relpath(outdir, self._basedir))
+        )
+    #end function
+
+#end class
@@ -0,0 +1,189 @@
+# -*- encoding: utf-8 -*-
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2024 Tobias Koch <tobias.koch@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+import json
+import logging
+import os
+
+from multiprocessing.pool import Pool
+
+from pathspec import PathSpec
+
+from snazzy.task import Task
+
+LOGGER = logging.getLogger(__name__)
+
+SW_SCRIPT   = "sw.js"
+SW_MANIFEST = "precache-manifest.json"
+
+# Cache entries are keyed by content hash rather than URL. Production builds
+# move all assets to a new static prefix, but an asset whose content did not
+# change is still served from the cache after a deploy.
+SW_TEMPLATE = """\
+"use strict";
+
+const MANIFEST = {manifest};
+const CACHE = "snazzy-precache";
+const SCOPE = new URL(self.registration.scope);
+
+function cacheKey(hash) {{
+    return new URL("__precache/" + hash, SCOPE).href;
+}}
+
+function manifestPath(url) {{
+    if (url.origin !== SCOPE.origin ||
+            !url.pathname.startsWith(SCOPE.pathname)) {{
+        return null;
+    }}
+
+    let path = url.pathname.substring(SCOPE.pathname.length);
+    if (path === "" || path.endsWith("/")) {{
+        path += "index.html";
+    }}
+    return path;
+}}
+
+self.addEventListener("install", (event) => {{
+    event.waitUntil((async () => {{
+        const cache = await caches.open(CACHE);
+
+        const entries = Object.entries(MANIFEST);
+
+        await Promise.all(entries.map(async ([path, hash]) => {{
+            if (await cache.match(cacheKey(hash))) {{
+                return;
+            }}
+            const response = await fetch(
+                new URL(path, SCOPE), {{cache: "no-cache"}}
+            );
+            if (response.ok) {{
+                await cache.put(cacheKey(hash), response);
+            }}
+        }}));
+
+        await self.skipWaiting();
+    }})());
+}});
+
+self.addEventListener("activate", (event) => {{
+    event.waitUntil((async () => {{
+        const cache = await caches.open(CACHE);
+        const wanted = new Set(Object.values(MANIFEST).map(cacheKey));
+
+        for (const request of await cache.keys()) {{
+            if (!wanted.has(request.url)) {{
+                await cache.delete(request);
+            }}
+        }}
+
+        await self.clients.claim();
+    }})());
+}});
+
+self.addEventListener("fetch", (event) => {{
+    const request = event.request;
+    if (request.method !== "GET") {{
+        return;
+    }}
+
+    const path = manifestPath(new URL(request.url));
+    const hash = path !== null ? MANIFEST[path] : undefined;
+    if (hash === undefined) {{
+        return;
+    }}
+
+    // Pages are fetched from the network first, so that a new deploy is
+    // picked up on the next visit. Everything else is served from cache.
+    if (request.mode === "navigate") {{
+        event.respondWith(
+            fetch(request).catch(() => caches.match(cacheKey(hash)))
+        );
+    }} else {{
+        event.respondWith(
+            caches.match(cacheKey(hash)).then(
+                (response) => response || fetch(request)
+            )
+        );
+    }}
+}});
+"""
+
+REGISTRATION_TEMPLATE = \
+    "if(\"serviceWorker\" in navigator){{" \
+    "navigator.serviceWorker.register(\"{}\");}}"
+
+class ServiceWorker(Task):
+
+    DEFAULT_MAX_SIZE = 2 * 1024 * 1024
+
+    def execute(self, worker_pool: Pool) -> None:
+        settings = self._config.get("service_worker")
+        if not isinstance(settings, dict):
+            settings = {}
+
+        exclude_spec = PathSpec.from_lines(
+            "gitignore", settings.get("exclude", [])
+        )
+        max_size = settings.get("max_size", self.DEFAULT_MAX_SIZE)
+
+        manifest = {}
+
+        for path in self._output.paths():
+            if path in [SW_SCRIPT, SW_MANIFEST]:
+                continue
+            if exclude_spec.match_file(path):
+                continue
+
+            if self._output.size(path) > max_size:
+                continue
+
+            manifest[path] = self._output.digest(path)[:16]
+        #end for
+
+        LOGGER.info(
+            "writing service worker with {} precached assets"
+            .format(len(manifest))
+        )
+
+        self._output.write(
+            SW_MANIFEST, json.dumps(manifest, indent=2, sort_keys=True) + "\n"
+        )
+
+        self._output.write(
+            SW_SCRIPT, SW_TEMPLATE.format(
+                manifest=json.dumps(manifest, sort_keys=True)
+            )
+        )
+    #end function
+
+    @staticmethod
+    def registration_script(page_url: str) -> str:
+        sw_url = os.path.relpath(
+            "/" + SW_SCRIPT, os.path.dirname(page_url)
+        )
+        return REGISTRATION_TEMPLATE.format(sw_url)
+    #end function
+
+#end class
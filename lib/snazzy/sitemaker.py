@@ -23,28 +23,55 @@
 # THE SOFTWARE.
 #
 
+import glob
+import hashlib
+import json
 import logging
 import os
 import random
+import re
 import shutil
 import string
 import subprocess
 import sys
 import textwrap
+import time
 
-from multiprocessing import Pool
-from pathspec import PathSpec
+from typing import Any, TYPE_CHECKING
 
-from snazzy.appmaker import AppMaker
-from snazzy.component import Component
-from snazzy.copyfiles import CopyFiles
-from snazzy.preptask import PrepTask
-from snazzy.task import Task
+from snazzy.config import Config, STATE_DIR
+
+# Only "make" needs the build machinery. The heavy modules are imported
+# where they are used, so that light commands like "new" start quickly.
+if TYPE_CHECKING:
+    from multiprocessing.pool import Pool
+    from pathspec import PathSpec
+    from snazzy.output import Output
+    from snazzy.task import Task
+    from snazzy.usage import UsageIndex
 
 LOGGER = logging.getLogger(__name__)
 
+# Remembers the static prefix of the live site for partial builds.
+SITE_STATE_FILE = os.path.join(STATE_DIR, "site.json")
+
+def _init_worker(jobserver) -> None:
+    from snazzy import toolrunner
+    from snazzy.jobserver import install as install_jobserver
+
+    install_jobserver(jobserver)
+    toolrunner.init_worker()
+#end function
+
 class SiteMaker:
 
+    def __init__(self):
+        # The build daemon keeps the SiteMaker between builds and replaces
+        # it when the ignore files change.
+        self._ignore_spec = None
+        self._listings    = {}
+    #end function
+
     def prepare(
             self,
             npm_reinstall: bool = False,
@@ -58,22 +85,179 @@ class SiteMaker:
         return self
     #end function
 
-    def make(self, debug: bool = False, num_proc: int = 1) -> "SiteMaker":
+    def make(self, debug: bool = False, num_proc: int = 1,
+            output: "Output | None" = None,
+            opt_level: int | None = None,
+            keep_going: bool = False,
+            only: list[str] | None = None,
+            worker_pool: "Pool | None" = None) -> "SiteMaker":
+        from multiprocessing import Pool
+        from pathspec import PathSpec
+        from snazzy import toolrunner
+        from snazzy.error import BuildCancelled, SnazzyError
+        from snazzy.jobserver import JobServer
+        from snazzy.jobserver import install as install_jobserver
+        from snazzy.output import SiteDirectory
+        from snazzy.schedule import save_duration_stats
+        from snazzy.task import DEFAULT_OPT_LEVEL
+        from snazzy.toolchain import update_toolchain
+
+        start_time = time.monotonic()
+
+        toolrunner.reset(keep_going)
+
+        # Caches keyed on the toolchain must not see a fingerprint from
+        # before modules were installed or updated by hand.
+        toolchain = update_toolchain()
+
+        config = Config.load()
+
+        if opt_level is None:
+            opt_level = config.get("optimization_level", DEFAULT_OPT_LEVEL)
+
+        only_spec = None
+        live_site = output is None
+
+        if only:
+            if not live_site:
+                raise SnazzyError("partial builds only work on _site")
+
+            site_state = self._read_site_state()
+            if site_state is None:
+                raise SnazzyError(
+                    "partial builds need a previous full build in _site"
+                )
+
+            # The pages that are not rebuilt must not be mixed with pages
+            # built in another mode or at another level.
+            if site_state["debug"] != debug or \
+                    site_state["opt_level"] != opt_level:
+                raise SnazzyError(
+                    "_site was built with debug={} and opt_level={}, run a "
+                    "full build to change them".format(
+                        site_state["debug"], site_state["opt_level"]
+                    )
+                )
+            #end if
+
+            # The pages that are not rebuilt link to the assets below the
+            # current prefix, so a partial build has to stick with it.
+            prefix = site_state["static_prefix"]
+
+            only_spec = PathSpec.from_lines("gitignore", only)
+        elif not debug:
+            prefix = self._content_prefix(opt_level, toolchain["fingerprint"])
+        else:
+            prefix = ""
+        #end if
+
         LOGGER.info("building site with {} processes".format(num_proc))
 
-        tasks = self._create_tasks(debug=debug)
+        jobserver = JobServer.from_environment()
+        if jobserver:
+            LOGGER.info("taking job tokens from the make jobserver")
+        install_jobserver(jobserver)
+
+        # By default, everything is built in a staging directory, which
+        # replaces the live _site directory only once the build has
+        # succeeded.
+        if output is None:
+            output = SiteDirectory(
+                os.path.join(os.path.abspath("."), "_site")
+            )
+        output.begin()
+
+        if only_spec is not None:
+            output.seed_from_live()
 
-        with Pool(processes=num_proc) as pool:
-            for t in tasks:
-                t.execute(pool)
+        try:
+            tasks = self._create_tasks(
+                debug=debug, config=config, output=output,
+                    opt_level=opt_level, static_prefix=prefix
+            )
+
+            # Leaving the with block terminates the pool, which kills the
+            # tools that are still running in the workers.
+            if worker_pool is not None:
+                self._run_tasks(tasks, worker_pool, debug=debug,
+                    config=config, only_spec=only_spec)
+            else:
+                with Pool(processes=num_proc, initializer=_init_worker,
+                        initargs=(jobserver,)) as pool:
+                    self._run_tasks(tasks, pool, debug=debug,
+                        config=config, only_spec=only_spec)
+            #end if
+        except BaseException as e:
+            # A pool that was passed in is terminated as well, its workers
+            # must not write to the output while it is discarded.
+            if worker_pool is not None:
+                worker_pool.terminate()
+
+            toolrunner.kill_tools()
+            output.discard()
+
+            # Other jobs fail with BuildCancelled once the first error has
+            # cancelled the build, the first error is the one to report.
+            if isinstance(e, BuildCancelled) and toolrunner.first_error():
+                raise toolrunner.first_error() from None
+            raise
+        finally:
+            install_jobserver(None)
+        #end try
+
+        errors = toolrunner.errors()
+
+        if errors:
+            for error in errors:
+                LOGGER.error(error)
+            output.discard()
+            raise SnazzyError(
+                "build failed with {} error{}".format(
+                    len(errors), "" if len(errors) == 1 else "s"
+                )
+            )
+        #end if
+
+        # The build time of a partial build says nothing about the level.
+        if not debug and only_spec is None:
+            self._report_optimization(
+                output, opt_level, time.monotonic() - start_time
+            )
+
+        changes = output.publish()
+        save_duration_stats()
+
+        if live_site:
+            self._write_site_state(prefix, debug, opt_level)
+
+        if changes is None:
+            LOGGER.info("published site to {}".format(output.location))
+            return self
+
+        self._write_changed_files(changes)
+
+        LOGGER.info(
+            "published {}: {} added, {} modified, {} removed".format(
+                os.path.relpath(output.location),
+                len(changes["added"]),
+                len(changes["modified"]),
+                len(changes["removed"])
+            )
+        )
 
         return self
     #end function
 
     def clean(self) -> "SiteMaker":
-        if os.path.exists("_site"):
-            LOGGER.info("removing _site folder")
-            shutil.rmtree("_site")
+        # Where _site is a symlink, the builds it points to are named
+        # _site.<id> and go along with it.
+        for item in ["_site"] + sorted(glob.glob("_site.*")):
+            if os.path.islink(item):
+                os.unlink(item)
+            elif os.path.isdir(item):
+                LOGGER.info("removing {} folder".format(item))
+                shutil.rmtree(item)
+        #end for
 
         return self
     #end function
@@ -82,6 +266,7 @@ class SiteMaker:
         self.clean()
 
         things_to_remove = [
+            STATE_DIR,
             ".babelrc",
             "node_modules",
             "package-lock.json"
@@ -100,6 +285,8 @@ class SiteMaker:
     #end function
 
     def new(self, component_name) -> "SiteMaker":
+        from snazzy.component import Component
+
         sys.stdout.write(Component(component_name).generate())
         return self
     #end function
@@ -118,11 +305,12 @@ class SiteMaker:
                     """\
                     /.babelrc
                     /_site/
+                    /{}/
                     /node_modules/
                     /package-lock.json
                     .*.swp
                     """
-                )
+                ).format(STATE_DIR)
             )
         #end with
 
@@ -133,17 +321,19 @@ class SiteMaker:
             self,
             npm_reinstall: bool = False,
             npm_update: bool = False) -> "SiteMaker":
+        from snazzy.toolchain import NPM_MODULES, current_toolchain, \
+            is_complete, record_toolchain, recorded_toolchain
 
-        modules = [
-            "@babel/core",
-            "@babel/cli",
-            "@babel/preset-env",
-            "handlebars",
-            "jquery",
-            "marked",
-            "sass",
-            "terser"
-        ]
+        if not (npm_reinstall or npm_update):
+            toolchain = current_toolchain()
+            recorded = recorded_toolchain()
+
+            if is_complete(toolchain) and recorded is not None and \
+                    recorded.get("fingerprint") == toolchain["fingerprint"]:
+                LOGGER.info("toolchain unchanged, skipping npm")
+                return self
+            #end if
+        #end if
 
         if npm_reinstall:
             if os.path.exists("package.json"):
@@ -154,11 +344,15 @@ class SiteMaker:
         if os.path.exists("package.json") and npm_update:
             cmd = ["npm", "update"]
         else:
-            cmd = ["npm", "install", "--save-dev", *modules]
+            cmd = ["npm", "install", "--save-dev", *NPM_MODULES]
 
         LOGGER.info("running npm {}...".format(cmd[1]))
 
         subprocess.run(cmd)
+
+        # npm rewrites package.json and package-lock.json, the fingerprint
+        # is taken afterwards.
+        record_toolchain(current_toolchain())
         return self
     #end function
 
@@ -183,7 +377,9 @@ class SiteMaker:
         return self
     #end function
 
-    def _make_ignore_spec(self) -> PathSpec:
+    def _make_ignore_spec(self) -> "PathSpec":
+        from pathspec import PathSpec
+
         ignore_patterns = [
             "/environment.sh",
             "/.git/",
@@ -210,17 +406,78 @@ class SiteMaker:
         return PathSpec.from_lines("gitignore", ignore_patterns)
     #end function
 
-    def _create_tasks(self, debug: bool = False) -> list[Task]:
-        ignore_spec = self._make_ignore_spec()
+    def _create_tasks(self, debug: bool = False,
+            config: Config | None = None,
+            output: "Output | None" = None,
+            opt_level: int | None = None,
+            static_prefix: str | None = None) -> list["Task"]:
+        from snazzy.appmaker import AppMaker
+        from snazzy.copyfiles import CopyFiles
+        from snazzy.output import SiteDirectory
+        from snazzy.preptask import PrepTask
+        from snazzy.serverconfig import ServerConfig
+        from snazzy.serviceworker import ServiceWorker
+        from snazzy.task import DEFAULT_OPT_LEVEL
+
+        if config is None:
+            config = Config()
+
+        if self._ignore_spec is None:
+            self._ignore_spec = self._make_ignore_spec()
 
         basedir = os.path.abspath(".")
         sitedir = os.path.join(basedir, "_site")
 
-        prefix = self._generate_random_string(8) if not debug else ""
+        if static_prefix is None:
+            static_prefix = \
+                self._generate_random_string(8) if not debug else ""
+        prefix = static_prefix
+
+        if output is None:
+            output = SiteDirectory(sitedir)
 
-        preptask = PrepTask(basedir, sitedir, debug, prefix)
-        appmaker = AppMaker(basedir, sitedir, debug, prefix)
-        copyfiles = CopyFiles(basedir, sitedir, debug, prefix)
+        if opt_level is None:
+            opt_level = DEFAULT_OPT_LEVEL
+
+        preptask = PrepTask(basedir, sitedir, debug, prefix, config, output,
+            opt_level)
+        appmaker = AppMaker(basedir, sitedir, debug, prefix, config, output,
+            opt_level)
+        copyfiles = CopyFiles(basedir, sitedir, debug, prefix, config,
+            output, opt_level)
+
+        tasks = [preptask, copyfiles, appmaker]
+
+        if config.get("service_worker"):
+            tasks.append(
+                ServiceWorker(basedir, sitedir, debug, prefix, config,
+                    output, opt_level)
+            )
+
+        # Runs last, it covers everything the other tasks wrote.
+        if config.get("server_config"):
+            tasks.append(
+                ServerConfig(basedir, sitedir, debug, prefix, config,
+                    output, opt_level)
+            )
+
+        return tasks
+    #end function
+
+    def _run_tasks(self, tasks: list["Task"], worker_pool: "Pool",
+            debug: bool = False,
+            config: Config | None = None,
+            only_spec: "PathSpec | None" = None) -> None:
+        from snazzy import toolrunner
+        from snazzy.discovery import Discovery
+        from snazzy.preptask import PrepTask
+
+        if config is None:
+            config = Config()
+
+        preptask, copyfiles, appmaker, *remaining = tasks
+
+        basedir = os.path.abspath(".")
 
         module_by_extension = {
             "css":  copyfiles,
@@ -234,26 +491,321 @@ class SiteMaker:
             "svg":  copyfiles,
         }
 
-        LOGGER.info("compiling tasks")
+        if config.get("prerender_markdown"):
+            module_by_extension["md"] = copyfiles
+
+        # Stylesheets are pruned and pages post-processed with the names
+        # used anywhere on the site, so they have to wait for the index.
+        prune_css = config.get("prune_css") and not debug
+        held_back = []
+        script_sources = []
+
+        LOGGER.info("discovering and building sources")
+
+        copyfiles.start(worker_pool)
+        appmaker.start(worker_pool)
+
+        try:
+            for entry in Discovery(basedir, self._ignore_spec,
+                    self._listings):
+                filename = os.path.basename(entry)
+                ext = filename.rsplit(".", 1)[-1] if "." in filename \
+                    else None
+
+                if ext in ["html", "js"]:
+                    script_sources.append(basedir + entry)
+                if ext not in module_by_extension:
+                    continue
+                # The README of the project is not a page of the site.
+                if entry == "/README.md":
+                    continue
+                if only_spec is not None and \
+                        not self._is_selected(entry, only_spec):
+                    continue
+
+                if prune_css and ext in ["css", "html", "scss"]:
+                    held_back.append(entry)
+                else:
+                    module_by_extension[ext].submit(entry)
+            #end for
+
+            for module in PrepTask.VENDOR_MODULES:
+                # Once Markdown is rendered at build time, marked only needs
+                # to be shipped if some script still calls it.
+                if module == "marked" and \
+                        config.get("prerender_markdown") and \
+                        not self._uses_marked(
+                            script_sources,
+                                config.get("shared_components")):
+                    LOGGER.info(
+                        "all Markdown is prerendered, omitting marked"
+                    )
+                    appmaker.omit_vendor_module(module)
+                    continue
+                #end if
+
+                preptask.add_object(module)
+            #end for
 
-        for dirpath, dirnames, filenames in os.walk(basedir):
-            for entry in filenames:
-                full_path = os.path.join(dirpath, entry)
+            if prune_css:
+                index = self._make_usage_index(script_sources, config)
+                copyfiles.set_usage_index(index)
+                appmaker.set_usage_index(index)
+
+                for entry in held_back:
+                    module_by_extension[entry.rsplit(".", 1)[-1]] \
+                        .submit(entry)
+                #end for
+            #end if
+
+            preptask.execute(worker_pool)
+            copyfiles.finish()
+
+            # Pages link the scripts and stylesheets that were just written.
+            appmaker.set_assets_ready()
+            appmaker.finish()
+        except BaseException as e:
+            toolrunner.cancel(e)
+            appmaker.abort()
+            raise
+        #end try
+
+        for t in remaining:
+            t.execute(worker_pool)
+    #end function
+
+    def _report_optimization(self, output: "Output", opt_level: int,
+            seconds: float) -> None:
+        sizes = {"js": 0, "css": 0, "total": 0}
+
+        for path in output.paths():
+            size = output.size(path) or 0
+            sizes["total"] += size
+
+            for ext in ["js", "css"]:
+                if path.endswith("." + ext):
+                    sizes[ext] += size
+        #end for
+
+        report_file = os.path.join(STATE_DIR, "reports", "optimization.json")
+
+        try:
+            with open(report_file, "r", encoding="utf-8") as f:
+                report = json.load(f)
+        except (OSError, ValueError):
+            report = {}
+
+        # The last build at every level is kept, so that the levels can be
+        # compared with each other.
+        report["O{}".format(opt_level)] = {
+            "seconds": round(seconds, 2),
+            "bytes": sizes
+        }
+
+        os.makedirs(os.path.dirname(report_file), exist_ok=True)
+
+        with open(report_file, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+            f.write("\n")
+
+        for level, entry in sorted(report.items()):
+            LOGGER.info(
+                "{}-{}: {} bytes ({} js, {} css), built in {:.2f}s".format(
+                    "" if level == "O{}".format(opt_level) else "last ",
+                    level,
+                    entry["bytes"]["total"],
+                    entry["bytes"]["js"],
+                    entry["bytes"]["css"],
+                    entry["seconds"]
+                )
+            )
+        #end for
+    #end function
+
+    def _is_selected(self, entry: str, only_spec: "PathSpec") -> bool:
+        if only_spec.match_file(entry):
+            return True
+        if not entry.endswith(".html"):
+            return False
+
+        # A page is also rebuilt when a file of the app behind it matches.
+        srcdir = os.path.dirname(entry)
+
+        if only_spec.match_file(os.path.join(srcdir, "+app.js")):
+            return True
+
+        appdir = os.path.join(srcdir, "+app")
+
+        for dirpath, _, filenames in os.walk("." + appdir):
+            for filename in filenames:
+                if only_spec.match_file(os.path.join(dirpath[1:], filename)):
+                    return True
+            #end for
+        #end for
+
+        return False
+    #end function
+
+    def _read_site_state(self) -> dict[str, Any] | None:
+        if not os.path.isdir("_site"):
+            return None
+
+        try:
+            with open(SITE_STATE_FILE, "r", encoding="utf-8") as f:
+                state = json.load(f)
+            return {
+                key: state[key]
+                    for key in ["static_prefix", "debug", "opt_level"]
+            }
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+    #end function
+
+    def _write_site_state(self, prefix: str, debug: bool,
+            opt_level: int) -> None:
+        os.makedirs(STATE_DIR, exist_ok=True)
+
+        state = {
+            "static_prefix": prefix,
+            "debug": debug,
+            "opt_level": opt_level
+        }
+
+        with open(SITE_STATE_FILE, "w", encoding="utf-8") as f:
+            json.dump(state, f, indent=2)
+            f.write("\n")
+    #end function
+
+    def _write_changed_files(self, changes: dict[str, list[str]]) -> None:
+        os.makedirs(STATE_DIR, exist_ok=True)
+
+        # One line per changed path, prefixed with A(dded), M(odified) or
+        # D(eleted), for deploy tools that only sync what changed.
+        with open(os.path.join(STATE_DIR, "changed-files.txt"), "w",
+                encoding="utf-8") as f:
+            for status, key in [("A", "added"), ("M", "modified"),
+                    ("D", "removed")]:
+                for path in changes[key]:
+                    f.write("{}\t{}\n".format(status, path))
+            #end for
+        #end with
+    #end function
+
+    def _uses_marked(self, script_sources: list[str],
+            shared_dir: str | None = None) -> bool:
+        candidates = self._all_script_sources(script_sources, shared_dir)
+
+        # A call to marked or one of its methods. A reference to marked.js in
+        # a script tag does not count.
+        usage = re.compile(
+            r"\bmarked\s*(?:\(|\.\s*(?!js\b)[A-Za-z_$])"
+        )
+
+        for candidate in candidates:
+            with open(candidate, "r", encoding="utf-8") as f:
+                if usage.search(f.read()):
+                    return True
+        #end for
+
+        return False
+    #end function
+
+    def _make_usage_index(self, script_sources: list[str],
+            config: Config) -> "UsageIndex":
+        from snazzy.usage import UsageIndex
+
+        settings = config.get("prune_css")
+        if not isinstance(settings, dict):
+            settings = {}
+
+        LOGGER.info("indexing names used by pages, templates and scripts")
+
+        index = UsageIndex(settings.get("safelist", []))
+
+        for source in self._all_script_sources(
+                script_sources, config.get("shared_components")):
+            index.add_file(source)
+
+        return index
+    #end function
+
+    def _all_script_sources(self, script_sources: list[str],
+            shared_dir: str | None = None) -> list[str]:
+        # Adds the app scripts and components, which are excluded from the
+        # site by their "+" prefix, to the pages and scripts of the site.
+        candidates = list(script_sources)
+        component_dirs = []
+
+        if shared_dir:
+            component_dirs.append(
+                os.path.normpath(os.sep.join([os.getcwd(), shared_dir]))
+            )
+
+        for source in script_sources:
+            if source.endswith(".html"):
+                candidates.append(
+                    os.path.join(os.path.dirname(source), "+app.js")
+                )
+                component_dirs.append(
+                    os.path.join(os.path.dirname(source), "+app")
+                )
+            #end if
+        #end for
+
+        for component_dir in component_dirs:
+            for dirpath, _, filenames in os.walk(component_dir):
+                candidates += [
+                    os.path.join(dirpath, entry) for entry in filenames
+                        if entry.endswith(".xml")
+                ]
+            #end for
+        #end for
+
+        return [
+            candidate for candidate in candidates
+                if os.path.isfile(candidate)
+        ]
+    #end function
+
+    def _content_prefix(self, opt_level: int, fingerprint: str) -> str:
+        # The prefix only changes along with the sources, the settings or
+        # the toolchain. A rebuild of the same tree keeps the assets below
+        # it, and their inodes, while changed assets still get a new URL.
+        if self._ignore_spec is None:
+            self._ignore_spec = self._make_ignore_spec()
+
+        h = hashlib.sha256(
+            "{}\0{}\0".format(opt_level, fingerprint).encode("utf-8")
+        )
+
+        for dirpath, dirnames, filenames in os.walk("."):
+            relpath = os.path.relpath(dirpath, ".").replace(os.sep, "/")
+            relpath = "" if relpath == "." else relpath + "/"
+            in_app = relpath.startswith("+") or "/+" in relpath
+
+            # Apps live in "+app" folders and "+app.js" files, which the
+            # ignore spec leaves to the app maker, they count as sources.
+            dirnames[:] = sorted(
+                d for d in dirnames
+                    if in_app or d.startswith("+") or
+                        not self._ignore_spec.match_file(relpath + d + "/")
+            )
 
-                if ignore_spec.match_file(full_path[len(basedir):]):
+            for filename in sorted(filenames):
+                path = relpath + filename
+                if not (in_app or filename.startswith("+")) and \
+                        self._ignore_spec.match_file(path):
                     continue
 
-                try:
-                    _, ext = entry.rsplit(".", 1)
-                    if ext in module_by_extension:
-                        module_by_extension[ext] \
-                            .add_object(full_path[len(basedir):])
-                except ValueError:
-                    pass
+                h.update(path.encode("utf-8") + b"\0")
+                with open(os.path.join(dirpath, filename), "rb") as f:
+                    for chunk in iter(lambda: f.read(1 << 16), b""):
+                        h.update(chunk)
+                h.update(b"\0")
             #end for
         #end for
 
-        return [preptask, copyfiles, appmaker]
+        return h.hexdigest()[:8]
     #end function
 
     def _generate_random_string(self, length):
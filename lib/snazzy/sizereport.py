@@ -0,0 +1,181 @@
+# -*- encoding: utf-8 -*-
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2024 Tobias Koch <tobias.koch@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+import gzip
+import json
+import os
+import threading
+
+from typing import Any
+
+PARTS = ["template", "script", "style"]
+
+def measure(raw_size: int, minified: str | None) -> dict[str, int]:
+    minified_bytes = (minified or "").encode("utf-8")
+
+    return {
+        "raw":
+            raw_size,
+        "minified":
+            len(minified_bytes),
+        "gzip":
+            len(gzip.compress(minified_bytes, compresslevel=9, mtime=0))
+                if minified_bytes else 0
+    }
+#end function
+
+class SizeReport:
+
+    def __init__(self):
+        self._apps = []
+        self._lock = threading.Lock()
+
+    def add_app(self, app: str, bundles: dict[str, dict[str, int]],
+            components: list[dict[str, Any]]) -> None:
+        for entry in components:
+            entry["total"] = {
+                key: sum(entry[part][key] for part in PARTS)
+                    for key in ["raw", "minified", "gzip"]
+            }
+        #end for
+
+        components = sorted(
+            components, key=lambda c: c["total"]["gzip"], reverse=True
+        )
+
+        with self._lock:
+            self._apps.append({
+                "app": app,
+                "bundles": bundles,
+                "components": components
+            })
+        #end with
+    #end function
+
+    def write(self, outdir: str) -> tuple[str, str]:
+        os.makedirs(outdir, exist_ok=True)
+
+        apps = sorted(self._apps, key=lambda a: a["app"])
+
+        json_file = os.path.join(outdir, "bundle-sizes.json")
+        text_file = os.path.join(outdir, "bundle-sizes.txt")
+
+        with open(json_file, "w", encoding="utf-8") as f:
+            json.dump({"apps": apps}, f, indent=2)
+            f.write("\n")
+
+        with open(text_file, "w", encoding="utf-8") as f:
+            f.write(self.format_table())
+
+        return json_file, text_file
+    #end function
+
+    def format_table(self) -> str:
+        lines = []
+        row = "{:<32} {:>10} {:>10} {:>10}"
+
+        for app in sorted(self._apps, key=lambda a: a["app"]):
+            lines.append("app {}".format(app["app"]))
+            lines.append("")
+
+            for name, sizes in app["bundles"].items():
+                lines.append(
+                    row.format(name, sizes["raw"], sizes["minified"],
+                        sizes["gzip"])
+                )
+            #end for
+
+            lines.append("")
+            lines.append(row.format("component", "raw", "minified", "gzip"))
+
+            for entry in app["components"]:
+                lines.append(
+                    row.format(entry["name"], entry["total"]["raw"],
+                        entry["total"]["minified"], entry["total"]["gzip"])
+                )
+                for part in PARTS:
+                    sizes = entry[part]
+                    if not sizes["raw"]:
+                        continue
+                    lines.append(
+                        row.format("  " + part, sizes["raw"],
+                            sizes["minified"], sizes["gzip"])
+                    )
+                #end for
+            #end for
+
+            lines.append("")
+        #end for
+
+        return "\n".join(lines)
+    #end function
+
+    def check_budgets(self, budgets: dict[str, dict[str, Any]]) \
+            -> list[str]:
+        violations = []
+
+        for app in self._apps:
+            budget = budgets.get(app["app"], budgets.get("*"))
+            if not budget:
+                continue
+
+            for kind in ["js", "css"]:
+                limit = budget.get(kind)
+                if limit is None:
+                    continue
+
+                for name, sizes in app["bundles"].items():
+                    if not name.endswith("." + kind):
+                        continue
+                    if sizes["gzip"] > limit:
+                        violations.append(
+                            "{}: {} is {} bytes gzipped, budget is {}"
+                            .format(app["app"], name, sizes["gzip"], limit)
+                        )
+                #end for
+            #end for
+
+            per_component = budget.get("components", {})
+
+            for entry in app["components"]:
+                limit = per_component.get(
+                    entry["name"], budget.get("component")
+                )
+                if limit is None:
+                    continue
+
+                if entry["total"]["gzip"] > limit:
+                    violations.append(
+                        "{}: component {} is {} bytes gzipped, budget is {}"
+                        .format(app["app"], entry["name"],
+                            entry["total"]["gzip"], limit)
+                    )
+            #end for
+        #end for
+
+        return violations
+    #end function
+
+#end class
@@ -23,43 +23,116 @@
 # THE SOFTWARE.
 #
 
+import hashlib
+import json
 import os
+import posixpath
 import re
-import shutil
 import subprocess
 
 from multiprocessing.pool import Pool
-from typing import Any
+from typing import TYPE_CHECKING, Any
+from urllib.parse import unquote, urlparse
 
 from lxml import etree
 
+from snazzy.config import Config, STATE_DIR
+from snazzy.css import is_plain_css, minify as minify_css, \
+    optimize as optimize_css, prune as prune_css
+from snazzy.imagehints import DEFAULT_EAGER_IMAGES, ImageHints, \
+    image_sizes
+from snazzy.jobserver import job_slot
+from snazzy.output import Output, SiteDirectory
+from snazzy.toolchain import toolchain_fingerprint
+from snazzy.toolrunner import run_tool
+
+if TYPE_CHECKING:
+    from snazzy.usage import UsageIndex
+
+MARKED_SCRIPT = """\
+const m = require(process.cwd() + "/node_modules/marked");
+const marked = m.marked || m;
+let input = "";
+process.stdin.setEncoding("utf-8");
+process.stdin.on("data", (chunk) => input += chunk);
+process.stdin.on("end", () => {
+    const html = JSON.parse(input).map(
+        (source) => marked.parse ? marked.parse(source) : marked(source)
+    );
+    process.stdout.write(JSON.stringify(html));
+});
+"""
+
+# With differential bundles, every script is also built for browsers that
+# support ES modules, as <name>.module.js next to the legacy build.
+MODULE_SUFFIX = ".module.js"
+
+DEFAULT_MODERN_TARGETS = "defaults and fully supports es6-module"
+
+# -O0 only transpiles, -O1 adds babel's minifier, -O2 adds terser and -O3
+# lets terser work harder and optimizes the CSS.
+DEFAULT_OPT_LEVEL = 2
+
+# Tools whose output depends on nothing but their arguments and stdin. Sass
+# is not among them, it reads imported files.
+CACHEABLE_TOOLS = ["babel", "handlebars", "terser"]
+
+def module_script_name(name: str) -> str:
+    return name[:-len(".js")] + MODULE_SUFFIX
+
 class Task:
 
     def __init__(self, basedir: str, sitedir: str,
-            debug: bool = False, static_prefix: str = ""):
+            debug: bool = False, static_prefix: str = "",
+            config: Config | None = None,
+            output: Output | None = None,
+            opt_level: int = DEFAULT_OPT_LEVEL):
         self._basedir = basedir
         self._sitedir = sitedir
         self._debug   = debug
         self._prefix  = static_prefix
+        self._config  = config or Config()
+        self._output  = output or SiteDirectory(sitedir)
+        self._opt_level = opt_level
         self._objects = []
+        self._usage_index = None
+    #end function
+
+    def __getstate__(self) -> dict[str, Any]:
+        # Pool workers get the entry to work on with every job, sending
+        # them the list of all entries as well makes the IPC cost grow with
+        # the square of the number of files.
+        state = self.__dict__.copy()
+        state["_objects"] = []
+        return state
     #end function
 
     def add_object(self, entry: str) -> None:
         self._objects.append(entry)
 
+    def set_usage_index(self, usage_index: "UsageIndex") -> None:
+        self._usage_index = usage_index
+
     def execute(self, worker_pool: Pool) -> Any:
         raise NotImplementedError(
             "{} has no execute method".format(self.__class__.__name__)
         )
 
-    def _convert_scss(self, srcfile: str, dstfile: str) -> None:
+    def _site_path(self, entry: str) -> str:
+        # Maps a source entry to its path relative to the site root, with
+        # static assets moved below the static prefix.
+        if entry.startswith("/static/"):
+            entry = "/static/" + self._prefix + entry[len("/static"):]
+        return os.path.normpath(entry).strip(os.sep).replace(os.sep, "/")
+    #end function
+
+    def _convert_scss(self, srcfile: str, dstpath: str) -> None:
         with open(srcfile, "r") as f:
             scss = f.read()
 
         css = self._convert_scss_in_memory(scss, [os.path.dirname(srcfile)])
 
-        with open(dstfile, "w") as f:
-            f.write(css)
+        self._output.write(dstpath, self._optimize_css(self._prune_css(css)))
     #end function
 
     def _convert_scss_in_memory(
@@ -70,6 +143,12 @@ class Task:
         scss = scss.replace("##STATIC##",
             os.path.normpath(os.sep.join(["/static", self._prefix])))
 
+        # Sass would only strip whitespace and comments from plain CSS and
+        # shorten selectors, colors and numbers, which is much cheaper than
+        # starting it. Debug builds keep the expanded output of sass.
+        if not self._debug and is_plain_css(scss):
+            return minify_css(scss)
+
         cmd = [
             "node_modules/.bin/sass",
                     "-s", "expanded" if self._debug else "compressed",
@@ -80,57 +159,260 @@ class Task:
             cmd.append("-I")
             cmd.append(path)
 
-        result = subprocess.run(
+        result = self._run_tool(
             cmd, input=scss, stdout=subprocess.PIPE, universal_newlines=True
         )
 
         return result.stdout
     #end function
 
-    def _convert_js(self, srcfile: str, dstfile: str) -> None:
+    def _convert_js(self, srcfile: str, dstpath: str) -> None:
         if self._debug:
-            shutil.copyfile(srcfile, dstfile)
+            self._output.copy(srcfile, dstpath)
             return
 
+        # Other scripts may use the globals of a script under /static, so
+        # there is no module build of it, the legacy build serves all.
         cmd = [
             "./node_modules/.bin/babel",
-                "--minified",
-                    "--no-comments",
-                        "-o", dstfile, srcfile
+                *self._babel_options("legacy"),
+                    srcfile
         ]
 
-        subprocess.run(cmd)
+        result = self._run_tool(
+            cmd, stdout=subprocess.PIPE, universal_newlines=True
+        )
+
+        self._output.write(dstpath, self._obfuscate_js(result.stdout))
     #end function
 
-    def _convert_js_in_memory(self, js: str) -> str:
+    def _convert_js_in_memory(self, js: str, target: str = "legacy") -> str:
         if self._debug:
             return js
 
         cmd = [
             "./node_modules/.bin/babel",
-                "--minified",
-                    "--no-comments",
-                        "--filename", "app.js"
+                *self._babel_options(target),
+                    "--filename", "app.js"
         ]
 
-        result = subprocess.run(
+        result = self._run_tool(
             cmd, input=js, stdout=subprocess.PIPE, universal_newlines=True
         )
 
         return result.stdout
     #end function
 
-    def _obfuscate_js(self, srcfile: str, dstfile: str) -> None:
+    def _script_targets(self) -> dict[str, str | None] | None:
+        settings = self._config.get("differential_bundles")
+        if self._debug or not settings:
+            return None
+        if not isinstance(settings, dict):
+            settings = {}
+
+        # Without explicit legacy targets, the legacy build is the same as
+        # without differential bundles.
+        return {
+            "modern": settings.get("modern", DEFAULT_MODERN_TARGETS),
+            "legacy": settings.get("legacy")
+        }
+    #end function
+
+    def _babel_options(self, target: str) -> list[str]:
+        options = ["--minified", "--no-comments"] \
+            if self._opt_level >= 1 else []
+
+        targets = self._script_targets()
+        if not targets or not targets.get(target):
+            return options
+
+        config_file = self._state_path("babel", "{}.json".format(target))
+        config = json.dumps({
+            "presets": [
+                ["@babel/preset-env", {
+                    "bugfixes": True,
+                    "targets": targets[target]
+                }]
+            ]
+        }, indent=2) + "\n"
+
+        try:
+            with open(config_file, "r", encoding="utf-8") as f:
+                up_to_date = f.read() == config
+        except OSError:
+            up_to_date = False
+
+        # Workers may get here at the same time, the file is replaced
+        # atomically.
+        if not up_to_date:
+            os.makedirs(os.path.dirname(config_file), exist_ok=True)
+            tmp_file = "{}.{}.tmp".format(config_file, os.getpid())
+            with open(tmp_file, "w", encoding="utf-8") as f:
+                f.write(config)
+            os.replace(tmp_file, config_file)
+        #end if
+
+        return options + ["--no-babelrc", "--config-file", config_file]
+    #end function
+
+    def _obfuscate_js(self, js: str, module: bool = False,
+            toplevel: bool = False) -> str:
+        if self._opt_level < 2:
+            return js
+
+        compress_options = []
+
+        if self._opt_level >= 3:
+            compress_options = ["passes=3,pure_getters=true,unsafe=true"]
+
         cmd = [
             "./node_modules/.bin/terser",
-                "--compress",
-                    "--mangle",
-                        "-o", dstfile, srcfile
+                "--compress", *compress_options,
+                    "--mangle"
         ]
 
-        subprocess.run(cmd)
+        # Top-level names of an ES module are not visible to other scripts
+        # and can be mangled, too. The same goes for the app bundle, unless
+        # inline scripts on the page refer to its globals, which is why
+        # that is reserved for -O3.
+        if module:
+            cmd.append("--module")
+        elif toplevel and self._opt_level >= 3:
+            cmd.append("--toplevel")
+
+        result = self._run_tool(
+            cmd, input=js, stdout=subprocess.PIPE, universal_newlines=True
+        )
+
+        return result.stdout
     #end function
 
+    def _prune_css(self, css: str, own_classes: set[str] | None = None) \
+            -> str:
+        if self._debug or self._usage_index is None:
+            return css
+
+        def is_used(kind: str, name: str) -> bool:
+            if kind == "class" and own_classes and name in own_classes:
+                return True
+            return self._usage_index.is_used(kind, name)
+        #end function
+
+        return prune_css(css, is_used)
+    #end function
+
+    def _optimize_css(self, css: str) -> str:
+        if self._debug or self._opt_level < 3:
+            return css
+        return optimize_css(css)
+    #end function
+
+    def _convert_markdown_in_memory(self, sources: list[str]) -> list[str]:
+        cache_dir = self._state_path("cache", "markdown")
+        # Rendered with whatever marked the toolchain provides.
+        version = toolchain_fingerprint(self._basedir)
+
+        results = [None] * len(sources)
+        missing = []
+
+        for i, source in enumerate(sources):
+            cache_file = os.path.join(
+                cache_dir, hashlib.sha256(
+                    "{}\0{}".format(version, source).encode("utf-8")
+                ).hexdigest() + ".html"
+            )
+
+            if os.path.exists(cache_file):
+                with open(cache_file, "r", encoding="utf-8") as f:
+                    results[i] = f.read()
+            else:
+                missing.append((i, cache_file))
+        #end for
+
+        if not missing:
+            return results
+
+        # All sources that are not cached yet are rendered in one go, node
+        # takes longer to start up than marked takes to render.
+        result = self._run_tool(
+            ["node", "-e", MARKED_SCRIPT],
+            input=json.dumps([sources[i] for i, _ in missing]),
+            stdout=subprocess.PIPE,
+            universal_newlines=True
+        )
+
+        os.makedirs(cache_dir, exist_ok=True)
+
+        for (i, cache_file), html in zip(missing, json.loads(result.stdout)):
+            results[i] = html
+
+            tmp_file = "{}.{}.tmp".format(cache_file, os.getpid())
+            with open(tmp_file, "w", encoding="utf-8") as f:
+                f.write(html)
+            os.replace(tmp_file, cache_file)
+        #end for
+
+        return results
+    #end function
+
+    def _state_path(self, *parts: str) -> str:
+        return os.path.join(self._basedir, STATE_DIR, *parts)
+
+    def _run_tool(self, cmd: list[str], **kwargs) \
+            -> subprocess.CompletedProcess:
+        # Raises a ToolError if the tool fails. The output of tools that
+        # see nothing but stdin may be reused by the build daemon.
+        cacheable = os.path.basename(cmd[0]) in CACHEABLE_TOOLS
+
+        with job_slot():
+            return run_tool(cmd, cacheable=cacheable, **kwargs)
+    #end function
+
+    def _add_image_hints(self, fragment: etree.Element,
+            page_dir: str | None = None) -> None:
+        settings = self._config.get("image_hints")
+        if not isinstance(settings, dict):
+            settings = {}
+
+        sizes = image_sizes()
+
+        ImageHints(sizes, settings.get("eager_images", DEFAULT_EAGER_IMAGES))\
+            .apply(fragment, lambda src: self._image_source(src, page_dir))
+
+        sizes.save()
+    #end function
+
+    def _image_source(self, src: str, page_dir: str | None = None) \
+            -> str | None:
+        url = urlparse(src)
+        if url.scheme or url.netloc or "{{" in src:
+            return None
+
+        path = unquote(url.path)
+
+        # Templates end up on different pages, so only their static assets
+        # can be resolved.
+        if not path.startswith("/"):
+            if page_dir is not None:
+                path = posixpath.join(page_dir, path)
+            elif path.startswith("static/"):
+                path = "/" + path
+            else:
+                return None
+        #end if
+
+        path = posixpath.normpath(path)
+
+        static_dir = "/static/{}/".format(self._prefix)
+        if self._prefix and path.startswith(static_dir):
+            path = "/static/" + path[len(static_dir):]
+
+        srcfile = os.path.normpath(self._basedir + path)
+        if not srcfile.startswith(self._basedir + os.sep):
+            return None
+
+        return srcfile
+    #end function
 
     def _apply_static_asset_prefix(self, fragment: etree.Element) -> None:
         if not self._prefix:
@@ -0,0 +1,154 @@
+# -*- encoding: utf-8 -*-
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2024 Tobias Koch <tobias.koch@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+
+# The tools a build depends on, summed up in one fingerprint. "prepare"
+# skips npm when it has not changed, and caches of tool output can use it
+# to tell when the tools changed underneath them.
+
+import hashlib
+import json
+import os
+import subprocess
+
+from typing import Any
+
+from snazzy.config import STATE_DIR
+
+TOOLCHAIN_FILE = os.path.join(STATE_DIR, "toolchain.json")
+
+NPM_MODULES = [
+    "@babel/core",
+    "@babel/cli",
+    "@babel/preset-env",
+    "handlebars",
+    "jquery",
+    "marked",
+    "sass",
+    "terser"
+]
+
+def current_toolchain(basedir: str = ".") -> dict[str, Any]:
+    toolchain = {
+        "node": _node_version(),
+        "package.json": _file_digest(
+            os.path.join(basedir, "package.json")),
+        "package-lock.json": _file_digest(
+            os.path.join(basedir, "package-lock.json")),
+        "modules": {
+            module: _module_version(basedir, module)
+                for module in NPM_MODULES
+        }
+    }
+
+    toolchain["fingerprint"] = hashlib.sha256(
+        json.dumps(toolchain, sort_keys=True).encode("utf-8")
+    ).hexdigest()
+
+    return toolchain
+#end function
+
+def is_complete(toolchain: dict[str, Any]) -> bool:
+    return toolchain["node"] is not None and \
+        toolchain["package.json"] is not None and \
+            None not in toolchain["modules"].values()
+#end function
+
+def recorded_toolchain(basedir: str = ".") -> dict[str, Any] | None:
+    try:
+        with open(os.path.join(basedir, TOOLCHAIN_FILE), "r",
+                encoding="utf-8") as f:
+            toolchain = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    return toolchain if isinstance(toolchain, dict) else None
+#end function
+
+def record_toolchain(toolchain: dict[str, Any], basedir: str = ".") -> None:
+    filename = os.path.join(basedir, TOOLCHAIN_FILE)
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+
+    tmp_file = "{}.{}.tmp".format(filename, os.getpid())
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        json.dump(toolchain, f, indent=2, sort_keys=True)
+        f.write("\n")
+    os.replace(tmp_file, filename)
+#end function
+
+def update_toolchain(basedir: str = ".") -> dict[str, Any]:
+    # Records the toolchain as it is now, if it differs from what was
+    # recorded, e.g. after modules were installed without "prepare".
+    toolchain = current_toolchain(basedir)
+
+    recorded = recorded_toolchain(basedir)
+    if recorded is None or \
+            recorded.get("fingerprint") != toolchain["fingerprint"]:
+        record_toolchain(toolchain, basedir)
+
+    return toolchain
+#end function
+
+def toolchain_fingerprint(basedir: str = ".") -> str:
+    toolchain = recorded_toolchain(basedir)
+    if toolchain is None:
+        return ""
+    return toolchain.get("fingerprint", "")
+#end function
+
+def _node_version() -> str | None:
+    try:
+        result = subprocess.run(
+            ["node", "--version"], stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL, universal_newlines=True
+        )
+    except OSError:
+        return None
+
+    if result.returncode != 0:
+        return None
+
+    return result.stdout.strip()
+#end function
+
+def _module_version(basedir: str, module_name: str) -> str | None:
+    package_json = os.path.join(
+        basedir, "node_modules", module_name, "package.json"
+    )
+
+    try:
+        with open(package_json, "r", encoding="utf-8") as f:
+            return json.load(f).get("version", "")
+    except (OSError, ValueError, AttributeError):
+        return None
+#end function
+
+def _file_digest(filename: str) -> str | None:
+    try:
+        with open(filename, "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except OSError:
+        return None
+#end function
@@ -0,0 +1,221 @@
+# -*- encoding: utf-8 -*-
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2024 Tobias Koch <tobias.koch@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+import hashlib
+import logging
+import os
+import signal
+import subprocess
+import sys
+import threading
+
+from snazzy.error import BuildCancelled, ToolError
+from snazzy.jobserver import release_held_tokens
+
+LOGGER = logging.getLogger(__name__)
+
+# Tool processes started by this process, so that they can be killed when
+# the build is cancelled. The lock is reentrant, the SIGTERM handler may
+# interrupt the thread that holds it.
+_processes = set()
+_processes_lock = threading.RLock()
+
+# Outputs of tools that only read from stdin, shared by the workers of the
+# build daemon. Outside of the daemon, nothing is cached.
+_output_cache = None
+
+MAX_CACHED_OUTPUTS = 20000
+
+# The build daemon passes tool output on to the client through the log.
+_log_tool_output = False
+
+# Build-wide failure state of the main process.
+_state_lock  = threading.Lock()
+_cancelled   = threading.Event()
+_first_error = None
+_keep_going  = False
+_errors      = []
+
+def reset(keep_going: bool = False) -> None:
+    global _first_error, _keep_going, _errors
+
+    with _state_lock:
+        _cancelled.clear()
+        _first_error = None
+        _keep_going  = keep_going
+        _errors      = []
+    #end with
+#end function
+
+def keep_going() -> bool:
+    return _keep_going
+
+def cancel(error: BaseException) -> None:
+    # Marks the build as failed. Work that is waiting on results gives up
+    # and tools that are still running are killed.
+    global _first_error
+
+    with _state_lock:
+        if _first_error is None and not isinstance(error, BuildCancelled):
+            _first_error = error
+        _cancelled.set()
+    #end with
+
+    kill_tools()
+#end function
+
+def cancelled() -> bool:
+    return _cancelled.is_set()
+
+def first_error() -> BaseException | None:
+    return _first_error
+
+def record_error(message: str) -> None:
+    with _state_lock:
+        _errors.append(message)
+
+def errors() -> list[str]:
+    with _state_lock:
+        return list(_errors)
+
+def run_tool(cmd: list[str], input: str | bytes | None = None,
+        cacheable: bool = False, **kwargs) -> subprocess.CompletedProcess:
+    if cancelled():
+        raise BuildCancelled("build cancelled")
+
+    cache_key = None
+
+    if cacheable and _output_cache is not None and input is not None:
+        cache_key = _cache_key(cmd, input, kwargs)
+        cached = _output_cache.get(cache_key)
+
+        if cached is not None:
+            stdout, stderr = cached
+            _forward_tool_output(stderr)
+            return subprocess.CompletedProcess(cmd, 0, stdout, stderr)
+        #end if
+    #end if
+
+    kwargs.setdefault("stderr", subprocess.PIPE)
+
+    if input is not None:
+        kwargs["stdin"] = subprocess.PIPE
+
+    with subprocess.Popen(cmd, **kwargs) as proc:
+        with _processes_lock:
+            _processes.add(proc)
+        try:
+            stdout, stderr = proc.communicate(input)
+        finally:
+            with _processes_lock:
+                _processes.discard(proc)
+        #end try
+    #end with
+
+    if isinstance(stderr, bytes):
+        stderr = stderr.decode("utf-8", errors="replace")
+
+    # A tool that was killed because another job failed is not an error of
+    # its own.
+    if cancelled():
+        raise BuildCancelled("build cancelled")
+
+    if proc.returncode != 0:
+        message = "{} failed with exit code {}".format(
+            os.path.basename(cmd[0]), proc.returncode
+        )
+        if stderr and stderr.strip():
+            message += ":\n" + stderr.strip()
+        raise ToolError(message)
+    #end if
+
+    _forward_tool_output(stderr)
+
+    if cache_key is not None:
+        if len(_output_cache) >= MAX_CACHED_OUTPUTS:
+            _output_cache.clear()
+        _output_cache[cache_key] = (stdout, stderr)
+    #end if
+
+    return subprocess.CompletedProcess(cmd, proc.returncode, stdout, stderr)
+#end function
+
+def set_output_cache(cache) -> None:
+    global _output_cache
+    _output_cache = cache
+
+def log_tool_output(enabled: bool = True) -> None:
+    global _log_tool_output
+    _log_tool_output = enabled
+
+def _forward_tool_output(stderr: str | None) -> None:
+    # Warnings are passed on, as if stderr had not been captured.
+    if not stderr:
+        return
+
+    if _log_tool_output:
+        LOGGER.warning(stderr.rstrip())
+    else:
+        sys.stderr.write(stderr)
+#end function
+
+def _cache_key(cmd: list[str], input: str | bytes, kwargs: dict) -> str:
+    h = hashlib.sha256()
+
+    h.update(repr(cmd).encode("utf-8"))
+    h.update(repr(sorted((k, repr(v)) for k, v in kwargs.items()))
+        .encode("utf-8"))
+    h.update(input.encode("utf-8") if isinstance(input, str) else input)
+
+    return h.hexdigest()
+#end function
+
+def kill_tools() -> None:
+    with _processes_lock:
+        processes = list(_processes)
+
+    for proc in processes:
+        try:
+            proc.kill()
+        except OSError:
+            pass
+    #end for
+#end function
+
+def init_worker() -> None:
+    # A worker may be forked while the build of the parent is marked as
+    # failed, but its own state starts out clean.
+    reset()
+
+    # Pool.terminate sends SIGTERM to the workers, which would otherwise
+    # leave their tools running.
+    signal.signal(signal.SIGTERM, _terminate_worker)
+#end function
+
+def _terminate_worker(signum: int, frame) -> None:
+    kill_tools()
+    release_held_tokens()
+    os._exit(1)
+#end function
@@ -0,0 +1,173 @@
+# -*- encoding: utf-8 -*-
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2024 Tobias Koch <tobias.koch@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+import fnmatch
+import logging
+import re
+
+from lxml import etree
+
+LOGGER = logging.getLogger(__name__)
+
+# Tags that Markdown renders to, whether at build time or by marked in the
+# browser.
+MARKDOWN_TAGS = [
+    "a", "blockquote", "br", "code", "del", "em", "h1", "h2", "h3", "h4",
+    "h5", "h6", "hr", "img", "input", "li", "ol", "p", "pre", "strong",
+    "table", "tbody", "td", "th", "thead", "tr", "ul"
+]
+
+class UsageIndex:
+
+    # Records which classes, ids, tags and attributes pages, component
+    # templates and scripts may put into the document. Scripts are not
+    # parsed, every word in them counts as a possible name.
+
+    def __init__(self, safelist: list[str] | None = None):
+        self._names = {
+            "class": set(), "id": set(), "tag": set(MARKDOWN_TAGS),
+            "attribute": set()
+        }
+        self._words    = set()
+        self._prefixes = set()
+        self._safelist = []
+
+        # Patterns without a leading ".", "#" or "[" refer to classes.
+        for pattern in safelist or []:
+            if pattern[:1] not in [".", "#", "["]:
+                pattern = "." + pattern
+            # Brackets around attribute names are literal, not a set of
+            # characters as in fnmatch.
+            if pattern.startswith("[") and pattern.endswith("]"):
+                pattern = "[[]" + pattern[1:-1] + "[]]"
+            self._safelist.append(pattern)
+        #end for
+    #end function
+
+    def add_file(self, filename: str) -> None:
+        try:
+            if filename.endswith(".html"):
+                with open(filename, "rb") as f:
+                    tree = etree.parse(f, parser=etree.HTMLParser())
+                if tree.getroot() is not None:
+                    self.add_document(tree.getroot())
+            elif filename.endswith(".xml"):
+                self.add_component(etree.parse(filename).getroot())
+            else:
+                with open(filename, "r", encoding="utf-8") as f:
+                    self.add_script(f.read())
+            #end if
+        except (OSError, UnicodeDecodeError, etree.LxmlError) as e:
+            LOGGER.warning(
+                "could not index {}: {}".format(filename, str(e))
+            )
+        #end try
+    #end function
+
+    def add_component(self, root: etree.Element) -> None:
+        template_node = root.find("template")
+        script_node   = root.find("script")
+
+        if template_node is not None:
+            self.add_document(template_node)
+        if script_node is not None:
+            self.add_script(script_node.text or "")
+    #end function
+
+    def add_document(self, root: etree.Element) -> None:
+        for element in root.iter():
+            if not isinstance(element.tag, str):
+                continue
+
+            if element.tag == "script":
+                self.add_script(element.text or "")
+
+            self._names["tag"].add(element.tag.lower())
+
+            for attr_name, value in element.attrib.items():
+                self._names["attribute"].add(attr_name.lower())
+
+                if attr_name == "class":
+                    self._add_names("class", value)
+                elif attr_name == "id":
+                    self._add_names("id", value)
+            #end for
+
+            # Handlebars expressions may emit markup of their own.
+            for text in [element.text, element.tail]:
+                if text and "{{" in text:
+                    self.add_script(text)
+        #end for
+    #end function
+
+    def add_script(self, text: str) -> None:
+        for word in re.findall(r"[A-Za-z_][-\w]*", text):
+            self._words.add(word)
+
+            # Names that are pieced together, as in "btn-" + type.
+            if word.endswith("-"):
+                self._prefixes.add(word)
+        #end for
+    #end function
+
+    def is_used(self, kind: str, name: str) -> bool:
+        if name in self._names[kind] or name in self._words:
+            return True
+
+        if kind in ["class", "id"] and \
+                any(name.startswith(prefix) for prefix in self._prefixes):
+            return True
+
+        token = {
+            "attribute": "[{}]",
+            "class": ".{}",
+            "id": "#{}",
+            "tag": "{}"
+        }[kind].format(name)
+
+        return any(
+            fnmatch.fnmatchcase(token, pattern) for pattern in self._safelist
+        )
+    #end function
+
+    def _add_names(self, kind: str, value: str) -> None:
+        # In templates, parts of a name may be filled in by handlebars, as
+        # in class="btn-{{type}}", which makes the literal part a prefix.
+        value = re.sub(r"\{\{.*?\}\}", "\0", value)
+
+        for token in value.split():
+            pieces = token.split("\0")
+
+            for i, piece in enumerate(pieces):
+                if not piece:
+                    continue
+                self._names[kind].add(piece)
+                if i < len(pieces) - 1:
+                    self._prefixes.add(piece)
+            #end for
+        #end for
+    #end function
+
+#end class
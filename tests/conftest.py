@@ -0,0 +1,129 @@
+# -*- encoding: utf-8 -*-
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2024 Tobias Koch <tobias.koch@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+import os
+import sys
+import textwrap
+
+import pytest
+
+# The tests run against the source tree, like bin/snazzy.
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "lib"
+))
+
+# Stand-ins for the node tools, which are not installed for the tests. They
+# pass their input through, handlebars wraps the template in a script.
+FAKE_TOOLS = {
+    "babel": """\
+        #!/bin/sh
+        for last in "$@"; do :; done
+        if [ -f "$last" ]; then cat "$last"; else cat; fi
+        """,
+    "handlebars": """\
+        #!/bin/sh
+        while [ $# -gt 0 ]; do
+            [ "$1" = "--name" ] && name="$2"
+            shift
+        done
+        printf 'Handlebars.templates["%s"]=%s;\\n' "$name" "$({python} -c \\
+            'import json, sys; print(json.dumps(sys.stdin.read()))')"
+        """,
+    "sass": """\
+        #!/bin/sh
+        cat
+        """,
+    "terser": """\
+        #!/bin/sh
+        cat
+        """,
+}
+
+class Project:
+
+    def __init__(self, basedir: str):
+        self.basedir = basedir
+
+    def write(self, path: str, text: str) -> None:
+        filename = os.path.join(self.basedir, *path.split("/"))
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(filename, "w", encoding="utf-8") as f:
+            f.write(textwrap.dedent(text))
+    #end function
+
+    def read(self, path: str) -> str:
+        with open(os.path.join(self.basedir, *path.split("/")), "r",
+                encoding="utf-8") as f:
+            return f.read()
+    #end function
+
+    def exists(self, path: str) -> bool:
+        return os.path.exists(os.path.join(self.basedir, *path.split("/")))
+
+    def make(self, **options) -> "Project":
+        from snazzy.sitemaker import SiteMaker
+
+        options.setdefault("num_proc", 2)
+        SiteMaker().make(**options)
+        return self
+    #end function
+
+#end class
+
+@pytest.fixture
+def project(tmp_path, monkeypatch) -> Project:
+    # A project as "snazzy prepare" leaves it, with fake tools.
+    try:
+        from tidylib import tidy_document
+        tidy_document("", {})
+    except OSError:
+        pytest.skip("needs libtidy")
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.delenv("MAKEFLAGS", raising=False)
+
+    project = Project(str(tmp_path))
+    project.write("package.json", "{}\n")
+
+    for tool, script in FAKE_TOOLS.items():
+        filename = os.path.join("node_modules", ".bin", tool)
+        project.write(
+            "node_modules/.bin/" + tool,
+            script.replace("{python}", sys.executable)
+        )
+        os.chmod(filename, 0o755)
+    #end for
+
+    for module, script in [
+                ("handlebars", "var Handlebars = {templates: {}};\n"),
+                ("jquery", "var $ = function(html) { return html; };\n"),
+                ("marked", "var marked = {};\n")]:
+        project.write(
+            "node_modules/{0}/dist/{0}.min.js".format(module), script
+        )
+    #end for
+
+    return project
+#end function
@@ -0,0 +1,136 @@
+# -*- encoding: utf-8 -*-
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2024 Tobias Koch <tobias.koch@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+import os
+import shutil
+import subprocess
+
+import pytest
+from lxml import etree
+
+# Runs the scripts of a page like a browser that supports modules.
+RUN_SCRIPTS = """\
+const fs = require("fs");
+const path = require("path");
+const vm = require("vm");
+
+(async () => {
+    for (const [kind, filename] of JSON.parse(process.argv[1])) {
+        if (kind === "module") {
+            await import(filename);
+        } else {
+            vm.runInThisContext(fs.readFileSync(filename, "utf-8"));
+        }
+    }
+    console.log(globalThis.result);
+})().catch(e => { console.error(String(e)); process.exit(1); });
+"""
+
+def modern_scripts(site_dir: str, page: str) -> list[list[str]]:
+    with open(os.path.join(site_dir, page), "rb") as f:
+        root = etree.fromstring(f.read(), parser=etree.HTMLParser())
+
+    scripts = []
+
+    for script in root.iter("script"):
+        if script.get("nomodule") is not None or not script.get("src"):
+            continue
+
+        src = script.get("src")
+        if src.startswith("/"):
+            filename = os.path.join(site_dir, src.lstrip("/"))
+        else:
+            filename = os.path.join(site_dir, os.path.dirname(page), src)
+
+        kind = "module" if script.get("type") == "module" else "classic"
+
+        # Node only treats .mjs files as modules.
+        if kind == "module":
+            shutil.copy(filename, filename + ".mjs")
+            filename += ".mjs"
+
+        scripts.append([kind, os.path.abspath(filename)])
+    #end for
+
+    return scripts
+#end function
+
+@pytest.mark.skipif(shutil.which("node") is None, reason="needs node")
+def test_app_module_sees_shared_classes(project):
+    import json
+
+    project.write("snazzy.json", """\
+        {
+            "shared_components": "shared",
+            "shared_bundle": true,
+            "differential_bundles": true
+        }
+        """)
+    project.write("shared/widget.xml", """\
+        <component name="widget">
+        <template><span>W</span></template>
+        <script><![CDATA[ class Widget { } ]]></script>
+        </component>
+        """)
+    project.write("blog/+app/foo.xml", """\
+        <component name="foo">
+        <dependencies><depends>widget</depends></dependencies>
+        <template><div>Hi</div></template>
+        <script><![CDATA[ class Foo extends Widget { } ]]></script>
+        </component>
+        """)
+    project.write("blog/+app.js", """\
+        globalThis.result = Foo.prototype instanceof Widget && util;
+        """)
+    project.write("blog/index.html", """\
+        <html><head><title>Blog</title></head><body>
+        <script src="/static/ext/js/handlebars.js"></script>
+        <script src="/static/js/util.js"></script>
+        <script src="app.js"></script>
+        </body></html>
+        """)
+    project.write("static/js/util.js", "var util = 'ok';\n")
+    project.make()
+
+    site_dir = os.path.join(project.basedir, "_site")
+    scripts = modern_scripts(site_dir, os.path.join("blog", "index.html"))
+
+    assert [kind for kind, _ in scripts] == \
+        ["classic", "classic", "classic", "module"]
+
+    result = subprocess.run(
+        ["node", "-e", RUN_SCRIPTS, json.dumps(scripts)],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        universal_newlines=True
+    )
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == "ok"
+
+    for dirpath, dirnames, filenames in os.walk(site_dir):
+        for name in filenames:
+            if name.endswith(".module.js"):
+                assert name.startswith("app-")
+    #end for
+#end function
@@ -0,0 +1,87 @@
+# -*- encoding: utf-8 -*-
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2024 Tobias Koch <tobias.koch@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+import time
+
+import pytest
+
+from snazzy import toolrunner
+from snazzy.appmaker import AppMaker
+from snazzy.componentmaker import ComponentMaker
+from snazzy.error import BuildCancelled, ToolError
+from snazzy.output import MemoryOutput
+
+@pytest.fixture(autouse=True)
+def reset_build() -> None:
+    toolrunner.reset()
+    yield
+    toolrunner.reset()
+#end function
+
+def test_abort_waits_for_app_threads() -> None:
+    output = MemoryOutput()
+    maker = AppMaker("/nonexistent", "/nonexistent/_site", output=output)
+    maker.start(None)
+
+    def generate(entry: str) -> None:
+        maker._wait_for_assets()
+        maker._write(entry, "page")
+    #end function
+
+    def generate_late(entry: str) -> None:
+        time.sleep(0.3)
+        maker._write(entry, "page")
+    #end function
+
+    maker._generate = generate
+    maker.submit("a.html")
+    maker._generate = generate_late
+    maker.submit("b.html")
+
+    toolrunner.cancel(RuntimeError("failed"))
+    maker.abort()
+
+    assert all(result.ready() for result in maker._pending)
+    for result in maker._pending:
+        with pytest.raises(BuildCancelled):
+            result.get()
+    assert output.files == {}
+#end function
+
+def test_component_errors_keep_their_type(monkeypatch) -> None:
+    maker = ComponentMaker("/nonexistent", "/nonexistent/_site")
+
+    def fail(srcfile: str) -> None:
+        raise ToolError("sass failed")
+    #end function
+
+    monkeypatch.setattr(maker, "_process_component_xml", fail)
+    with pytest.raises(ToolError):
+        maker.process_component_xml_safety_wrapper("a.xml")
+
+    monkeypatch.setattr(maker, "_process_component_xml", lambda srcfile: {}[1])
+    with pytest.raises(RuntimeError):
+        maker.process_component_xml_safety_wrapper("a.xml")
+#end function
@@ -0,0 +1,106 @@
+# -*- encoding: utf-8 -*-
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2024 Tobias Koch <tobias.koch@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+import os
+import shutil
+import subprocess
+
+import pytest
+
+from snazzy import css
+
+SASS = os.path.join("node_modules", ".bin", "sass")
+
+def test_rebase_urls() -> None:
+    rebased = css.rebase_urls(
+        "a{background:url(../img/a.png)}"
+        "b{src:url( 'b.woff2' ) format('woff2')}"
+        "c{background:url(data:image/png;base64,AA)}"
+        "d{background:url(/d.png),url(https://x.org/d.png)}"
+        "e{fill:url(#e)}"
+        "@import \"f.css\";",
+        "/static/p/css/main.css"
+    )
+
+    assert rebased == \
+        "a{background:url(/static/p/img/a.png)}" \
+        "b{src:url( '/static/p/css/b.woff2' ) format('woff2')}" \
+        "c{background:url(data:image/png;base64,AA)}" \
+        "d{background:url(/d.png),url(https://x.org/d.png)}" \
+        "e{fill:url(#e)}" \
+        "@import \"/static/p/css/f.css\";"
+#end function
+
+PLAIN_CSS = """
+/* Navigation */
+ul.nav > li + li ~ a , li:nth-child(2n + 1) , a[title~="x"] {
+    color : #FFFFFF;
+    background : #AABBCC url( "img/a.5.png" ) ;
+    margin: 0.50px -0.5em 10.0% 0;
+    opacity: 0.0;
+    width: calc(100% - 1.50px);
+    content: "0.50 #ffffff";
+}
+
+@media (min-width: 600px) {
+    .card > .title { color: #123456; line-height: 1.250; }
+    .empty { }
+}
+
+/*! License */
+"""
+
+MINIFIED_CSS = \
+    "ul.nav>li+li~a,li:nth-child(2n + 1),a[title~=\"x\"]{color:#fff;" \
+    "background:#abc url(\"img/a.5.png\");margin:.5px -.5em 10% 0;" \
+    "opacity:0;width:calc(100% - 1.5px);content:\"0.50 #ffffff\"}" \
+    "@media (min-width:600px){.card>.title{color:#123456;" \
+    "line-height:1.25}}/*! License */"
+
+def sass_command() -> list[str] | None:
+    for sass in [SASS, shutil.which("sass")]:
+        if sass and os.path.exists(sass):
+            return [sass]
+    return None
+#end function
+
+def test_minify() -> None:
+    assert css.is_plain_css(PLAIN_CSS)
+    assert css.minify(PLAIN_CSS) == MINIFIED_CSS
+#end function
+
+def test_minify_matches_sass() -> None:
+    cmd = sass_command()
+    if cmd is None:
+        pytest.skip("sass is not installed")
+
+    result = subprocess.run(
+        cmd + ["-s", "compressed", "--no-source-map", "--stdin"],
+            input=PLAIN_CSS, stdout=subprocess.PIPE, universal_newlines=True,
+                check=True
+    )
+
+    assert css.minify(PLAIN_CSS) == result.stdout.strip()
+#end function
@@ -0,0 +1,74 @@
+# -*- encoding: utf-8 -*-
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2024 Tobias Koch <tobias.koch@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+import os
+
+from pathspec import PathSpec
+
+from snazzy.discovery import Discovery
+
+def make_tree(basedir: str, paths: list[str]) -> None:
+    for path in paths:
+        filename = os.path.join(basedir, *path.split("/"))
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(filename, "w", encoding="utf-8") as f:
+            f.write("x")
+    #end for
+
+    # Old enough to be cached.
+    for dirpath, _, _ in os.walk(basedir):
+        os.utime(dirpath, (1000000000, 1000000000))
+#end function
+
+def test_walk_order_and_ignore_rules(tmp_path) -> None:
+    make_tree(str(tmp_path), [
+        "index.html", "b/x.js", "a/z/y.css", "a/b.png", "_site/index.html",
+        "node_modules/m/m.js", "a/.x.swp"
+    ])
+    spec = PathSpec.from_lines("gitignore", ["_*", "/node_modules/", ".*"])
+
+    assert list(Discovery(str(tmp_path), spec)) == [
+        "/index.html", "/a/b.png", "/a/z/y.css", "/b/x.js"
+    ]
+#end function
+
+def test_listings_are_reused_until_a_directory_changes(tmp_path) -> None:
+    make_tree(str(tmp_path), ["index.html", "a/b.png"])
+    spec = PathSpec.from_lines("gitignore", [])
+    listings = {}
+
+    assert list(Discovery(str(tmp_path), spec, listings)) == \
+        ["/index.html", "/a/b.png"]
+    assert sorted(listings) == [str(tmp_path), str(tmp_path / "a")]
+
+    # A stale listing is used as long as the mtime matches.
+    listings[str(tmp_path / "a")][2].append("/a/cached.png")
+    assert list(Discovery(str(tmp_path), spec, listings)) == \
+        ["/index.html", "/a/b.png", "/a/cached.png"]
+
+    (tmp_path / "a" / "c.png").write_text("x")
+    assert list(Discovery(str(tmp_path), spec, listings)) == \
+        ["/index.html", "/a/b.png", "/a/c.png"]
+#end function
@@ -0,0 +1,82 @@
+# -*- encoding: utf-8 -*-
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2024 Tobias Koch <tobias.koch@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+import struct
+
+import pytest
+
+from snazzy.imagehints import image_size
+
+def jpeg(width: int, height: int, orientation: int | None = None,
+        order: str = "<") -> bytes:
+    data = b"\xff\xd8"
+
+    if orientation is not None:
+        tiff = (b"II" if order == "<" else b"MM") + \
+            struct.pack(order + "HI", 42, 8) + \
+            struct.pack(order + "H", 1) + \
+            struct.pack(order + "HHIHH", 0x0112, 3, 1, orientation, 0) + \
+            struct.pack(order + "I", 0)
+        segment = b"Exif\0\0" + tiff
+        data += b"\xff\xe1" + struct.pack(">H", len(segment) + 2) + segment
+    #end if
+
+    sof = struct.pack(">BHHB", 8, height, width, 3) + b"\x01\x22\x00" * 3
+    data += b"\xff\xc0" + struct.pack(">H", len(sof) + 2) + sof
+
+    return data + b"\xff\xd9"
+#end function
+
+def test_png_and_gif() -> None:
+    png = b"\x89PNG\r\n\x1a\n" + struct.pack(">I", 13) + b"IHDR" + \
+        struct.pack(">II", 4, 3) + b"\x08\x06\x00\x00\x00"
+    gif = b"GIF89a" + struct.pack("<HH", 16, 9) + b"\x00" * 3
+
+    assert image_size(png) == (4, 3)
+    assert image_size(gif) == (16, 9)
+#end function
+
+@pytest.mark.parametrize("orientation, order, size", [
+    (None, "<", (40, 30)),
+    (1, "<", (40, 30)),
+    (3, ">", (40, 30)),
+    (6, "<", (30, 40)),
+    (8, ">", (30, 40)),
+])
+def test_jpeg_orientation(orientation, order, size) -> None:
+    assert image_size(jpeg(40, 30, orientation, order)) == size
+
+def test_svg() -> None:
+    assert image_size(b"<svg width=\"20\" height=\"10px\"/>") == (20, 10)
+    assert image_size(b"<svg viewBox=\"0 0 48 24.4\"/>") == (48, 24)
+    assert image_size(b"<svg width=\"50%\" height=\"2em\"/>") is None
+#end function
+
+def test_unreadable_images() -> None:
+    assert image_size(b"") is None
+    assert image_size(b"RIFF\0\0\0\0WEBP") is None
+    assert image_size(jpeg(40, 30, 6)[:30]) is None
+    assert image_size(b"<svg width=\"1\"") is None
+#end function
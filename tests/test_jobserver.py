@@ -0,0 +1,155 @@
+# -*- encoding: utf-8 -*-
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2024 Tobias Koch <tobias.koch@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+import os
+
+import pytest
+
+from snazzy import jobserver
+from snazzy.jobserver import JobServer, job_slot
+
+@pytest.fixture
+def pipe() -> tuple[int, int]:
+    read_fd, write_fd = os.pipe()
+    yield read_fd, write_fd
+    for fd in [read_fd, write_fd]:
+        try:
+            os.close(fd)
+        except OSError:
+            pass
+    #end for
+#end function
+
+@pytest.fixture(autouse=True)
+def no_jobserver() -> None:
+    yield
+    jobserver.install(None)
+#end function
+
+def drain(fd: int) -> bytes:
+    os.set_blocking(fd, False)
+    try:
+        return os.read(fd, 64)
+    except BlockingIOError:
+        return b""
+#end function
+
+def test_fifo_auth(tmp_path) -> None:
+    fifo = str(tmp_path / "jobserver")
+    os.mkfifo(fifo)
+
+    server = JobServer.from_environment(
+        "-j4 --jobserver-auth=fifo:{}".format(fifo)
+    )
+
+    assert server is not None
+    assert server._fifo_path == fifo
+#end function
+
+@pytest.mark.parametrize("flag", ["--jobserver-auth", "--jobserver-fds"])
+def test_pipe_auth(pipe, flag) -> None:
+    makeflags = " -j4 {}={},{}".format(flag, *pipe)
+    server = JobServer.from_environment(makeflags)
+
+    assert server is not None
+    assert server._write_fd == pipe[1]
+#end function
+
+def test_last_auth_wins(pipe) -> None:
+    server = JobServer.from_environment(
+        "--jobserver-auth=fifo:/nonexistent --jobserver-auth={},{}"
+            .format(*pipe)
+    )
+    assert server is not None and server._fifo_path is None
+#end function
+
+@pytest.mark.parametrize("makeflags", [
+    "",
+    "-j4",
+    "--jobserver-auth=fifo:/nonexistent/jobserver",
+    "--jobserver-auth=abc",
+])
+def test_no_jobserver(makeflags) -> None:
+    assert JobServer.from_environment(makeflags) is None
+
+def test_closed_pipe(pipe) -> None:
+    read_fd, write_fd = pipe
+    os.close(read_fd)
+    os.close(write_fd)
+
+    assert JobServer.from_environment(
+        "--jobserver-auth={},{}".format(read_fd, write_fd)
+    ) is None
+#end function
+
+def test_tokens_are_returned(pipe) -> None:
+    read_fd, write_fd = pipe
+    os.write(write_fd, b"ab")
+    server = JobServer(read_fd, write_fd)
+
+    assert server.acquire() is None
+    tokens = sorted([server.acquire(), server.acquire()])
+    assert tokens == [b"a", b"b"]
+
+    for token in tokens + [None]:
+        server.release(token)
+
+    assert sorted(drain(read_fd)) == sorted(b"ab")
+    assert server.acquire() is None
+#end function
+
+def test_job_slot_returns_tokens_on_error(pipe) -> None:
+    read_fd, write_fd = pipe
+    os.write(write_fd, b"+")
+    server = JobServer(read_fd, write_fd)
+    jobserver.install(server)
+
+    # Another job holds the implicit token, the slot needs one from make.
+    assert server.acquire() is None
+
+    with pytest.raises(RuntimeError):
+        with job_slot():
+            assert jobserver._held_tokens == [b"+"]
+            with job_slot():
+                raise RuntimeError()
+    #end with
+
+    assert jobserver._held_tokens == []
+    assert drain(read_fd) == b"+"
+#end function
+
+def test_release_held_tokens(pipe) -> None:
+    read_fd, write_fd = pipe
+    os.write(write_fd, b"+")
+    server = JobServer(read_fd, write_fd)
+    jobserver.install(server)
+
+    server.acquire()
+    jobserver._held_tokens.append(server.acquire())
+    jobserver.release_held_tokens()
+
+    assert jobserver._held_tokens == []
+    assert drain(read_fd) == b"+"
+#end function
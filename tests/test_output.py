@@ -0,0 +1,120 @@
+# -*- encoding: utf-8 -*-
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2024 Tobias Koch <tobias.koch@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+import os
+import tarfile
+import threading
+import zipfile
+
+import pytest
+
+from snazzy.output import ArchiveOutput, MemoryOutput, SiteDirectory, \
+    WriteBuffer
+
+def build(sitedir: str, files: dict[str, str]) -> dict[str, list[str]]:
+    output = SiteDirectory(sitedir)
+    output.begin()
+    for path, data in files.items():
+        output.write(path, data)
+    return output.publish()
+#end function
+
+def test_publish_swaps_symlink_without_renameat2(tmp_path, monkeypatch) \
+        -> None:
+    monkeypatch.setattr(SiteDirectory, "_exchange", lambda *args: False)
+    sitedir = str(tmp_path / "_site")
+
+    build(sitedir, {"a.html": "a", "b.html": "b"})
+    inode = os.stat(os.path.join(sitedir, "a.html")).st_ino
+
+    changes = build(sitedir, {"a.html": "a", "b.html": "c"})
+    assert os.path.islink(sitedir)
+    assert changes["modified"] == ["b.html"]
+    assert os.stat(os.path.join(sitedir, "a.html")).st_ino == inode
+
+    changes = build(sitedir, {"a.html": "a"})
+    assert changes["removed"] == ["b.html"]
+    assert sorted(os.listdir(tmp_path)) == \
+        ["_site", os.path.basename(os.readlink(sitedir))]
+#end function
+
+@pytest.mark.parametrize("suffix", [".zip", ".tar.gz"])
+def test_archive_concurrent_writes(tmp_path, suffix) -> None:
+    filename = str(tmp_path / ("site" + suffix))
+    output = ArchiveOutput(filename)
+    output.begin()
+
+    def write_many(n: int) -> None:
+        for i in range(50):
+            data = "{}-{}".format(n, i) * 100
+            output.write("t{}/f{}.txt".format(n, i), data)
+    #end function
+
+    threads = [threading.Thread(target=write_many, args=(n,))
+        for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    output.publish()
+
+    if suffix == ".zip":
+        with zipfile.ZipFile(filename) as archive:
+            assert archive.testzip() is None
+            members = {name: archive.read(name).decode()
+                for name in archive.namelist()}
+    else:
+        with tarfile.open(filename) as archive:
+            members = {info.name: archive.extractfile(info).read().decode()
+                for info in archive.getmembers()}
+    #end if
+
+    assert len(members) == 400
+    assert members["t3/f7.txt"] == "3-7" * 100
+    assert len(list(output.paths())) == 400
+#end function
+
+def test_mtime_is_passed_through(tmp_path) -> None:
+    srcfile = tmp_path / "img.png"
+    srcfile.write_bytes(b"png")
+    os.utime(srcfile, (1000000000, 1000000000))
+
+    buffer = WriteBuffer()
+    buffer.copy(str(srcfile), "/static/img.png")
+
+    memory = MemoryOutput()
+    filename = str(tmp_path / "site.tar")
+    archive = ArchiveOutput(filename)
+    archive.begin()
+
+    for path, data, mtime in buffer.writes:
+        memory.write(path, data, mtime=mtime)
+        archive.write(path, data, mtime=mtime)
+    archive.publish()
+
+    assert memory.mtimes["static/img.png"] == 1000000000
+    with tarfile.open(filename) as f:
+        assert f.getmember("static/img.png").mtime == 1000000000
+#end function
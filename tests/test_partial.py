@@ -0,0 +1,77 @@
+# -*- encoding: utf-8 -*-
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2024 Tobias Koch <tobias.koch@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+import json
+import os
+
+import pytest
+
+from snazzy.error import SnazzyError
+
+def blog(project) -> None:
+    project.write("blog/index.html", """\
+        <html><head><title>Blog</title></head><body>
+        <script src="app.js"></script>
+        </body></html>
+        """)
+    project.write("blog/+app.js", "var blog = 1;\n")
+#end function
+
+def test_site_state_records_mode(project):
+    blog(project)
+    project.make(debug=True, opt_level=2)
+
+    state = json.loads(project.read("_snazzy/site.json"))
+    assert state == {"static_prefix": "", "debug": True, "opt_level": 2}
+#end function
+
+@pytest.mark.parametrize("options", [
+    {"debug": False, "opt_level": 2},
+    {"debug": True, "opt_level": 1},
+])
+def test_only_refuses_other_mode(project, options):
+    blog(project)
+    project.make(debug=True, opt_level=2)
+
+    with pytest.raises(SnazzyError, match="full build"):
+        project.make(only=["blog/"], **options)
+
+    # The live site is left as it was.
+    assert project.exists("_site/blog/app.js")
+    assert not any(
+        name.startswith("app-")
+            for name in os.listdir(os.path.join(project.basedir, "_site/blog"))
+    )
+#end function
+
+def test_only_in_same_mode(project):
+    blog(project)
+    project.make(debug=True, opt_level=2)
+
+    project.write("blog/+app.js", "var blog = 2;\n")
+    project.make(debug=True, opt_level=2, only=["blog/"])
+
+    assert "blog = 2" in project.read("_site/blog/app.js")
+#end function
@@ -0,0 +1,94 @@
+# -*- encoding: utf-8 -*-
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2024 Tobias Koch <tobias.koch@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+from lxml import etree
+
+from snazzy import css
+from snazzy.usage import UsageIndex
+
+def index(html: str, script: str = "", safelist: list[str] | None = None) \
+        -> UsageIndex:
+    usage_index = UsageIndex(safelist)
+    usage_index.add_document(
+        etree.fromstring(html, parser=etree.HTMLParser())
+    )
+    usage_index.add_script(script)
+    return usage_index
+#end function
+
+def test_unused_rules_are_pruned() -> None:
+    usage_index = index("<div class=\"card\" id=\"main\"><p>x</p></div>")
+
+    pruned = css.prune(
+        ".card p{margin:0}.modal{display:none}#main,#other{color:red}"
+        "aside span{padding:0}",
+        usage_index.is_used
+    )
+
+    assert pruned == ".card p{margin:0}#main{color:red}"
+#end function
+
+def test_at_rules_are_pruned_inside() -> None:
+    usage_index = index("<div class=\"card\"></div>")
+
+    pruned = css.prune(
+        "@media print{.card{color:red}.modal{color:red}}"
+        "@media screen{.modal{color:red}}"
+        "@font-face{font-family:x}",
+        usage_index.is_used
+    )
+
+    assert pruned == "@media print{.card{color:red}}@font-face{font-family:x}"
+#end function
+
+def test_names_from_scripts_and_templates_are_kept() -> None:
+    usage_index = index(
+        "<div class=\"btn-{{type}}\"></div>",
+        "el.classList.add('is-open'); el.className = 'icon-' + name;"
+    )
+
+    for name in ["btn-primary", "is-open", "icon-home"]:
+        assert usage_index.is_used("class", name)
+    assert not usage_index.is_used("class", "hidden")
+#end function
+
+def test_safelist() -> None:
+    usage_index = index(
+        "<div></div>", safelist=["js-*", "#app", "[data-*]"]
+    )
+
+    assert usage_index.is_used("class", "js-toggle")
+    assert usage_index.is_used("id", "app")
+    assert usage_index.is_used("attribute", "data-x")
+    assert not usage_index.is_used("attribute", "d")
+    assert not usage_index.is_used("id", "other")
+#end function
+
+def test_selector_tokens() -> None:
+    assert css.selector_tokens("ul.nav > li:not(.active) a[href^='#']") == [
+        ("attribute", "href"), ("class", "nav"), ("tag", "ul"),
+        ("tag", "li"), ("tag", "a")
+    ]
+#end function
@@ -0,0 +1,96 @@
+# -*- encoding: utf-8 -*-
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2024 Tobias Koch <tobias.koch@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+from multiprocessing.pool import ThreadPool
+
+import pytest
+
+from snazzy import schedule, toolrunner
+from snazzy.schedule import DurationStats, StreamingRun
+
+DURATIONS = {"a.scss": 0.01, "b.scss": 0.3, "c.js": 0.05, "d.js": 0.2}
+
+started = []
+
+def build(item: str) -> str:
+    started.append(item)
+    return item.upper()
+#end function
+
+@pytest.fixture
+def stats(tmp_path, monkeypatch) -> DurationStats:
+    stats = DurationStats(str(tmp_path / "durations.json"))
+    for srcfile, seconds in DURATIONS.items():
+        stats.record(srcfile, seconds)
+
+    monkeypatch.setattr(schedule, "_stats", stats)
+    toolrunner.reset()
+    started.clear()
+
+    return stats
+#end function
+
+def test_streaming_run_sends_window_longest_first(stats) -> None:
+    with ThreadPool(1) as pool:
+        run = StreamingRun(pool, build, lambda item: item, "test")
+        for item in DURATIONS:
+            run.submit(item)
+        results = run.finish()
+    #end with
+
+    assert results == ["A.SCSS", "B.SCSS", "C.JS", "D.JS"]
+    assert started == ["b.scss", "d.js", "c.js", "a.scss"]
+#end function
+
+def test_run_longest_first(stats) -> None:
+    items = list(DURATIONS)
+
+    with ThreadPool(1) as pool:
+        results = schedule.run_longest_first(
+            pool, build, items, items, "test"
+        )
+    #end with
+
+    assert results == ["A.SCSS", "B.SCSS", "C.JS", "D.JS"]
+    assert started == ["b.scss", "d.js", "c.js", "a.scss"]
+    assert stats.estimate("b.scss") < 0.3
+#end function
+
+def test_make_chunks_batches_short_jobs() -> None:
+    estimates = [4.0, 2.0] + [0.01] * 20
+    order = list(range(len(estimates)))
+
+    chunks = schedule._make_chunks(order, estimates, 1)
+
+    assert chunks[0] == [0]
+    assert chunks[1] == [1]
+    assert sum(len(chunk) for chunk in chunks) == len(estimates)
+    assert len(chunks) < len(estimates)
+#end function
+
+def test_lpt_makespan() -> None:
+    assert schedule._lpt_makespan([3.0, 2.0, 2.0, 1.0], 2) == 4.0
+    assert schedule._lpt_makespan([3.0], 4) == 3.0
+#end function
@@ -0,0 +1,67 @@
+# -*- encoding: utf-8 -*-
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2024 Tobias Koch <tobias.koch@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+from lxml import etree
+
+from snazzy.componentmaker import ComponentMaker
+
+def replace_scopes(template: str, css: str) -> tuple[str, str]:
+    maker = ComponentMaker("/nonexistent", "/nonexistent/_site")
+    template_node = etree.fromstring(template)
+
+    scope_classes = maker._replace_scope_attributes(
+        "component", template_node, None
+    )
+
+    return (
+        etree.tostring(template_node, encoding="unicode"),
+        maker._replace_scope_selectors(css, scope_classes)
+    )
+#end function
+
+def test_empty_scope_attribute_becomes_class() -> None:
+    template, css = replace_scopes(
+        "<template><p data-css-scope-x=\"\"/></template>",
+        "[data-css-scope-x]{color:red}"
+    )
+
+    assert "data-css-scope-x" not in template
+    assert "data-css-scope-x" not in css
+
+    scope_class = css[1:css.index("{")]
+    assert "class=\"{}\"".format(scope_class) in template
+#end function
+
+def test_valued_scope_attribute_stays() -> None:
+    template, css = replace_scopes(
+        "<template><p data-css-scope-x=\"a\"/><p data-css-scope-x=\"\"/>"
+        "</template>",
+        "[data-css-scope-x=\"a\"]{color:red}[data-css-scope-x]{margin:0}"
+    )
+
+    assert template.count("data-css-scope-x") == 2
+    assert css == \
+        "[data-css-scope-x=\"a\"]{color:red}[data-css-scope-x]{margin:0}"
+#end function
@@ -0,0 +1,99 @@
+# -*- encoding: utf-8 -*-
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2024 Tobias Koch <tobias.koch@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+# Commands other than "make" must not load the build machinery. Runs every
+# command with -X importtime and checks what was imported and how long the
+# imports took in total.
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+TOPDIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES = ["lxml", "multiprocessing", "pathspec", "tidylib"]
+
+# Milliseconds of import time, generous enough for a loaded CI machine.
+# Loading lxml and tidylib alone takes longer than any of these.
+BUDGETS = {
+    "":          150,
+    "clean":     150,
+    "daemon":    150,
+    "distclean": 150,
+    "make":      150,
+    "new":       150,
+    "prepare":   150,
+}
+
+def import_times(command: str) -> dict[str, int]:
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        filter(None, [os.path.join(TOPDIR, "lib"), env.get("PYTHONPATH")])
+    )
+
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime",
+            os.path.join(TOPDIR, "bin", "snazzy"), *command.split(),
+                "--help"],
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, env=env,
+            universal_newlines=True, check=True
+    )
+
+    times = {}
+
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+
+        self_us, _, module = line[len("import time:"):].split("|")
+        times[module.strip()] = int(self_us)
+    #end for
+
+    return times
+#end function
+
+@pytest.mark.parametrize("command", sorted(BUDGETS))
+def test_command_imports(command: str) -> None:
+    times = import_times(command)
+
+    heavy = [
+        module for module in times
+            if module.split(".")[0] in HEAVY_MODULES
+    ]
+
+    assert heavy == [], "{} imports {}".format(
+        command or "--help", ", ".join(heavy)
+    )
+
+    total_ms = sum(times.values()) / 1000.0
+
+    message = "{} took {:.1f}ms to import, the budget is {}ms".format(
+        command or "--help", total_ms, BUDGETS[command]
+    )
+
+    assert total_ms <= BUDGETS[command], message
+#end function
@@ -0,0 +1,42 @@
+# -*- encoding: utf-8 -*-
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2024 Tobias Koch <tobias.koch@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+from lxml import etree
+
+from snazzy.componentmaker import ComponentMaker
+
+def serialize(template: str) -> str:
+    maker = ComponentMaker("/nonexistent", "/nonexistent/_site")
+    return maker._serialize_template(etree.fromstring(template))
+#end function
+
+def test_leading_text_is_kept() -> None:
+    assert serialize("<template>Hi &amp; {{name}}<p>x</p></template>") == \
+        "Hi &amp; {{name}}<p>x</p>"
+#end function
+
+def test_leading_indentation_is_dropped() -> None:
+    assert serialize("<template>\n  <p>x</p>\n</template>") == "<p>x</p>\n"
+#end function